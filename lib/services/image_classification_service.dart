@@ -73,7 +73,11 @@ class ImageClassificationService {
   List<ClassificationResult> _parseClassLabels() {
     if (_labelsData == null) return [];
     
-    final classes = _labelsData!['classes'] as List;
+    // labels.json is written next to the model at training/conversion time;
+    // keep entries in model output order so index i matches output i.
+    final classes = List<Map<String, dynamic>>.from(_labelsData!['classes'] as List)
+      ..sort((a, b) => (a['id'] as int).compareTo(b['id'] as int));
+    _labelsData!['classes'] = classes;
     return classes.map((classData) => ClassificationResult.fromJson(classData)).toList();
   }
 
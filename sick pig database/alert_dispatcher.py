@@ -0,0 +1,270 @@
+import datetime
+import queue
+import smtplib
+import threading
+import time
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+
+class AlertDispatcher:
+    """
+    Sends disease alert emails from a background thread so /predict never waits on SMTP.
+
+    - Alerts go into a bounded queue; when it is full new alerts are dropped, not blocked on.
+    - One authenticated SMTP connection is kept open and re-established when the server drops it.
+    - Alerts arriving within coalesce_window_seconds of each other go out as one digest email
+      with every detection image attached.
+    - Failed sends are retried with exponential backoff.
+    - The per-disease cooldown lives here and is guarded by a lock, so concurrent request
+      threads cannot both queue an alert for the same disease.
+    - on_send, if given, is called with (seconds, succeeded) after every send attempt (metrics).
+
+    To try it without a real mail account, run a local stand-in server
+    (e.g. `python -m aiosmtpd -n -l localhost:1025`) and create the dispatcher with
+    smtp_server='localhost', smtp_port=1025, use_starttls=False, sender_password=None.
+    """
+
+    def __init__(self, smtp_server, smtp_port, sender_email, sender_password, recipient_emails,
+                 cooldown_seconds=3600, coalesce_window_seconds=30.0, max_queue_size=100,
+                 max_retries=5, retry_backoff_seconds=2.0, use_starttls=True, smtp_timeout_seconds=30,
+                 on_send=None):
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        self.recipient_emails = list(recipient_emails)
+        self.cooldown_seconds = cooldown_seconds
+        self.coalesce_window_seconds = coalesce_window_seconds
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.use_starttls = use_starttls
+        self.smtp_timeout_seconds = smtp_timeout_seconds
+        self.on_send = on_send
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._cooldown_lock = threading.Lock()
+        self.last_alert_times = {} # Stores { 'disease_name': datetime_object, ... }
+        self._smtp = None
+        self._stats_lock = threading.Lock()
+        self._counts = {"queued": 0, "sent_emails": 0, "sent_alerts": 0,
+                        "failed_alerts": 0, "dropped_queue_full": 0, "suppressed_cooldown": 0}
+        self._running = False
+        self._stop = threading.Event() # Set by close(); the worker drains the queue and exits
+        self._worker = None
+
+    # --- Public API ---
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._worker = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+        self._worker.start()
+        return self
+
+    def submit(self, disease, confidence, timestamp, image_data=None):
+        """
+        Queues an alert unless the disease is on cooldown or the queue is full.
+        Returns True if the alert was queued. Never blocks on the network.
+        """
+        current_time = datetime.datetime.now()
+        with self._cooldown_lock:
+            previous_time = self.last_alert_times.get(disease)
+            if previous_time is not None:
+                time_since_last_alert = (current_time - previous_time).total_seconds()
+                if time_since_last_alert <= self.cooldown_seconds:
+                    print(f"Alert for '{disease}' is on cooldown. Last sent {time_since_last_alert:.0f} seconds ago. "
+                          f"Next alert in {self.cooldown_seconds - time_since_last_alert:.0f} seconds.")
+                    self._count("suppressed_cooldown")
+                    return False
+            # Reserve the cooldown slot now; it is rolled back if the email finally fails.
+            self.last_alert_times[disease] = current_time
+
+        alert = {
+            "disease": disease,
+            "confidence": confidence,
+            "timestamp": timestamp,
+            "image_data": image_data,
+            "previous_alert_time": previous_time,
+            "reserved_alert_time": current_time,
+        }
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            self._release_cooldown(alert)
+            print(f"Alert queue is full, dropping alert for '{disease}'.")
+            self._count("dropped_queue_full")
+            return False
+        self._count("queued")
+        return True
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            counts = dict(self._counts)
+        counts["queue_depth"] = self.queue_depth()
+        return counts
+
+    def close(self, timeout=None):
+        """Sends whatever is still queued, then closes the SMTP connection."""
+        if not self._running:
+            return
+        self._running = False
+        self._stop.set()
+        try:
+            # Wakes an idle worker. If the queue is full the worker is busy (e.g. retrying SMTP) and
+            # sees _stop once it has drained the queue, so close() never blocks on a full queue.
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._worker.join(timeout)
+
+    # --- Digest Building ---
+    def build_message(self, alerts):
+        msg = MIMEMultipart()
+        msg['From'] = self.sender_email
+        msg['To'] = ", ".join(self.recipient_emails)
+
+        diseases = sorted({alert["disease"] for alert in alerts})
+        if len(alerts) == 1:
+            msg['Subject'] = f"Pig Health ALERT: {alerts[0]['disease']} (High Confidence)"
+        else:
+            msg['Subject'] = f"Pig Health ALERT: {len(alerts)} detections ({', '.join(diseases)})"
+
+        lines = []
+        for number, alert in enumerate(alerts, start=1):
+            lines.append(f"{number}. A pig has been detected with potential symptoms of '{alert['disease']}'.\n"
+                         f"   Confidence: {alert['confidence']:.2f}%\n"
+                         f"   Time: {alert['timestamp']}")
+        lines.append("Please investigate immediately.")
+        msg.attach(MIMEText("\n\n".join(lines), 'plain'))
+
+        for number, alert in enumerate(alerts, start=1):
+            if alert["image_data"]:
+                name = 'detected_pig_image.jpg' if len(alerts) == 1 else f'detected_pig_image_{number}.jpg'
+                try:
+                    img_part = MIMEImage(alert["image_data"], name=name)
+                except TypeError: # Subtype could not be sniffed from the bytes; camera frames are JPEG
+                    img_part = MIMEImage(alert["image_data"], _subtype='jpeg', name=name)
+                msg.attach(img_part)
+        return msg
+
+    # --- Worker ---
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get_nowait() if self._stop.is_set() else self._queue.get()
+            except queue.Empty:
+                break
+            if first is None:
+                break
+            alerts = [first]
+            # Coalesce everything that arrives within the window into one digest.
+            deadline = time.monotonic() + self.coalesce_window_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    alert = self._queue.get(timeout=remaining) if remaining > 0 and self._running \
+                        else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if alert is None:
+                    stopping = True
+                    continue
+                alerts.append(alert)
+            self._send_with_retry(alerts)
+        self._disconnect()
+
+    def _send_with_retry(self, alerts):
+        msg = self.build_message(alerts)
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                self._ensure_connection()
+                self._smtp.sendmail(self.sender_email, self.recipient_emails, msg.as_string())
+                self._observe_send(start, True)
+                print(f"Email alert sent successfully! ({len(alerts)} alert(s) in digest)")
+                self._count("sent_emails")
+                self._count("sent_alerts", len(alerts))
+                return True
+            except Exception as e:
+                self._observe_send(start, False)
+                print(f"Error sending email (attempt {attempt + 1}/{self.max_retries + 1}): {e}")
+                # The connection may be half-dead after a failure; start fresh on the next try.
+                self._disconnect()
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_backoff_seconds * (2 ** attempt))
+
+        for alert in alerts:
+            self._release_cooldown(alert)
+        self._count("failed_alerts", len(alerts))
+        return False
+
+    def _observe_send(self, start, succeeded):
+        if self.on_send is not None:
+            try:
+                self.on_send(time.perf_counter() - start, succeeded)
+            except Exception as e:
+                print(f"Alert send observer failed: {e}")
+
+    def _ensure_connection(self):
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._disconnect()
+
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.smtp_timeout_seconds)
+        try:
+            if self.use_starttls:
+                server.starttls()
+            if self.sender_password:
+                server.login(self.sender_email, self.sender_password)
+        except Exception:
+            server.close()
+            raise
+        self._smtp = server
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
+
+    def _release_cooldown(self, alert):
+        # Only roll back if no newer alert for this disease has been reserved since.
+        with self._cooldown_lock:
+            if self.last_alert_times.get(alert["disease"]) == alert["reserved_alert_time"]:
+                if alert["previous_alert_time"] is None:
+                    del self.last_alert_times[alert["disease"]]
+                else:
+                    self.last_alert_times[alert["disease"]] = alert["previous_alert_time"]
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._counts[key] += amount
+
+
+# --- Manual check against a local stand-in SMTP server ---
+if __name__ == "__main__":
+    # Start a stand-in first: python -m aiosmtpd -n -l localhost:1025
+    dispatcher = AlertDispatcher('localhost', 1025, 'pigcam@localhost', None, ['farmer@localhost'],
+                                 coalesce_window_seconds=2, max_retries=1, retry_backoff_seconds=0.5,
+                                 use_starttls=False).start()
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    dispatcher.submit('hernia', 91.5, now, image_data=b'\xff\xd8\xff\xd9')
+    dispatcher.submit('cenker', 88.0, now)
+    dispatcher.submit('hernia', 95.0, now) # On cooldown, not queued
+    dispatcher.close()
+    print(dispatcher.stats())
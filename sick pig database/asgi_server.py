@@ -0,0 +1,390 @@
+import asyncio
+import collections
+import io
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import numpy as np
+import inference_server as server
+from prediction_feed import normalize_camera_id
+
+# Production front end for inference_server.py. Run with an ASGI server, one process:
+#   uvicorn asgi_server:app --host 0.0.0.0 --port 5000
+# or `python asgi_server.py`. The event loop only accepts connections and reads uploads;
+# decode and inference run on a fixed-size executor, and /predict requests beyond what that
+# executor can work off are turned away with 503 + Retry-After instead of piling up threads.
+# Every other endpoint is the unchanged Flask app, called through a small WSGI bridge.
+
+# --- Configuration ---
+HOST = os.environ.get('PIGCAM_HOST', '0.0.0.0')
+PORT = int(os.environ.get('PIGCAM_PORT', 5000))
+CPU_COUNT = os.cpu_count() or 1
+# TensorFlow's own thread pools (Keras backend); set before the model loads
+TF_INTRA_OP_THREADS = int(os.environ.get('PIGCAM_TF_INTRA_OP_THREADS', CPU_COUNT))
+TF_INTER_OP_THREADS = int(os.environ.get('PIGCAM_TF_INTER_OP_THREADS', 1))
+
+
+def default_executor_workers():
+    """
+    Threads doing decode + inference. With micro-batching they mostly wait on the batcher, so
+    there are enough of them to fill a batch; with TFLite one per pooled interpreter; plain Keras
+    gets as many as fit next to TF's intra-op threads.
+    """
+    if server.INFERENCE_BACKEND == 'tflite':
+        return server.TFLITE_POOL_SIZE
+    if server.ENABLE_MICRO_BATCHING:
+        return server.MAX_BATCH_SIZE
+    return max(1, CPU_COUNT // TF_INTRA_OP_THREADS)
+
+
+EXECUTOR_WORKERS = int(os.environ.get('PIGCAM_EXECUTOR_WORKERS', 0)) or default_executor_workers()
+# /predict requests admitted at once (running + waiting for a worker); the rest get 503
+MAX_PENDING_REQUESTS = int(os.environ.get('PIGCAM_MAX_PENDING', 0)) or 2 * EXECUTOR_WORKERS
+# A request still waiting after this long is answered 504 and, if it has not reached the model yet,
+# never runs. Clients can ask for less with an X-Deadline-Ms header.
+REQUEST_DEADLINE_MS = float(os.environ.get('PIGCAM_REQUEST_DEADLINE_MS', 2000))
+MAX_UPLOAD_BYTES = int(os.environ.get('PIGCAM_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+WSGI_BRIDGE_THREADS = 16 # Other endpoints; every open /events stream holds one of these
+LATENCY_WINDOW = 1000
+
+
+def configure_tf_threads(intra_op_threads=TF_INTRA_OP_THREADS, inter_op_threads=TF_INTER_OP_THREADS):
+    """Fixes TensorFlow's thread pools so executor threads + TF threads fit the CPU instead of oversubscribing it."""
+    if server.INFERENCE_BACKEND != 'keras':
+        return
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    print(f"TensorFlow threads: {intra_op_threads} intra-op, {inter_op_threads} inter-op.")
+
+
+# --- Admission Control ---
+class AdmissionGate:
+    """
+    Counts /predict requests between admission and the end of their executor job. A slot is
+    only given back when the work is really done (not when the client stopped waiting), so
+    the executor never has more than max_pending frames queued or running.
+    """
+
+    def __init__(self, max_pending, workers):
+        self.max_pending = max_pending
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._service_ms = collections.deque(maxlen=LATENCY_WINDOW)
+        self._queue_wait_ms = collections.deque(maxlen=LATENCY_WINDOW)
+        self._total_ms = collections.deque(maxlen=LATENCY_WINDOW)
+        # deadline_skipped: the frame never reached the model; deadline_timeout: answered 504 while still running
+        self._counts = {"admitted": 0, "rejected_busy": 0, "completed": 0, "errors": 0,
+                        "deadline_skipped": 0, "deadline_timeout": 0}
+
+    def try_acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._counts["rejected_busy"] += 1
+                return False
+            self._pending += 1
+            self._counts["admitted"] += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def retry_after_seconds(self):
+        """Time for the current backlog to drain at the recent service time, rounded up."""
+        with self._lock:
+            mean_service_s = (sum(self._service_ms) / len(self._service_ms) / 1000.0) if self._service_ms else 1.0
+            return max(1, math.ceil(self._pending * mean_service_s / self.workers))
+
+    def count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def record(self, queue_wait_ms, service_ms):
+        with self._lock:
+            self._queue_wait_ms.append(queue_wait_ms)
+            self._service_ms.append(service_ms)
+
+    def record_total(self, total_ms):
+        with self._lock:
+            self._total_ms.append(total_ms)
+
+    def counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            timings = {"queue_wait_ms": list(self._queue_wait_ms), "service_ms": list(self._service_ms),
+                       "total_ms": list(self._total_ms)}
+            counts["pending"] = self._pending
+        counts.update({"max_pending": self.max_pending, "executor_workers": self.workers})
+        for key, values in timings.items():
+            counts[key] = {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+                           "p99": float(np.percentile(values, 99)), "max": float(max(values))} if values else None
+        return counts
+
+
+# --- ASGI Helpers ---
+async def read_body(receive, limit):
+    """Whole request body, or None once it grows past `limit` bytes."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError("Client disconnected during upload")
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+                           + [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def header_dict(scope):
+    # Later duplicates win; nothing /predict reads is sent twice
+    return {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope['headers']}
+
+
+def wsgi_environ(scope, body):
+    """Minimal PEP 3333 environ for one ASGI HTTP request."""
+    server_name, server_port = scope.get('server') or ('localhost', PORT)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin1'), value.decode('latin1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+# --- ASGI Application ---
+class InferenceASGIApp:
+    """
+    /predict is handled here: admission check first (a saturated server answers 503 before
+    reading the upload), then the upload is read on the event loop, and decode + inference run
+    on the fixed executor under a deadline. /server_stats reports admission and timing numbers.
+    Everything else goes to inference_server.app through the WSGI bridge, streamed chunk by
+    chunk so /events keeps working.
+    """
+
+    def __init__(self, flask_app, workers=EXECUTOR_WORKERS, max_pending=MAX_PENDING_REQUESTS,
+                 deadline_ms=REQUEST_DEADLINE_MS, max_upload_bytes=MAX_UPLOAD_BYTES):
+        self.flask_app = flask_app
+        self.deadline_ms = deadline_ms
+        self.max_upload_bytes = max_upload_bytes
+        self.gate = AdmissionGate(max_pending, workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        self.bridge_executor = ThreadPoolExecutor(max_workers=WSGI_BRIDGE_THREADS, thread_name_prefix='wsgi-bridge')
+        # Admission numbers next to the server's own on /metrics
+        server.metrics_registry.counter_callback('pigcam_asgi_requests_total', "/predict admission outcomes (ASGI mode)",
+                                                 self.gate.counts, ('outcome',))
+        server.metrics_registry.gauge_callback('pigcam_asgi_pending_requests', "/predict requests admitted and unfinished",
+                                               self.gate.pending)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            if scope['path'] == '/predict' and scope['method'] == 'POST':
+                await self.predict(scope, receive, send)
+            elif scope['path'] == '/server_stats' and scope['method'] == 'GET':
+                await send_json(send, 200, self.gate.stats())
+            else:
+                await self.call_wsgi(scope, receive, send)
+
+    # --- Startup / Shutdown ---
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, self.startup)
+                except BaseException as e: # load_model_and_classes exits on failure
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if server.stream_ingest is not None:
+                    server.stream_ingest.close()
+                self.executor.shutdown(wait=True)
+                server.alert_dispatcher.close()
+                if server.prediction_store is not None:
+                    server.prediction_store.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def startup(self):
+        configure_tf_threads()
+        server.load_model_and_classes() # Loads, warms up, then the port starts taking frames
+        server.alert_dispatcher.start()
+        if server.prediction_store is not None:
+            server.prediction_store.start()
+        server.start_stream_ingest()
+        print(f"ASGI mode: {self.gate.workers} inference workers, up to {self.gate.max_pending} pending "
+              f"/predict requests, {self.deadline_ms:.0f} ms deadline.")
+
+    # --- /predict ---
+    async def predict(self, scope, receive, send):
+        arrival = time.monotonic()
+        if not self.gate.try_acquire():
+            await send_json(send, 503, {"error": "Server busy, retry later"},
+                            headers=[('Retry-After', str(self.gate.retry_after_seconds()))])
+            return
+
+        handed_over = False # Once the executor has the job, its completion releases the slot
+        try:
+            headers = header_dict(scope)
+            query = parse_qs(scope['query_string'].decode('latin1'))
+            try:
+                deadline_ms = min(float(headers.get('x-deadline-ms', self.deadline_ms)), self.deadline_ms)
+                camera_id = normalize_camera_id(headers.get('x-camera-id') or query.get('camera_id', [None])[0])
+            except ValueError as e:
+                await send_json(send, 400, {"error": str(e)})
+                return
+            deadline = arrival + deadline_ms / 1000.0
+
+            img_bytes = await read_body(receive, self.max_upload_bytes)
+            if img_bytes is None:
+                await send_json(send, 413, {"error": f"Upload larger than {self.max_upload_bytes} bytes"})
+                return
+            if not img_bytes:
+                await send_json(send, 400, {"error": "No image data provided in request body"})
+                return
+            bypass_cache = 'no-cache' in headers.get('cache-control', '') or query.get('nocache', [''])[0] == '1'
+
+            job = self.executor.submit(self.run_frame, img_bytes, camera_id, bypass_cache, arrival, deadline)
+            job.add_done_callback(lambda _: self.gate.release())
+            handed_over = True
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(job), timeout=max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                self.gate.count("deadline_timeout")
+                await send_json(send, 504, {"error": f"No result within {deadline_ms:.0f} ms"})
+                return
+            except server.DeadlineExceeded as e:
+                self.gate.count("deadline_skipped")
+                await send_json(send, 504, {"error": str(e)})
+                return
+            except Exception as e:
+                self.gate.count("errors")
+                print(f"Error during prediction or processing: {e}")
+                await send_json(send, 500, {"error": str(e)})
+                return
+            self.gate.count("completed")
+            self.gate.record_total((time.monotonic() - arrival) * 1000.0)
+            await send_json(send, 200, result)
+        except ConnectionError:
+            pass # Client went away mid-upload; nothing to answer
+        finally:
+            if not handed_over:
+                self.gate.release()
+
+    def run_frame(self, img_bytes, camera_id, bypass_cache, arrival, deadline):
+        """Executor job: skips frames that already missed their deadline while queued."""
+        started = time.monotonic()
+        if started > deadline:
+            raise server.DeadlineExceeded("Request deadline passed while queued")
+        result = server.process_frame(img_bytes, camera_id, bypass_cache=bypass_cache,
+                                      request_start=time.perf_counter() - (started - arrival), deadline=deadline)
+        self.gate.record((started - arrival) * 1000.0, (time.monotonic() - started) * 1000.0)
+        return result
+
+    # --- Everything else: the Flask app through a WSGI bridge ---
+    async def call_wsgi(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        try:
+            body = await read_body(receive, self.max_upload_bytes)
+        except ConnectionError:
+            return # Client went away mid-upload; nothing to answer (same as /predict)
+        if body is None:
+            await send_json(send, 413, {"error": f"Body larger than {self.max_upload_bytes} bytes"})
+            return
+        environ = wsgi_environ(scope, body)
+        response_start = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response_start['status'] = int(status.split(' ', 1)[0])
+            response_start['headers'] = [(name.lower().encode('latin1'), value.encode('latin1'))
+                                         for name, value in response_headers]
+
+        def begin():
+            result = self.flask_app(environ, start_response)
+            return result, iter(result)
+
+        result, chunks = await loop.run_in_executor(self.bridge_executor, begin)
+        # Streams (/events) only end when the client leaves; the SSE heartbeat makes the loop re-check
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            chunk = await loop.run_in_executor(self.bridge_executor, next, chunks, None)
+            await send({'type': 'http.response.start', 'status': response_start['status'],
+                        'headers': response_start['headers']})
+            while chunk is not None and not disconnected.done():
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(self.bridge_executor, next, chunks, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.bridge_executor, result.close)
+
+
+app = InferenceASGIApp(server.app)
+
+# --- Main Execution ---
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        print("ASGI mode needs an ASGI server: pip install uvicorn (or run `python inference_server.py` for the Flask dev server).")
+        sys.exit(1)
+    print("\n--- Starting ASGI Server ---")
+    # One process: models, caches and the per-camera state live in memory
+    uvicorn.run(app, host=HOST, port=PORT, workers=1, log_level='warning')
@@ -0,0 +1,336 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+# --- Configuration ---
+DATASET_ROOT_PATH = 'C:/Users/Alfred/Desktop/sick pig database'
+DATA_SUBFOLDER = 'category'
+IMAGE_SIZE = (224, 224)
+
+# Models to benchmark; missing files are skipped with a note
+MODELS = {
+    'keras': 'pig_disease_detector_model.h5',
+    'tflite-float': 'pig_detector_float.tflite',
+    'tflite-dynamic': 'quantized_pig_detector.tflite',
+    'tflite-int8': 'quantized_pig_detector_int8.tflite',
+}
+BATCH_SIZES = (1, 4, 16, 32)
+NUM_IMAGES = 64 # Real images sampled from category/ (fixed seed), kept in memory as encoded bytes
+ITERATIONS = 20 # Timed batches per (backend, threads, batch size)
+WARMUP_ITERATIONS = 3
+REGRESSION_THRESHOLD = 0.10 # --compare: flag p50 latency or throughput changes worse than 10%
+
+# HTTP load generator defaults
+HTTP_URL = 'http://localhost:5000/predict'
+HTTP_CLIENTS = 8
+HTTP_REQUESTS = 200
+
+
+# --- Shared Helpers ---
+def default_thread_counts():
+    cpus = os.cpu_count() or 1
+    counts, n = [], 1
+    while n < cpus:
+        counts.append(n)
+        n *= 2
+    return counts + [cpus]
+
+
+def sample_images(data_dir, num_images, seed=0):
+    """Encoded bytes of a fixed random sample of dataset images (all formats, as on disk)."""
+    from predict_pig_disease import collect_image_files
+    files = collect_image_files([data_dir])
+    random.Random(seed).shuffle(files)
+    images = []
+    for path in files[:num_images]:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024 # bytes on macOS, KiB on Linux
+    except ImportError: # Windows
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+        except (ImportError, AttributeError):
+            return None
+
+
+def percentiles(values_ms):
+    values = np.asarray(values_ms)
+    return {"mean": float(values.mean()), "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)), "p99": float(np.percentile(values, 99))}
+
+
+# --- 1. In-Process Measurement (one backend, one thread count) ---
+def run_worker(backend_name, model_path, threads, batch_sizes, images, iterations, warmup):
+    """
+    Runs in a fresh process per (backend, threads): TensorFlow's thread pools can only be
+    sized before it initializes, and peak RSS and load time are only meaningful from a clean start.
+    """
+    from image_pipeline import decode_frame, to_model_input
+    from inference_backends import KerasBackend, TFLiteBackend, _load_interpreter_class
+
+    # Runtime import measured separately: TFLite models use tflite_runtime when it is installed
+    start = time.perf_counter()
+    if backend_name == 'keras':
+        import tensorflow as tf
+    else:
+        _load_interpreter_class()
+    import_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if backend_name == 'keras':
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+        backend = KerasBackend(model_path)
+    else:
+        backend = TFLiteBackend(model_path, pool_size=1, num_threads=threads)
+    load_seconds = time.perf_counter() - start
+
+    def preprocess(img_bytes):
+        return to_model_input(decode_frame(img_bytes, target_size=IMAGE_SIZE), IMAGE_SIZE)
+
+    results = []
+    for batch_size in batch_sizes:
+        preprocess_ms, inference_ms, latency_ms = [], [], []
+        for iteration in range(warmup + iterations):
+            offset = (iteration * batch_size) % len(images)
+            batch_bytes = [images[(offset + i) % len(images)] for i in range(batch_size)]
+
+            t0 = time.perf_counter()
+            batch = np.stack([preprocess(img_bytes) for img_bytes in batch_bytes])
+            t1 = time.perf_counter()
+            backend.predict_batch(batch)
+            t2 = time.perf_counter()
+            if iteration < warmup:
+                continue
+            preprocess_ms.append((t1 - t0) * 1000.0 / batch_size)
+            inference_ms.append((t2 - t1) * 1000.0)
+            latency_ms.append((t2 - t0) * 1000.0)
+
+        results.append({
+            "backend": backend_name,
+            "threads": threads,
+            "batch_size": batch_size,
+            "preprocess_ms_per_image": percentiles(preprocess_ms),
+            "inference_ms_per_batch": percentiles(inference_ms),
+            "latency_ms": percentiles(latency_ms),
+            "throughput_images_per_s": batch_size * len(latency_ms) / (sum(latency_ms) / 1000.0),
+        })
+
+    for result in results:
+        result.update({"runtime_import_s": import_seconds, "model_load_s": load_seconds, "peak_rss_mb": peak_rss_mb(),
+                       "model_size_mb": os.path.getsize(model_path) / (1024 * 1024)})
+    return results
+
+
+def run_suite(data_dir, models, thread_counts, batch_sizes, num_images, iterations, warmup):
+    """Starts one worker process per (backend, thread count) and collects their results."""
+    results = []
+    for backend_name, model_path in models.items():
+        if not os.path.exists(model_path):
+            print(f"Skipping {backend_name}: '{model_path}' not found.")
+            continue
+        for threads in thread_counts:
+            print(f"Benchmarking {backend_name} with {threads} thread(s)...")
+            command = [sys.executable, os.path.abspath(__file__), '--worker', backend_name, model_path,
+                       '--threads', str(threads), '--data-dir', data_dir, '--images', str(num_images),
+                       '--iterations', str(iterations), '--warmup', str(warmup),
+                       '--batch-sizes', ','.join(str(size) for size in batch_sizes)]
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"  Worker failed:\n{completed.stderr[-2000:]}")
+                continue
+            # The worker prints its JSON as the last line; TensorFlow may log before it
+            worker_results = json.loads(completed.stdout.strip().splitlines()[-1])
+            for result in worker_results:
+                rss = f"{result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else "n/a"
+                print(f"  batch {result['batch_size']:>2}: p50 {result['latency_ms']['p50']:8.1f} ms, "
+                      f"p99 {result['latency_ms']['p99']:8.1f} ms, "
+                      f"{result['throughput_images_per_s']:7.1f} img/s, peak RSS {rss}")
+            results.extend(worker_results)
+    return results
+
+
+def environment_info(num_images):
+    info = {"timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'), "platform": platform.platform(),
+            "processor": platform.processor(), "cpu_count": os.cpu_count(),
+            "python": platform.python_version(), "images": num_images}
+    try:
+        from importlib.metadata import version
+        for package in ('tensorflow', 'tensorflow-cpu', 'tflite-runtime', 'numpy', 'pillow'):
+            try:
+                info[package] = version(package)
+            except Exception:
+                pass
+    except ImportError:
+        pass
+    return info
+
+
+# --- 2. Regression Comparison ---
+def compare_to_baseline(results, baseline_results, threshold=REGRESSION_THRESHOLD):
+    """
+    Matches results by (backend, threads, batch size) and flags p50 latency increases or
+    throughput drops larger than threshold. Returns the list of regressions.
+    """
+    def key(result):
+        return result["backend"], result["threads"], result["batch_size"]
+
+    baseline = {key(result): result for result in baseline_results}
+    regressions = []
+    print(f"\n--- Comparison with baseline (threshold {threshold * 100:.0f}%) ---")
+    print(f"{'backend':<16}{'threads':>8}{'batch':>6}{'p50 ms':>10}{'change':>9}{'img/s':>9}{'change':>9}")
+    for result in results:
+        old = baseline.get(key(result))
+        if old is None:
+            continue
+        latency_change = result["latency_ms"]["p50"] / old["latency_ms"]["p50"] - 1.0
+        throughput_change = result["throughput_images_per_s"] / old["throughput_images_per_s"] - 1.0
+        regressed = latency_change > threshold or throughput_change < -threshold
+        print(f"{result['backend']:<16}{result['threads']:>8}{result['batch_size']:>6}"
+              f"{result['latency_ms']['p50']:>10.1f}{latency_change * 100:>+8.1f}%"
+              f"{result['throughput_images_per_s']:>9.1f}{throughput_change * 100:>+8.1f}%"
+              f"{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append({"backend": result["backend"], "threads": result["threads"],
+                                "batch_size": result["batch_size"], "latency_change": latency_change,
+                                "throughput_change": throughput_change})
+    return regressions
+
+
+# --- 3. HTTP Load Generator ---
+def run_http_load(url, images, clients, total_requests, timeout=30.0):
+    """
+    Drives POST /predict with `clients` concurrent connections until total_requests have been
+    sent, cycling through the real images. Each client sends as its own camera.
+    """
+    latencies_ms, statuses = [], {}
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def client(client_index):
+        while True:
+            with lock:
+                request_index = next(counter, None)
+            if request_index is None:
+                return
+            body = images[request_index % len(images)]
+            request = urllib.request.Request(url, data=body, method='POST',
+                                             headers={'Content-Type': 'application/octet-stream',
+                                                      'X-Camera-Id': f"bench-{client_index}"})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except Exception as e:
+                status = type(e).__name__
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies_ms.append(elapsed_ms)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(index,), daemon=True) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - start
+
+    result = {"url": url, "clients": clients, "requests": total_requests, "wall_s": wall_seconds,
+              "statuses": {str(status): count for status, count in statuses.items()},
+              "throughput_requests_per_s": len(latencies_ms) / wall_seconds}
+    if latencies_ms:
+        result["latency_ms"] = percentiles(latencies_ms)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pig disease model inference.")
+    parser.add_argument('--data-dir', default=os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER))
+    parser.add_argument('--images', type=int, default=NUM_IMAGES)
+    parser.add_argument('--backends', default=','.join(MODELS), help="Comma-separated subset of: " + ', '.join(MODELS))
+    parser.add_argument('--threads', default=None, help="Comma-separated thread counts (default: 1, 2, 4, ... CPU count)")
+    parser.add_argument('--batch-sizes', default=','.join(str(size) for size in BATCH_SIZES))
+    parser.add_argument('--iterations', type=int, default=ITERATIONS)
+    parser.add_argument('--warmup', type=int, default=WARMUP_ITERATIONS)
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON results file")
+    parser.add_argument('--compare', default=None, help="Baseline JSON to compare against; exits 1 on regression")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--http', nargs='?', const=HTTP_URL, default=None,
+                        help="Load-test a running server instead (default URL: %(const)s)")
+    parser.add_argument('--clients', type=int, default=HTTP_CLIENTS)
+    parser.add_argument('--requests', type=int, default=HTTP_REQUESTS)
+    parser.add_argument('--worker', nargs=2, metavar=('BACKEND', 'MODEL_PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    images = sample_images(args.data_dir, args.images)
+
+    if args.worker:
+        # Child process of run_suite: print the results as one JSON line
+        results = run_worker(args.worker[0], args.worker[1], int(args.threads), batch_sizes, images,
+                             args.iterations, args.warmup)
+        print(json.dumps(results))
+        return
+
+    if not images:
+        print(f"Error: no images found in '{args.data_dir}'.")
+        exit()
+
+    report = {"environment": environment_info(len(images))}
+    if args.http:
+        print(f"--- HTTP load test: {args.requests} requests, {args.clients} clients -> {args.http} ---")
+        report["http"] = run_http_load(args.http, images, args.clients, args.requests)
+        print(json.dumps(report["http"], indent=2))
+    else:
+        thread_counts = [int(n) for n in args.threads.split(',')] if args.threads else default_thread_counts()
+        models = {name: MODELS[name] for name in args.backends.split(',')}
+        report["results"] = run_suite(args.data_dir, models, thread_counts, batch_sizes,
+                                      args.images, args.iterations, args.warmup)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if args.http:
+            old, new = baseline.get("http", {}), report["http"]
+            print(f"Throughput: {old.get('throughput_requests_per_s', 0):.1f} -> {new['throughput_requests_per_s']:.1f} req/s")
+            regressions = []
+            if old.get("throughput_requests_per_s") and \
+                    new["throughput_requests_per_s"] < old["throughput_requests_per_s"] * (1 - args.threshold):
+                regressions.append("http throughput")
+        else:
+            regressions = compare_to_baseline(report["results"], baseline.get("results", []), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against '{args.compare}'.")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
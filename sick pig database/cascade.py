@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from image_pipeline import decode_frame, to_model_input
+
+# --- Configuration ---
+DATASET_ROOT_PATH = 'C:/Users/Alfred/Desktop/sick pig database'
+DATA_SUBFOLDER = 'category'
+MODEL_PATH = 'pig_disease_detector_model.h5' # Full 8-class model (stage two)
+LABELS_PATH = 'labels.json'
+STAGE_ONE_MODEL_PATH = 'pig_healthy_prefilter_model.h5' # Written by train_pig_detector.py --stage-one
+STAGE_ONE_IMAGE_SIZE = (96, 96)
+STAGE_ONE_ALPHA = 0.35 # MobileNetV2 width multiplier of the stage-one model
+# Output order of the stage-one model (it shares labels.json's folder with the full model,
+# so its two classes are fixed here rather than stored there)
+STAGE_ONE_CLASSES = ('Healthy', 'Not healthy')
+HEALTHY_CLASS = 'Healthy'
+IMAGE_SIZE = (224, 224)
+VALIDATION_SPLIT = 0.2
+
+# A frame stops after stage one only when the stage-one model gives Healthy at least this probability
+CASCADE_MARGIN = 0.9
+REPORT_MARGINS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.97, 0.99)
+
+
+def load_model_backend(model_path, tflite_pool_size=4, tflite_num_threads=1):
+    """Model file as a backend: .tflite files use the interpreter pool, anything else Keras."""
+    from inference_backends import KerasBackend, TFLiteBackend
+    if model_path.lower().endswith('.tflite'):
+        return TFLiteBackend(model_path, pool_size=tflite_pool_size, num_threads=tflite_num_threads)
+    return KerasBackend(model_path)
+
+
+class CascadeClassifier:
+    """
+    Two-stage classifier. Stage one is a small low-resolution healthy/not-healthy model; when it
+    is at least `margin` sure a frame is Healthy, the frame is answered right there. Everything
+    else goes to the full classifier (full_predict_fn, which takes a (224, 224, 3) [0, 1] image
+    and returns the class probability vector, e.g. the server's micro-batched predict).
+
+    For frames answered by stage one, the returned probability vector puts stage one's healthy
+    probability on the Healthy class and spreads the rest evenly over the other classes.
+    """
+
+    def __init__(self, stage_one_backend, full_predict_fn, class_names, margin=CASCADE_MARGIN,
+                 stage_one_size=STAGE_ONE_IMAGE_SIZE, full_size=IMAGE_SIZE):
+        if HEALTHY_CLASS not in class_names:
+            raise ValueError(f"Cascade mode needs a '{HEALTHY_CLASS}' class; the model has {class_names}.")
+        self.stage_one = stage_one_backend
+        self.full_predict_fn = full_predict_fn
+        self.class_names = list(class_names)
+        self.healthy_index = self.class_names.index(HEALTHY_CLASS)
+        self.margin = margin
+        self.stage_one_size = tuple(stage_one_size)
+        self.full_size = tuple(full_size)
+        self._lock = threading.Lock()
+        self._frames = 0
+        self._stage_one_exits = 0
+        self._stage_one_seconds = 0.0
+        self._stage_two_seconds = 0.0
+
+    def set_class_names(self, class_names):
+        """Follows a model swap to a version whose labels differ."""
+        if HEALTHY_CLASS not in class_names:
+            raise ValueError(f"Cascade mode needs a '{HEALTHY_CLASS}' class; the model has {class_names}.")
+        self.class_names = list(class_names)
+        self.healthy_index = self.class_names.index(HEALTHY_CLASS)
+
+    def healthy_probability(self, frame):
+        return float(self.stage_one.predict(to_model_input(frame, self.stage_one_size))[0])
+
+    def predict(self, frame, full_predict_fn=None):
+        """
+        Takes a decoded RGB frame; returns (probabilities, stage) with stage 1 or 2.
+        full_predict_fn overrides the stage-two model for this one call (e.g. a leased model version).
+        """
+        start = time.perf_counter()
+        p_healthy = self.healthy_probability(frame)
+        stage_one_done = time.perf_counter()
+
+        if p_healthy >= self.margin:
+            probabilities = np.full(len(self.class_names), (1.0 - p_healthy) / max(len(self.class_names) - 1, 1),
+                                    dtype=np.float32)
+            probabilities[self.healthy_index] = p_healthy
+            stage = 1
+        else:
+            probabilities = (full_predict_fn or self.full_predict_fn)(to_model_input(frame, self.full_size))
+            stage = 2
+        end = time.perf_counter()
+
+        with self._lock:
+            self._frames += 1
+            self._stage_one_seconds += stage_one_done - start
+            if stage == 1:
+                self._stage_one_exits += 1
+            else:
+                self._stage_two_seconds += end - stage_one_done
+        return probabilities, stage
+
+    def stats(self):
+        with self._lock:
+            frames = self._frames
+            stage_two_runs = frames - self._stage_one_exits
+            return {
+                "margin": self.margin,
+                "frames": frames,
+                "stage_one_exits": self._stage_one_exits,
+                "stage_two_runs": stage_two_runs,
+                "exit_rate": self._stage_one_exits / frames if frames else 0.0,
+                "avg_stage_one_ms": self._stage_one_seconds * 1000.0 / frames if frames else 0.0,
+                "avg_stage_two_ms": self._stage_two_seconds * 1000.0 / stage_two_runs if stage_two_runs else 0.0,
+                "avg_cost_per_frame_ms": (self._stage_one_seconds + self._stage_two_seconds) * 1000.0 / frames
+                                         if frames else 0.0,
+            }
+
+
+# --- Cascade Report: recall and cost per margin on the held-out split ---
+def score_images(paths, stage_one, full_backend, stage_one_size=STAGE_ONE_IMAGE_SIZE, full_size=IMAGE_SIZE):
+    """Runs both stages on every image; returns (p_healthy, full_predictions, stage-one ms, stage-two ms)."""
+    p_healthy, full_predictions = [], []
+    stage_one_ms, stage_two_ms = [], []
+    for path in paths:
+        with open(path, 'rb') as f:
+            frame = decode_frame(f.read(), target_size=full_size)
+        start = time.perf_counter()
+        p_healthy.append(float(stage_one.predict(to_model_input(frame, stage_one_size))[0]))
+        middle = time.perf_counter()
+        full_predictions.append(int(np.argmax(full_backend.predict(to_model_input(frame, full_size)))))
+        end = time.perf_counter()
+        stage_one_ms.append((middle - start) * 1000.0)
+        stage_two_ms.append((end - middle) * 1000.0)
+    return np.array(p_healthy), np.array(full_predictions), float(np.median(stage_one_ms)), float(np.median(stage_two_ms))
+
+
+def cascade_report(labels, class_names, p_healthy, full_predictions, stage_one_ms, stage_two_ms,
+                   margins=REPORT_MARGINS):
+    """
+    For each margin: share of frames answered by stage one, recall on disease classes (a disease
+    frame counts as caught when the cascade does not call it Healthy), per-class recall of the
+    cascade's final class, and the average cost per frame. The full model alone is the reference.
+    """
+    labels = np.asarray(labels)
+    healthy_index = class_names.index(HEALTHY_CLASS)
+    diseased = labels != healthy_index
+
+    def summary(final_predictions, exit_rate):
+        per_class = {}
+        for index, name in enumerate(class_names):
+            mask = labels == index
+            if mask.any():
+                per_class[name] = float(np.mean(final_predictions[mask] == index))
+        return {
+            "exit_rate": float(exit_rate),
+            "disease_recall": float(np.mean(final_predictions[diseased] != healthy_index)) if diseased.any() else None,
+            "accuracy": float(np.mean(final_predictions == labels)),
+            "per_class_recall": per_class,
+        }
+
+    report = {"images": int(len(labels)), "stage_one_ms": stage_one_ms, "stage_two_ms": stage_two_ms,
+              "full_model": dict(summary(full_predictions, 0.0), avg_cost_per_frame_ms=stage_two_ms),
+              "margins": {}}
+    for margin in margins:
+        exits = p_healthy >= margin
+        final_predictions = np.where(exits, healthy_index, full_predictions)
+        result = summary(final_predictions, exits.mean())
+        result["avg_cost_per_frame_ms"] = stage_one_ms + (1.0 - exits.mean()) * stage_two_ms
+        result["missed_disease_frames"] = int(np.sum(exits & diseased))
+        report["margins"][str(margin)] = result
+    return report
+
+
+def print_cascade_report(report):
+    full = report["full_model"]
+    print(f"\n--- Cascade Report on {report['images']} held-out images ---")
+    print(f"Median latency: stage one {report['stage_one_ms']:.1f} ms, full model {report['stage_two_ms']:.1f} ms")
+    print(f"{'margin':>8}{'exit rate':>11}{'disease recall':>16}{'missed':>8}{'accuracy':>10}{'ms/frame':>10}")
+    print(f"{'full':>8}{0:>10.1%}{full['disease_recall']:>16.1%}{0:>8}{full['accuracy']:>10.1%}"
+          f"{full['avg_cost_per_frame_ms']:>10.1f}")
+    for margin, row in report["margins"].items():
+        print(f"{margin:>8}{row['exit_rate']:>10.1%}{row['disease_recall']:>16.1%}{row['missed_disease_frames']:>8}"
+              f"{row['accuracy']:>10.1%}{row['avg_cost_per_frame_ms']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report disease recall and cost per frame of the cascade per margin.")
+    parser.add_argument('--data-dir', default=os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER))
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--labels', default=LABELS_PATH)
+    parser.add_argument('--stage-one', default=STAGE_ONE_MODEL_PATH)
+    parser.add_argument('--manifest', default=None, help="Take the file list from a dataset_index.py manifest")
+    parser.add_argument('--output', default='cascade_report.json')
+    args = parser.parse_args()
+
+    from class_labels import resolve_class_names
+    from tfdata_pipeline import list_image_files, split_train_validation
+
+    class_names = resolve_class_names(args.labels, args.data_dir)
+    if args.manifest:
+        from dataset_index import load_manifest
+        paths, labels, _ = load_manifest(args.manifest, args.data_dir)
+    else:
+        paths, labels, _ = list_image_files(args.data_dir, class_names)
+    _, (val_paths, val_labels) = split_train_validation(paths, labels, VALIDATION_SPLIT)
+
+    print(f"Scoring {len(val_paths)} validation images with both stages...")
+    stage_one = load_model_backend(args.stage_one)
+    full_backend = load_model_backend(args.model)
+    scores = score_images(val_paths, stage_one, full_backend)
+    report = cascade_report(val_labels, class_names, *scores)
+    print_cascade_report(report)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import json
+import os
+
+# --- Configuration ---
+# Class-index mapping saved next to the model at training/conversion time. Same schema as
+# the Flutter app's assets/model/labels.json: "classes" is ordered by model output index.
+LABELS_FILENAME = 'labels.json'
+DEFAULT_CONFIDENCE_THRESHOLD = 0.7
+NON_DISEASE_CLASSES = ('Healthy', 'Background', 'Not_Pig')
+
+
+def _label_key(name):
+    # 'skin changes' (dataset folder) and 'skin_changes' (hand-written labels) are the same class
+    return name.strip().lower().replace(' ', '_')
+
+
+def labels_path_for(model_path):
+    """labels.json that sits in the same folder as the given model file."""
+    return os.path.join(os.path.dirname(os.path.abspath(model_path)), LABELS_FILENAME)
+
+
+def load_labels(labels_path):
+    with open(labels_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_class_names(labels_path):
+    """Returns class names ordered by their model output index."""
+    labels = load_labels(labels_path)
+    classes = sorted(labels['classes'], key=lambda entry: entry['id'])
+    return [entry['name'] for entry in classes]
+
+
+def class_names_from_directory(data_dir):
+    """
+    Cheap fallback when no labels.json exists: flow_from_directory orders classes by
+    sorted sub-folder name, so listing the folders gives the same order without
+    walking and stat-ing every training image.
+    """
+    return sorted(name for name in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, name)))
+
+
+def resolve_class_names(labels_path, data_dir=None):
+    """labels.json first, the dataset folder listing only if labels.json is missing."""
+    if os.path.exists(labels_path):
+        return load_class_names(labels_path)
+    if data_dir is not None and os.path.isdir(data_dir):
+        print(f"Warning: '{labels_path}' not found, falling back to class folders in '{data_dir}'.")
+        return class_names_from_directory(data_dir)
+    raise FileNotFoundError(f"No labels file at '{labels_path}' and no dataset folder to infer classes from.")
+
+
+def build_labels(class_indices, existing=None, model_info=None):
+    """
+    Builds a labels.json document from a Keras class_indices dict ({'name': index}).
+    Descriptions, severities and thresholds of classes already present in `existing`
+    are kept (matched ignoring case and space/underscore); new classes get neutral
+    defaults that can be filled in by hand later.
+    """
+    existing = existing or {}
+    known = {_label_key(entry['name']): entry for entry in existing.get('classes', [])}
+
+    classes = []
+    for name, index in sorted(class_indices.items(), key=lambda item: item[1]):
+        entry = {'id': int(index), 'name': name}
+        entry.update({key: value for key, value in known.get(_label_key(name), {}).items() if key not in ('id', 'name')})
+        entry.setdefault('display_name', name.replace('_', ' ').title())
+        entry.setdefault('description', '')
+        entry.setdefault('severity', 'None' if name in NON_DISEASE_CLASSES else 'Unknown')
+        entry.setdefault('requires_action', name not in NON_DISEASE_CLASSES)
+        entry.setdefault('confidence_threshold', DEFAULT_CONFIDENCE_THRESHOLD)
+        classes.append(entry)
+
+    info = dict(existing.get('model_info', {}))
+    info.update(model_info or {})
+    info['num_classes'] = len(classes)
+
+    usage_notes = existing.get('usage_notes', {
+        "confidence_range": [0.0, 1.0],
+        "default_threshold": DEFAULT_CONFIDENCE_THRESHOLD,
+        "case_sensitive": True,
+        "label_matching": "exact"
+    })
+    return {"model_info": info, "classes": classes, "usage_notes": usage_notes}
+
+
+def save_labels(labels_path, class_indices, model_info=None):
+    """Writes labels.json, merging with the file already at labels_path if there is one."""
+    existing = load_labels(labels_path) if os.path.exists(labels_path) else None
+    labels = build_labels(class_indices, existing=existing, model_info=model_info)
+    with open(labels_path, 'w', encoding='utf-8') as f:
+        json.dump(labels, f, indent=2)
+    return labels
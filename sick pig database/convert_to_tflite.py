@@ -1,5 +1,11 @@
 import tensorflow as tf
+import argparse
+import json
 import os
+import random
+import time
+import numpy as np
+from class_labels import labels_path_for, load_class_names, load_labels, save_labels
 
 # --- Configuration ---
 # Path to your saved Keras model
@@ -8,61 +14,260 @@ MODEL_PATH = 'pig_disease_detector_model.h5'
 # Output path for the TensorFlow Lite model
 TFLITE_MODEL_PATH = 'quantized_pig_detector.tflite'
 
-print("--- Starting TensorFlow Lite Model Conversion ---")
-
-# --- 1. Load the Keras model ---
-print(f"Loading Keras model from: {MODEL_PATH}")
-try:
-    model = tf.keras.models.load_model(MODEL_PATH)
-    print("Keras model loaded successfully.")
-except Exception as e:
-    print(f"Error loading Keras model: {e}")
-    print("Please ensure 'pig_disease_detector_model.h5' exists in the current directory.")
-    exit()
-
-# --- 2. Initialize the TensorFlow Lite Converter ---
-# Create a TFLite converter object from the Keras model.
-converter = tf.lite.TFLiteConverter.from_keras_model(model)
-
-# --- 3. Apply Quantization (Dynamic Range Quantization) ---
-# Dynamic Range Quantization is the simplest form of post-training quantization.
-# It quantizes only the weights to 8-bit integers, while activations are dynamically quantized at inference time.
-# This significantly reduces model size and speeds up computation with minimal accuracy loss.
-print("Applying Dynamic Range Quantization...")
-converter.optimizations = [tf.lite.Optimize.DEFAULT]
-
-# For full integer quantization (even smaller model, potentially more accuracy loss),
-# you would add:
-# converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
-# converter.inference_input_type = tf.int8  # Or tf.uint8
-# converter.inference_output_type = tf.int8 # Or tf.uint8
-# And provide a representative dataset for calibration:
-# def representative_data_gen():
-#   for input_value in tf.data.Dataset.from_tensor_slices(your_representative_dataset).batch(1).take(100):
-#     yield [input_value]
-# converter.representative_dataset = representative_data_gen
-
-# --- 4. Convert the model to TFLite format ---
-print("Converting model to TFLite...")
-tflite_model = converter.convert()
-
-# --- 5. Save the TFLite model ---
-print(f"Saving TFLite model to: {TFLITE_MODEL_PATH}")
-try:
-    with open(TFLITE_MODEL_PATH, 'wb') as f:
-        f.write(tflite_model)
-    print("TFLite model saved successfully.")
-    
-    # Print model size for comparison
-    original_size = os.path.getsize(MODEL_PATH) / (1024 * 1024) # MB
-    tflite_size = os.path.getsize(TFLITE_MODEL_PATH) / (1024 * 1024) # MB
-    print(f"Original Keras model size: {original_size:.2f} MB")
-    print(f"Quantized TFLite model size: {tflite_size:.2f} MB")
-
-except Exception as e:
-    print(f"Error saving TFLite model: {e}")
-
-print("\n--- TensorFlow Lite Model Conversion Complete ---")
-print("The 'quantized_pig_detector.tflite' file is now ready for embedded deployment.")
-print("Next, you will need to integrate this .tflite file into your ESP32-CAM Arduino project.")
+# labels.json written by train_pig_detector.py next to the Keras model
+LABELS_PATH = labels_path_for(MODEL_PATH)
 
+# The Flutter app reads its labels from here; it is updated with the model's class order
+FLUTTER_LABELS_PATH = '../assets/model/labels.json'
+
+# Dataset used for INT8 calibration and for the float-vs-TFLite comparison
+DATASET_ROOT_PATH = 'C:/Users/Alfred/Desktop/sick pig database'
+DATA_SUBFOLDER = 'category'
+VALIDATION_SPLIT = 0.2 # Same split as training: calibration draws from the training part,
+                       # the comparison runs on the held-out validation part
+
+# Conversion mode:
+# 'float'   -> no quantization (reference)
+# 'dynamic' -> dynamic-range quantization: int8 weights, float activations
+# 'int8'    -> full-integer quantization calibrated on a representative dataset
+QUANTIZATION_MODE = 'dynamic'
+INT8_IO_TYPE = 'uint8' # Input/output type of the full-integer model: 'uint8' or 'int8'
+CALIBRATION_SAMPLES = 200 # Stratified across classes
+LATENCY_RUNS = 50 # Single-image CPU invocations timed per model in the comparison
+
+DEFAULT_OUTPUT_PATHS = {
+    'float': 'pig_detector_float.tflite',
+    'dynamic': TFLITE_MODEL_PATH,
+    'int8': 'quantized_pig_detector_int8.tflite',
+}
+
+
+# --- Dataset Helpers ---
+def split_dataset(data_dir):
+    from tfdata_pipeline import list_image_files, split_train_validation
+    paths, labels, class_names = list_image_files(data_dir)
+    train, validation = split_train_validation(paths, labels, VALIDATION_SPLIT)
+    return train, validation, class_names
+
+
+def stratified_sample(paths, labels, num_samples, seed=0):
+    """Draws about num_samples files with each class represented in proportion (at least one each)."""
+    rng = random.Random(seed)
+    by_class = {}
+    for path, label in zip(paths, labels):
+        by_class.setdefault(label, []).append(path)
+    sample = []
+    for label, class_paths in sorted(by_class.items()):
+        share = max(1, round(num_samples * len(class_paths) / len(paths)))
+        sample.extend(rng.sample(class_paths, min(share, len(class_paths))))
+    rng.shuffle(sample)
+    return sample
+
+
+def load_model_input(path, image_size):
+    # Same decode and preprocessing as the inference server
+    from image_pipeline import decode_frame, to_model_input
+    with open(path, 'rb') as f:
+        return to_model_input(decode_frame(f.read(), target_size=image_size), image_size)
+
+
+# --- Conversion ---
+def convert(model, mode, calibration_paths=None, io_type=INT8_IO_TYPE):
+    # Create a TFLite converter object from the Keras model.
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    image_size = tuple(model.input_shape[1:3])
+
+    if mode == 'dynamic':
+        # Dynamic Range Quantization is the simplest form of post-training quantization.
+        # It quantizes only the weights to 8-bit integers, while activations are dynamically quantized at inference time.
+        print("Applying Dynamic Range Quantization...")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif mode == 'int8':
+        # Full integer quantization: weights and activations are int8, calibrated on real images
+        print(f"Applying Full-Integer (INT8) Quantization with {len(calibration_paths)} calibration images...")
+
+        def representative_data_gen():
+            for path in calibration_paths:
+                yield [np.expand_dims(load_model_input(path, image_size), axis=0)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_data_gen
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8 if io_type == 'uint8' else tf.int8
+        converter.inference_output_type = tf.uint8 if io_type == 'uint8' else tf.int8
+    elif mode != 'float':
+        raise ValueError(f"Unknown quantization mode '{mode}'")
+
+    print("Converting model to TFLite...")
+    return converter.convert()
+
+
+def quantization_metadata(tflite_path, mode):
+    """Input/output dtype, scale and zero-point of the converted model, for labels.json."""
+    interpreter = tf.lite.Interpreter(model_path=tflite_path)
+
+    def describe(details):
+        scale, zero_point = details['quantization']
+        return {"dtype": np.dtype(details['dtype']).name, "scale": float(scale), "zero_point": int(zero_point)}
+
+    return {
+        "mode": mode,
+        "input": describe(interpreter.get_input_details()[0]),
+        "output": describe(interpreter.get_output_details()[0]),
+    }
+
+
+# --- Float vs. TFLite Comparison ---
+def time_single_image(predict_fn, inputs, runs):
+    timings = []
+    for index in range(runs):
+        sample = inputs[index % len(inputs)]
+        start = time.perf_counter()
+        predict_fn(sample)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return {"mean_ms": float(np.mean(timings)), "p50_ms": float(np.percentile(timings, 50)),
+            "p95_ms": float(np.percentile(timings, 95))}
+
+
+def compare_models(model, keras_path, tflite_path, eval_paths, eval_labels, class_names, latency_runs=LATENCY_RUNS):
+    """
+    Scores the Keras model and the TFLite model on the same held-out images and reports
+    top-1 agreement, per-class accuracy of both and its delta, file sizes and CPU latency.
+    """
+    from inference_backends import TFLiteBackend
+
+    image_size = tuple(model.input_shape[1:3])
+    inputs = np.stack([load_model_input(path, image_size) for path in eval_paths])
+    labels = np.asarray(eval_labels)
+
+    keras_predictions = np.argmax(model.predict(inputs, batch_size=32, verbose=0), axis=1)
+    tflite_backend = TFLiteBackend(tflite_path, pool_size=1, num_threads=1)
+    tflite_predictions = np.argmax(tflite_backend.predict_batch(inputs), axis=1)
+
+    per_class = {}
+    for label, class_name in enumerate(class_names):
+        mask = labels == label
+        if not mask.any():
+            continue
+        keras_accuracy = float(np.mean(keras_predictions[mask] == label))
+        tflite_accuracy = float(np.mean(tflite_predictions[mask] == label))
+        per_class[class_name] = {"images": int(mask.sum()), "keras_accuracy": keras_accuracy,
+                                 "tflite_accuracy": tflite_accuracy, "delta": tflite_accuracy - keras_accuracy}
+
+    return {
+        "images": int(len(labels)),
+        "top1_agreement": float(np.mean(keras_predictions == tflite_predictions)),
+        "keras_accuracy": float(np.mean(keras_predictions == labels)),
+        "tflite_accuracy": float(np.mean(tflite_predictions == labels)),
+        "per_class": per_class,
+        "keras_size_mb": os.path.getsize(keras_path) / (1024 * 1024),
+        "tflite_size_mb": os.path.getsize(tflite_path) / (1024 * 1024),
+        "keras_latency": time_single_image(lambda x: model.predict_on_batch(x[None]), inputs, latency_runs),
+        "tflite_latency": time_single_image(tflite_backend.predict, inputs, latency_runs),
+    }
+
+
+def print_comparison(report):
+    print(f"\n--- Keras vs. TFLite on {report['images']} held-out images ---")
+    print(f"Top-1 agreement: {report['top1_agreement'] * 100:.2f}%")
+    print(f"Accuracy: Keras {report['keras_accuracy'] * 100:.2f}% | TFLite {report['tflite_accuracy'] * 100:.2f}%")
+    print(f"{'Class':<22}{'Images':>8}{'Keras':>9}{'TFLite':>9}{'Delta':>9}")
+    for class_name, row in report["per_class"].items():
+        print(f"{class_name:<22}{row['images']:>8}{row['keras_accuracy'] * 100:>8.1f}%"
+              f"{row['tflite_accuracy'] * 100:>8.1f}%{row['delta'] * 100:>+8.1f}%")
+    print(f"Size: Keras {report['keras_size_mb']:.2f} MB | TFLite {report['tflite_size_mb']:.2f} MB")
+    print(f"CPU latency (1 image): Keras {report['keras_latency']['p50_ms']:.1f} ms p50 | "
+          f"TFLite {report['tflite_latency']['p50_ms']:.1f} ms p50")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the Keras pig disease model to TensorFlow Lite.")
+    parser.add_argument('--mode', choices=['float', 'dynamic', 'int8'], default=QUANTIZATION_MODE)
+    parser.add_argument('--io-type', choices=['uint8', 'int8'], default=INT8_IO_TYPE,
+                        help="int8 mode only: input/output tensor type")
+    parser.add_argument('--output', default=None, help="Output .tflite path (default depends on --mode)")
+    parser.add_argument('--calibration-samples', type=int, default=CALIBRATION_SAMPLES)
+    parser.add_argument('--no-compare', action='store_true', help="Skip the Keras vs. TFLite comparison")
+    args = parser.parse_args()
+    output_path = args.output or DEFAULT_OUTPUT_PATHS[args.mode]
+    data_dir = os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER)
+
+    print("--- Starting TensorFlow Lite Model Conversion ---")
+
+    # --- 1. Load the Keras model ---
+    print(f"Loading Keras model from: {MODEL_PATH}")
+    try:
+        model = tf.keras.models.load_model(MODEL_PATH)
+        print("Keras model loaded successfully.")
+    except Exception as e:
+        print(f"Error loading Keras model: {e}")
+        print("Please ensure 'pig_disease_detector_model.h5' exists in the current directory.")
+        exit()
+
+    # --- 2-4. Convert (with a stratified calibration sample for INT8) ---
+    need_dataset = args.mode == 'int8' or not args.no_compare
+    if need_dataset and not os.path.isdir(data_dir):
+        print(f"Error: dataset folder '{data_dir}' is needed for calibration/comparison but does not exist.")
+        exit()
+    if need_dataset:
+        (train_paths, train_labels), (val_paths, val_labels), class_names = split_dataset(data_dir)
+    calibration_paths = None
+    if args.mode == 'int8':
+        calibration_paths = stratified_sample(train_paths, train_labels, args.calibration_samples)
+    tflite_model = convert(model, args.mode, calibration_paths=calibration_paths, io_type=args.io_type)
+
+    # --- 5. Save the TFLite model ---
+    print(f"Saving TFLite model to: {output_path}")
+    try:
+        with open(output_path, 'wb') as f:
+            f.write(tflite_model)
+        print("TFLite model saved successfully.")
+
+        # Print model size for comparison
+        original_size = os.path.getsize(MODEL_PATH) / (1024 * 1024) # MB
+        tflite_size = os.path.getsize(output_path) / (1024 * 1024) # MB
+        print(f"Original Keras model size: {original_size:.2f} MB")
+        print(f"TFLite model size ({args.mode}): {tflite_size:.2f} MB")
+    except Exception as e:
+        print(f"Error saving TFLite model: {e}")
+        exit()
+
+    # --- 6. Save the class-index mapping (with quantization parameters) next to the TFLite model and for the Flutter app ---
+    quantization = quantization_metadata(output_path, args.mode)
+    print(f"Input: {quantization['input']} | Output: {quantization['output']}")
+    try:
+        class_names = load_class_names(LABELS_PATH)
+        class_indices = {name: index for index, name in enumerate(class_names)}
+        tflite_labels_path = labels_path_for(output_path)
+        existing_models = {}
+        if os.path.exists(tflite_labels_path):
+            existing_models = load_labels(tflite_labels_path).get("model_info", {}).get("tflite_models", {})
+        existing_models[os.path.basename(output_path)] = quantization
+        model_info = {"input_size": list(model.input_shape[1:3]), "model_formats": ["h5", "tflite"],
+                      "tflite_models": existing_models}
+        save_labels(tflite_labels_path, class_indices, model_info=model_info)
+        if os.path.isdir(os.path.dirname(FLUTTER_LABELS_PATH)):
+            save_labels(FLUTTER_LABELS_PATH, class_indices, model_info=model_info)
+            print(f"Flutter labels updated: {FLUTTER_LABELS_PATH}")
+        print(f"Class labels saved for {len(class_names)} classes: {class_names}")
+    except FileNotFoundError:
+        print(f"Warning: '{LABELS_PATH}' not found. Re-run train_pig_detector.py to produce it.")
+
+    # --- 7. Compare against the float Keras model on the held-out split ---
+    if not args.no_compare:
+        report = compare_models(model, MODEL_PATH, output_path, val_paths, val_labels, class_names)
+        report["mode"] = args.mode
+        report["quantization"] = quantization
+        print_comparison(report)
+        report_path = os.path.splitext(output_path)[0] + '_report.json'
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Comparison report saved to: {report_path}")
+
+    print("\n--- TensorFlow Lite Model Conversion Complete ---")
+    print(f"The '{output_path}' file is now ready for embedded deployment.")
+    print("Next, you will need to integrate this .tflite file into your ESP32-CAM Arduino project.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+from PIL import Image
+from image_pipeline import difference_hash
+
+# --- Configuration ---
+DATASET_ROOT_PATH = 'C:/Users/Alfred/Desktop/sick pig database'
+DATA_SUBFOLDER = 'category'
+MANIFEST_PATH = 'dataset_manifest.sqlite'
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp') # Same formats as tfdata_pipeline.py
+VALIDATION_SPLIT = 0.2 # Same split rule as training, used for the leakage check
+NEAR_DUPLICATE_DISTANCE = 6 # Max differing bits (of 64) between dHashes to call two images near duplicates
+INDEX_WORKERS = None # None = one process per CPU core
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,      -- relative to the data folder, '/' separated
+    class_name TEXT NOT NULL,
+    position INTEGER NOT NULL,  -- order within the listing (same order as flow_from_directory)
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT,
+    width INTEGER,
+    height INTEGER,
+    format TEXT,
+    frames INTEGER,
+    dhash TEXT,                 -- 64-bit difference hash as 16 hex digits
+    error TEXT,                 -- set when the file cannot be decoded
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_sha256 ON images (sha256);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+# --- 1. Listing ---
+def list_dataset_files(data_dir):
+    """
+    Returns [(relative_path, class_name)] in the order tfdata_pipeline.list_image_files uses
+    (classes by sorted folder name, sorted walk within each class).
+    """
+    class_names = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    files = []
+    for class_name in class_names:
+        class_dir = os.path.join(data_dir, class_name)
+        for root, _, file_names in sorted(os.walk(class_dir), key=lambda entry: entry[0]):
+            for file_name in sorted(file_names):
+                if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    relative = os.path.relpath(os.path.join(root, file_name), data_dir)
+                    files.append((relative.replace(os.sep, '/'), class_name))
+    return files
+
+
+# --- 2. Per-File Inspection (runs in worker processes) ---
+def inspect_file(path):
+    """Hashes and fully decodes one image. Returns a dict of manifest fields."""
+    with open(path, 'rb') as f:
+        contents = f.read()
+    record = {"sha256": hashlib.sha256(contents).hexdigest(), "width": None, "height": None,
+              "format": None, "frames": None, "dhash": None, "error": None}
+    try:
+        img = Image.open(io.BytesIO(contents))
+        record["format"] = img.format
+        record["width"], record["height"] = img.size
+        record["frames"] = getattr(img, 'n_frames', 1)
+        img.load() # Full decode: catches truncated and corrupt files that open() alone accepts
+        record["dhash"] = f"{difference_hash(img):016x}"
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+
+# --- 3. Incremental Indexing ---
+def open_manifest(manifest_path):
+    connection = sqlite3.connect(manifest_path)
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def update_manifest(data_dir, manifest_path=MANIFEST_PATH, workers=INDEX_WORKERS):
+    """
+    Brings the manifest in line with data_dir. Files whose mtime and size are unchanged are
+    not read again; new and changed files are hashed and decode-checked in a process pool;
+    rows of deleted files are removed. Returns counts of what was done.
+    """
+    files = list_dataset_files(data_dir)
+    connection = open_manifest(manifest_path)
+    known = {path: (mtime, size) for path, mtime, size in connection.execute("SELECT path, mtime, size FROM images")}
+
+    todo, unchanged = [], []
+    for position, (relative, class_name) in enumerate(files):
+        stat = os.stat(os.path.join(data_dir, relative))
+        if known.get(relative) == (stat.st_mtime, stat.st_size):
+            unchanged.append((class_name, position, relative))
+        else:
+            todo.append((relative, class_name, position, stat.st_mtime, stat.st_size))
+
+    now = time.time()
+    with connection:
+        # Class and position can change without the file changing (files moved or added around it)
+        connection.executemany("UPDATE images SET class_name = ?, position = ? WHERE path = ?", unchanged)
+        listed = {relative for relative, _ in files}
+        removed = [(path,) for path in known if path not in listed]
+        connection.executemany("DELETE FROM images WHERE path = ?", removed)
+
+        if todo:
+            print(f"Indexing {len(todo)} new or changed files ({len(unchanged)} unchanged)...")
+            full_paths = [os.path.join(data_dir, relative) for relative, *_ in todo]
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                records = executor.map(inspect_file, full_paths, chunksize=16)
+                for (relative, class_name, position, mtime, size), record in zip(todo, records):
+                    connection.execute(
+                        "INSERT OR REPLACE INTO images (path, class_name, position, mtime, size, sha256, width, "
+                        "height, format, frames, dhash, error, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (relative, class_name, position, mtime, size, record["sha256"], record["width"],
+                         record["height"], record["format"], record["frames"], record["dhash"], record["error"], now))
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('data_dir', ?)", (os.path.abspath(data_dir),))
+    connection.close()
+    return {"files": len(files), "indexed": len(todo), "unchanged": len(unchanged), "removed": len(removed)}
+
+
+# --- 4. Loading the Manifest ---
+def read_rows(manifest_path=MANIFEST_PATH):
+    connection = sqlite3.connect(manifest_path)
+    connection.row_factory = sqlite3.Row
+    rows = [dict(row) for row in connection.execute("SELECT * FROM images ORDER BY position")]
+    meta = dict(connection.execute("SELECT key, value FROM meta"))
+    connection.close()
+    return rows, meta
+
+
+def load_manifest(manifest_path=MANIFEST_PATH, data_dir=None, drop_duplicates=True, drop_errors=True):
+    """
+    Drop-in replacement for tfdata_pipeline.list_image_files that reads the manifest instead of
+    walking the dataset: returns (paths, labels, class_names) in the same order.
+    Undecodable files are left out, and with drop_duplicates only the first copy of each exact
+    duplicate is kept (so the same bytes cannot land in both training and validation).
+    """
+    rows, meta = read_rows(manifest_path)
+    data_dir = data_dir or meta.get("data_dir", '')
+    class_names = sorted({row["class_name"] for row in rows})
+    label_of = {name: label for label, name in enumerate(class_names)}
+    seen = set()
+    paths, labels = [], []
+    for row in sorted(rows, key=lambda row: (label_of[row["class_name"]], row["position"])):
+        if drop_errors and row["error"]:
+            continue
+        if drop_duplicates:
+            if row["sha256"] in seen:
+                continue
+            seen.add(row["sha256"])
+        paths.append(os.path.join(data_dir, *row["path"].split('/')))
+        labels.append(label_of[row["class_name"]])
+    return paths, labels, class_names
+
+
+# --- 5. Duplicate and Leakage Report ---
+def _validation_paths(rows, validation_split):
+    # Same rule as tfdata_pipeline.split_train_validation: first int(split * n) files per class
+    by_class = {}
+    for row in sorted(rows, key=lambda row: row["position"]):
+        by_class.setdefault(row["class_name"], []).append(row["path"])
+    validation = set()
+    for class_paths in by_class.values():
+        validation.update(class_paths[:int(validation_split * len(class_paths))])
+    return validation
+
+
+def _near_duplicate_pairs(hashes, max_distance):
+    """Index pairs (i, j) whose 64-bit hashes differ in at most max_distance bits."""
+    values = np.array([int(h, 16) for h in hashes], dtype=np.uint64)
+    popcount = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+    pairs = []
+    for i in range(len(values) - 1):
+        differing = (values[i + 1:] ^ values[i]).view(np.uint8).reshape(-1, 8)
+        distances = popcount[differing].sum(axis=1)
+        pairs.extend((i, i + 1 + j) for j in np.nonzero(distances <= max_distance)[0])
+    return pairs
+
+
+def _group(items, pairs):
+    # Union-find over item indices
+    parent = list(range(len(items)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    for a, b in pairs:
+        parent[find(a)] = find(b)
+    groups = {}
+    for index in range(len(items)):
+        groups.setdefault(find(index), []).append(items[index])
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def duplicate_report(manifest_path=MANIFEST_PATH, validation_split=VALIDATION_SPLIT,
+                     max_distance=NEAR_DUPLICATE_DISTANCE):
+    """
+    Groups exact duplicates (same sha256) and near duplicates (dHash within max_distance bits),
+    and flags groups that span several classes or both the training and validation split.
+    """
+    rows, _ = read_rows(manifest_path)
+    ok_rows = [row for row in rows if not row["error"]]
+    validation = _validation_paths(ok_rows, validation_split)
+
+    by_sha = {}
+    for row in ok_rows:
+        by_sha.setdefault(row["sha256"], []).append(row)
+    exact_groups = [group for group in by_sha.values() if len(group) > 1]
+
+    # Near duplicates are searched between distinct contents (one representative per sha256)
+    representatives = [group[0]["sha256"] for group in by_sha.values()]
+    pairs = _near_duplicate_pairs([by_sha[sha][0]["dhash"] for sha in representatives], max_distance)
+    near_groups = [[row for sha in shas for row in by_sha[sha]] for shas in _group(representatives, pairs)]
+
+    def describe(group):
+        classes = sorted({row["class_name"] for row in group})
+        splits = sorted({'validation' if row["path"] in validation else 'train' for row in group})
+        return {"paths": [row["path"] for row in group], "classes": classes,
+                "cross_class": len(classes) > 1, "train_validation_leak": len(splits) > 1}
+
+    exact = [describe(group) for group in exact_groups]
+    near = [describe(group) for group in near_groups]
+    return {
+        "images": len(rows),
+        "unique_contents": len(by_sha),
+        "errors": [{"path": row["path"], "error": row["error"]} for row in rows if row["error"]],
+        "formats": dict(sorted(collections.Counter(row["format"] for row in ok_rows).items())),
+        "exact_duplicate_groups": exact,
+        "near_duplicate_groups": near,
+        "cross_class_groups": sum(group["cross_class"] for group in exact + near),
+        "leaking_groups": sum(group["train_validation_leak"] for group in exact + near),
+    }
+
+
+def print_report(report):
+    print("\n--- Dataset Index Report ---")
+    print(f"Images: {report['images']} ({report['unique_contents']} unique contents)")
+    print(f"Formats: {report['formats']}")
+    print(f"Undecodable files: {len(report['errors'])}")
+    for entry in report["errors"]:
+        print(f"  {entry['path']}: {entry['error']}")
+    for title, key in (("Exact duplicate", "exact_duplicate_groups"), ("Near duplicate", "near_duplicate_groups")):
+        groups = report[key]
+        print(f"{title} groups: {len(groups)} "
+              f"({sum(g['cross_class'] for g in groups)} across classes, "
+              f"{sum(g['train_validation_leak'] for g in groups)} leaking between train and validation)")
+        for group in groups:
+            if group["cross_class"] or group["train_validation_leak"]:
+                flags = ", ".join(flag for flag, on in (("cross-class", group["cross_class"]),
+                                                        ("train/val leak", group["train_validation_leak"])) if on)
+                print(f"  [{flags}] {' | '.join(group['paths'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the dataset: hash, decode-check and find duplicates.")
+    parser.add_argument('--data-dir', default=os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER))
+    parser.add_argument('--manifest', default=MANIFEST_PATH)
+    parser.add_argument('--workers', type=int, default=INDEX_WORKERS)
+    parser.add_argument('--near-distance', type=int, default=NEAR_DUPLICATE_DISTANCE,
+                        help="Max differing dHash bits for near duplicates (default: %(default)s)")
+    parser.add_argument('--report', default=None, help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir):
+        print(f"Error: data folder '{args.data_dir}' does not exist.")
+        exit()
+
+    start = time.time()
+    counts = update_manifest(args.data_dir, args.manifest, workers=args.workers)
+    print(f"Manifest '{args.manifest}' updated in {time.time() - start:.1f} s: {counts['files']} files, "
+          f"{counts['indexed']} indexed, {counts['unchanged']} unchanged, {counts['removed']} removed.")
+
+    report = duplicate_report(args.manifest, max_distance=args.near_distance)
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
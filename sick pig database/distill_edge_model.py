@@ -0,0 +1,524 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.applications import MobileNetV2
+from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Softmax
+from tensorflow.keras.models import Model
+from tensorflow.keras.optimizers import Adam
+from tensorflow.keras.callbacks import EarlyStopping
+
+# --- Configuration ---
+DATASET_ROOT_PATH = 'C:/Users/Alfred/Desktop/sick pig database'
+DATA_SUBFOLDER = 'category'
+TEACHER_MODEL_PATH = 'pig_disease_detector_model.h5' # Full 224x224 model from train_pig_detector.py
+OUTPUT_DIR = 'edge_models' # One sub-folder per candidate, plus the soft-label cache and edge_report.json
+EDGE_MODEL_PATH = 'pig_detector_edge_int8.tflite' # The selected candidate is copied here
+HEADER_FILE_PATH = 'model_data.h' # Same default as tflite_to_header.py
+VALIDATION_SPLIT = 0.2 # Same split as training: students never see the validation images
+
+# Students: MobileNetV2 at a reduced width (alpha) and input resolution, optionally magnitude-pruned.
+# sparsity is the fraction of pointwise-conv and dense weights set to zero after distillation.
+CANDIDATES = [
+    {"name": "a035_96", "alpha": 0.35, "image_size": 96, "sparsity": 0.0},
+    {"name": "a035_96_pruned", "alpha": 0.35, "image_size": 96, "sparsity": 0.5},
+    {"name": "a035_128", "alpha": 0.35, "image_size": 128, "sparsity": 0.0},
+    {"name": "a050_96", "alpha": 0.5, "image_size": 96, "sparsity": 0.0},
+]
+STUDENT_WEIGHTS = 'imagenet' # Backbone initialisation of the students; None trains from scratch
+
+# Distillation
+TEMPERATURE = 4.0 # Softens the teacher's distribution so the small classes' scores carry signal
+DISTILL_WEIGHT = 0.7 # Share of the soft-label (KL) term; the rest is cross-entropy on the true labels
+DISTILL_EPOCHS = 100
+DISTILL_PATIENCE = 10
+DISTILL_LEARNING_RATE = 0.0005 # Higher than train_pig_detector.py: the whole student is trained
+BATCH_SIZE = 32
+
+# Magnitude pruning (fine-tuning after distillation)
+PRUNE_EPOCHS = 20
+PRUNE_END_FRACTION = 0.7 # Target sparsity is reached at this fraction of PRUNE_EPOCHS, then held
+PRUNE_FREQUENCY = 50 # Steps between mask updates
+PRUNE_MIN_WEIGHTS = 1024 # Smaller kernels (the stem conv) are left dense
+
+# ESP32-CAM budgets. The model array sits in flash (a 3 MB app partition, e.g. "Huge APP"),
+# the tensor arena in RAM; 4 MB of PSRAM is shared with the camera frame buffers.
+FLASH_BUDGET_BYTES = 3 * 1024 * 1024
+ARENA_BUDGET_BYTES = 1024 * 1024
+ARENA_OVERHEAD_BYTES = 16 * 1024 # Interpreter structs, per-op data and kernel scratch buffers (rough)
+TARGET_FPS = 3.0
+# Throughput of the int8 conv kernels on the ESP32 at 240 MHz with ESP-NN (rough); used to turn
+# a model's multiply-accumulate count into an on-device frame rate estimate.
+DEVICE_MACS_PER_SECOND = 100e6
+LATENCY_RUNS = 50
+
+
+# --- Teacher Soft Labels ---
+def _file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def teacher_probabilities(teacher, teacher_path, paths, labels, num_classes, cache_path):
+    """
+    Teacher softmax outputs for every image, computed once (plain images, no augmentation) and
+    shared by all candidates. Cached on disk per teacher file, so reruns skip the 224x224 pass.
+    """
+    from tfdata_pipeline import make_dataset
+    teacher_hash = _file_sha1(teacher_path)
+    if os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        if str(cached["teacher_sha1"]) == teacher_hash and list(cached["paths"]) == list(paths):
+            print(f"Teacher soft labels loaded from {cache_path}")
+            return cached["probs"]
+
+    print(f"Running the teacher on {len(paths)} images...")
+    image_size = tuple(teacher.input_shape[1:3])
+    dataset = make_dataset(paths, labels, num_classes, image_size, BATCH_SIZE, training=False)
+    probs = teacher.predict(dataset.map(lambda images, _: images), verbose=0).astype(np.float32)
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    np.savez(cache_path, probs=probs, paths=np.asarray(paths), teacher_sha1=teacher_hash)
+    return probs
+
+
+def distillation_dataset(paths, targets, image_size, training, seed=None):
+    """(image, [one-hot | teacher probs]) batches at the student's resolution, augmented like training."""
+    from tfdata_pipeline import AUGMENTATION, AUTOTUNE, augment_batch, decode_and_resize
+    dataset = tf.data.Dataset.from_tensor_slices((list(paths), targets))
+    dataset = dataset.map(lambda path, target: (decode_and_resize(path, image_size), target),
+                          num_parallel_calls=AUTOTUNE, deterministic=not training)
+    dataset = dataset.cache()
+    if training:
+        dataset = dataset.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(BATCH_SIZE)
+    dataset = dataset.map(lambda images, batch_targets: (tf.cast(images, tf.float32) / 255.0, batch_targets),
+                          num_parallel_calls=AUTOTUNE)
+    if training:
+        # The soft label is the teacher's view of the plain image; small affine changes keep it valid
+        dataset = dataset.map(lambda images, batch_targets: (augment_batch(images, AUGMENTATION, seed), batch_targets),
+                              num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
+
+
+# --- Student Model and Loss ---
+def build_student(num_classes, image_size, alpha, weights=STUDENT_WEIGHTS):
+    """MobileNetV2 backbone at the given width and resolution with a linear head; outputs logits."""
+    base_model = MobileNetV2(weights=weights, include_top=False, alpha=alpha,
+                             input_shape=(image_size, image_size, 3))
+    x = GlobalAveragePooling2D()(base_model.output)
+    logits = Dense(num_classes)(x)
+    return Model(inputs=base_model.input, outputs=logits)
+
+
+def distillation_loss(num_classes, temperature=TEMPERATURE, distill_weight=DISTILL_WEIGHT):
+    """
+    y_true is [one-hot label | teacher probabilities]. Hinton et al.'s loss: KL divergence between
+    the temperature-softened teacher and student, scaled by T^2, blended with hard-label cross-entropy.
+    """
+    def loss(y_true, logits):
+        hard, teacher_probs = y_true[:, :num_classes], y_true[:, num_classes:]
+        # The teacher exports softmax outputs; log-probabilities are its logits up to a constant
+        soft_teacher = tf.nn.softmax(tf.math.log(teacher_probs + 1e-8) / temperature)
+        log_soft_student = tf.nn.log_softmax(logits / temperature)
+        kl = tf.reduce_sum(soft_teacher * (tf.math.log(soft_teacher + 1e-8) - log_soft_student), axis=-1)
+        cross_entropy = tf.nn.softmax_cross_entropy_with_logits(hard, logits)
+        return distill_weight * temperature ** 2 * kl + (1.0 - distill_weight) * cross_entropy
+    return loss
+
+
+def label_accuracy(num_classes):
+    def accuracy(y_true, logits):
+        return tf.cast(tf.equal(tf.argmax(y_true[:, :num_classes], -1), tf.argmax(logits, -1)), tf.float32)
+    return accuracy
+
+
+def teacher_agreement(num_classes):
+    def agreement(y_true, logits):
+        return tf.cast(tf.equal(tf.argmax(y_true[:, num_classes:], -1), tf.argmax(logits, -1)), tf.float32)
+    return agreement
+
+
+def with_softmax(student):
+    # Same output as every other model in the repo: class probabilities
+    return Model(inputs=student.input, outputs=Softmax()(student.output))
+
+
+# --- Magnitude Pruning ---
+class MagnitudePruning(tf.keras.callbacks.Callback):
+    """
+    Gradual magnitude pruning (Zhu & Gupta): every PRUNE_FREQUENCY steps the smallest-magnitude
+    weights of each pointwise conv and dense kernel are masked, with sparsity rising along
+    s_t = s * (1 - (1 - t / end)^3). Masks are re-applied after every step so that optimizer
+    updates cannot bring pruned weights back. Depthwise kernels have few weights and are kept.
+    """
+
+    def __init__(self, target_sparsity, total_steps, end_fraction=PRUNE_END_FRACTION,
+                 frequency=PRUNE_FREQUENCY, min_weights=PRUNE_MIN_WEIGHTS):
+        super().__init__()
+        self.target_sparsity = target_sparsity
+        self.end_step = max(1, int(total_steps * end_fraction))
+        self.frequency = frequency
+        self.min_weights = min_weights
+        self.step = 0
+        self.kernels = []
+        self.masks = []
+
+    def on_train_begin(self, logs=None):
+        self.kernels = [layer.kernel for layer in self.model.layers
+                        if type(layer).__name__ in ('Conv2D', 'Dense') and int(np.prod(layer.kernel.shape)) >= self.min_weights]
+        self.masks = [np.ones(kernel.shape, dtype=np.float32) for kernel in self.kernels]
+        self._update_masks()
+
+    def sparsity_at(self, step):
+        progress = min(1.0, step / self.end_step)
+        return self.target_sparsity * (1.0 - (1.0 - progress) ** 3)
+
+    def _update_masks(self):
+        sparsity = self.sparsity_at(self.step)
+        for position, kernel in enumerate(self.kernels):
+            magnitudes = np.abs(kernel.numpy())
+            num_pruned = int(sparsity * magnitudes.size)
+            if num_pruned == 0:
+                continue
+            threshold = np.partition(magnitudes.ravel(), num_pruned - 1)[num_pruned - 1]
+            self.masks[position] = (magnitudes > threshold).astype(np.float32)
+
+    def _apply_masks(self):
+        for kernel, mask in zip(self.kernels, self.masks):
+            kernel.assign(kernel.numpy() * mask)
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step += 1
+        if self.step <= self.end_step and (self.step % self.frequency == 0 or self.step == self.end_step):
+            self._update_masks()
+        self._apply_masks()
+
+    def on_train_end(self, logs=None):
+        self._apply_masks()
+
+    def sparsity(self):
+        total = sum(mask.size for mask in self.masks)
+        return float(sum(mask.size - mask.sum() for mask in self.masks) / total) if total else 0.0
+
+
+# --- Candidate Training ---
+def distill_candidate(candidate, num_classes, train_paths, train_targets, val_paths, val_targets,
+                      epochs=DISTILL_EPOCHS, prune_epochs=PRUNE_EPOCHS, weights=STUDENT_WEIGHTS, seed=0):
+    """Distils one student, then (if candidate sparsity > 0) prunes it while distillation continues."""
+    image_size = (candidate["image_size"], candidate["image_size"])
+    train_dataset = distillation_dataset(train_paths, train_targets, image_size, training=True, seed=seed)
+    val_dataset = distillation_dataset(val_paths, val_targets, image_size, training=False)
+
+    student = build_student(num_classes, candidate["image_size"], candidate["alpha"], weights=weights)
+    student.compile(optimizer=Adam(learning_rate=DISTILL_LEARNING_RATE), loss=distillation_loss(num_classes),
+                    metrics=[label_accuracy(num_classes), teacher_agreement(num_classes)])
+    early_stopping = EarlyStopping(monitor='val_loss', patience=DISTILL_PATIENCE, restore_best_weights=True, verbose=1)
+    start = time.perf_counter()
+    history = student.fit(train_dataset, validation_data=val_dataset, epochs=epochs,
+                          callbacks=[early_stopping], verbose=2)
+    info = {"distill_epochs": len(history.history["loss"]), "sparsity": 0.0}
+
+    if candidate.get("sparsity", 0.0) > 0:
+        # No early stopping here: the run must get to the target sparsity
+        pruning = MagnitudePruning(candidate["sparsity"], prune_epochs * len(train_dataset))
+        student.compile(optimizer=Adam(learning_rate=DISTILL_LEARNING_RATE / 10), loss=distillation_loss(num_classes),
+                        metrics=[label_accuracy(num_classes), teacher_agreement(num_classes)])
+        student.fit(train_dataset, validation_data=val_dataset, epochs=prune_epochs, callbacks=[pruning], verbose=2)
+        info["sparsity"] = pruning.sparsity()
+    info["train_seconds"] = time.perf_counter() - start
+    return with_softmax(student), info
+
+
+# --- Edge Profile of a .tflite Model ---
+def _builtin_ops(interpreter):
+    # DELEGATE nodes (XNNPACK) are appended to the op list and still reference the tensors of the
+    # ops they replaced, which would stretch those tensors' lifetimes to the end of the graph
+    return [op for op in interpreter._get_ops_details() if op['op_name'] != 'DELEGATE']
+
+
+def _tensor_bytes(tensor):
+    return int(np.prod(tensor['shape'])) * np.dtype(tensor['dtype']).itemsize
+
+
+def arena_estimate(interpreter):
+    """
+    Peak bytes of activation tensors alive at the same time when the ops run in order, which is
+    what the TFLite Micro memory planner packs into the tensor arena (plus a fixed overhead).
+    Weights are not counted: they are read from flash.
+    """
+    ops = _builtin_ops(interpreter)
+    tensors = {tensor['index']: tensor for tensor in interpreter.get_tensor_details()}
+    model_inputs = [detail['index'] for detail in interpreter.get_input_details()]
+    model_outputs = [detail['index'] for detail in interpreter.get_output_details()]
+    activations = set(model_inputs) | {int(index) for op in ops for index in op['outputs']}
+
+    first_use, last_use = {index: 0 for index in model_inputs}, {}
+    for position, op in enumerate(ops):
+        for index in list(op['inputs']) + list(op['outputs']):
+            index = int(index)
+            if index in activations:
+                first_use.setdefault(index, position)
+                last_use[index] = position
+    for index in model_outputs:
+        last_use[index] = len(ops)
+
+    peak = 0
+    for position in range(len(ops)):
+        live = sum(_tensor_bytes(tensors[index]) for index in activations
+                   if first_use[index] <= position <= last_use.get(index, position))
+        peak = max(peak, live)
+    return peak + ARENA_OVERHEAD_BYTES
+
+
+def multiply_accumulates(interpreter):
+    """MACs of the conv, depthwise conv and fully connected ops, i.e. nearly all of the compute."""
+    tensors = {tensor['index']: tensor for tensor in interpreter.get_tensor_details()}
+    total = 0
+    for op in _builtin_ops(interpreter):
+        name = op['op_name']
+        if name not in ('CONV_2D', 'DEPTHWISE_CONV_2D', 'FULLY_CONNECTED'):
+            continue
+        output_elements = int(np.prod(tensors[int(op['outputs'][0])]['shape']))
+        filter_shape = tensors[int(op['inputs'][1])]['shape']
+        if name == 'DEPTHWISE_CONV_2D': # [1, kh, kw, channels]: one kh * kw window per output
+            total += output_elements * int(np.prod(filter_shape[1:3]))
+        else: # [out, kh, kw, in] or [out, in]
+            total += output_elements * int(np.prod(filter_shape[1:]))
+    return total
+
+
+def weight_sparsity(interpreter):
+    """Fraction of zeros in the int8 conv / fully connected weights of the converted model."""
+    tensors = {tensor['index']: tensor for tensor in interpreter.get_tensor_details()}
+    zeros = total = 0
+    for op in _builtin_ops(interpreter):
+        if op['op_name'] in ('CONV_2D', 'FULLY_CONNECTED'):
+            tensor = tensors[int(op['inputs'][1])]
+            try:
+                weights = interpreter.get_tensor(tensor['index'])
+            except ValueError:
+                continue
+            zeros += int(np.count_nonzero(weights == 0))
+            total += weights.size
+    return zeros / total if total else 0.0
+
+
+def edge_profile(tflite_path, latency_inputs=None, latency_runs=LATENCY_RUNS):
+    """Flash size, arena estimate, MACs, estimated device FPS and host CPU latency of one .tflite."""
+    from convert_to_tflite import time_single_image
+    from inference_backends import TFLiteBackend
+
+    # Plain builtin kernels, as on the device: no XNNPACK rewrite of the graph being measured
+    interpreter = tf.lite.Interpreter(
+        model_path=tflite_path,
+        experimental_op_resolver_type=tf.lite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+    interpreter.allocate_tensors()
+    with open(tflite_path, 'rb') as f:
+        model_bytes = f.read()
+    macs = multiply_accumulates(interpreter)
+    profile = {
+        "flash_bytes": len(model_bytes),
+        # Zeros from pruning do not shrink the flatbuffer; they show up once the array is compressed
+        "gzip_bytes": len(gzip.compress(model_bytes, compresslevel=9)),
+        "arena_bytes": arena_estimate(interpreter),
+        "macs": macs,
+        "weight_sparsity": weight_sparsity(interpreter),
+        "device_fps_estimate": DEVICE_MACS_PER_SECOND / macs if macs else None,
+    }
+    if latency_inputs is None:
+        input_shape = tuple(int(d) for d in interpreter.get_input_details()[0]['shape'][1:])
+        latency_inputs = np.random.default_rng(0).random((8,) + input_shape, dtype=np.float32)
+    backend = TFLiteBackend(tflite_path, pool_size=1, num_threads=1)
+    profile["host_latency"] = time_single_image(backend.predict, latency_inputs, latency_runs)
+    return profile
+
+
+def fits_budget(profile, flash_budget=FLASH_BUDGET_BYTES, arena_budget=ARENA_BUDGET_BYTES, target_fps=TARGET_FPS):
+    return (profile["flash_bytes"] <= flash_budget and profile["arena_bytes"] <= arena_budget
+            and (profile["device_fps_estimate"] or 0) >= target_fps)
+
+
+# --- Evaluation Against the Teacher ---
+def evaluate_candidate(tflite_path, image_size, val_paths, val_labels, teacher_predictions, class_names):
+    from convert_to_tflite import load_model_input
+    from inference_backends import TFLiteBackend
+    inputs = np.stack([load_model_input(path, image_size) for path in val_paths])
+    predictions = np.argmax(TFLiteBackend(tflite_path, pool_size=1, num_threads=1).predict_batch(inputs), axis=1)
+    labels = np.asarray(val_labels)
+    per_class = {}
+    for label, class_name in enumerate(class_names):
+        mask = labels == label
+        if mask.any():
+            per_class[class_name] = {"images": int(mask.sum()),
+                                     "student_accuracy": float(np.mean(predictions[mask] == label)),
+                                     "teacher_accuracy": float(np.mean(teacher_predictions[mask] == label))}
+    return {
+        "images": int(len(labels)),
+        "teacher_agreement": float(np.mean(predictions == teacher_predictions)),
+        "student_accuracy": float(np.mean(predictions == labels)),
+        "teacher_accuracy": float(np.mean(teacher_predictions == labels)),
+        "per_class": per_class,
+    }, inputs
+
+
+def select_candidate(results, flash_budget=FLASH_BUDGET_BYTES, arena_budget=ARENA_BUDGET_BYTES, target_fps=TARGET_FPS):
+    """Highest teacher agreement among the candidates within every budget; ties go to the smaller model."""
+    fitting = [result for result in results if fits_budget(result["profile"], flash_budget, arena_budget, target_fps)]
+    if not fitting:
+        return None
+    return max(fitting, key=lambda result: (result["evaluation"]["teacher_agreement"], -result["profile"]["flash_bytes"]))
+
+
+def print_profile(name, profile, evaluation=None):
+    line = (f"{name:<18} flash {profile['flash_bytes'] / 1024:>7.0f} KB (gzip {profile['gzip_bytes'] / 1024:.0f} KB) | "
+            f"arena {profile['arena_bytes'] / 1024:>6.0f} KB | {profile['macs'] / 1e6:>6.1f} M MACs "
+            f"~{profile['device_fps_estimate'] or 0:.1f} FPS on device | host {profile['host_latency']['p50_ms']:.1f} ms p50")
+    if profile["weight_sparsity"] > 0.01:
+        line += f" | sparsity {profile['weight_sparsity'] * 100:.0f}%"
+    if evaluation:
+        line += (f" | agreement {evaluation['teacher_agreement'] * 100:.1f}% "
+                 f"acc {evaluation['student_accuracy'] * 100:.1f}% (teacher {evaluation['teacher_accuracy'] * 100:.1f}%)")
+    print(line)
+
+
+# --- Pipeline ---
+def run(args):
+    from class_labels import labels_path_for, load_labels, save_labels
+    from convert_to_tflite import convert, quantization_metadata, stratified_sample
+    from tfdata_pipeline import list_image_files, split_train_validation
+    from tflite_to_header import write_header
+
+    if args.manifest:
+        from dataset_index import load_manifest
+        paths, labels, class_names = load_manifest(args.manifest, args.data_dir)
+    else:
+        paths, labels, class_names = list_image_files(args.data_dir)
+    (train_paths, train_labels), (val_paths, val_labels) = split_train_validation(paths, labels, VALIDATION_SPLIT)
+    num_classes = len(class_names)
+    candidates = CANDIDATES
+    if args.candidates:
+        with open(args.candidates, 'r', encoding='utf-8') as f:
+            candidates = json.load(f)
+
+    print(f"Loading teacher from {args.teacher}")
+    teacher = tf.keras.models.load_model(args.teacher)
+    split_paths = train_paths + val_paths
+    probs = teacher_probabilities(teacher, args.teacher, split_paths, train_labels + val_labels, num_classes,
+                                  os.path.join(args.output_dir, 'teacher_soft_labels.npz'))
+    del teacher
+    one_hot = tf.keras.utils.to_categorical(train_labels + val_labels, num_classes)
+    targets = np.concatenate([one_hot, probs], axis=1).astype(np.float32)
+    train_targets, val_targets = targets[:len(train_paths)], targets[len(train_paths):]
+    teacher_predictions = np.argmax(probs[len(train_paths):], axis=1)
+    calibration_paths = stratified_sample(train_paths, train_labels, args.calibration_samples)
+
+    weights = None if args.from_scratch else STUDENT_WEIGHTS
+    results = []
+    for candidate in candidates:
+        print(f"\n--- Candidate {candidate['name']}: alpha {candidate['alpha']}, "
+              f"{candidate['image_size']}px, sparsity {candidate.get('sparsity', 0.0)} ---")
+        candidate_dir = os.path.join(args.output_dir, candidate['name'])
+        os.makedirs(candidate_dir, exist_ok=True)
+        student, training = distill_candidate(candidate, num_classes, train_paths, train_targets, val_paths,
+                                              val_targets, epochs=args.epochs, prune_epochs=args.prune_epochs,
+                                              weights=weights)
+        student.save(os.path.join(candidate_dir, 'student.h5'))
+        tflite_path = os.path.join(candidate_dir, 'student_int8.tflite')
+        with open(tflite_path, 'wb') as f:
+            f.write(convert(student, 'int8', calibration_paths=calibration_paths))
+
+        image_size = (candidate['image_size'], candidate['image_size'])
+        evaluation, inputs = evaluate_candidate(tflite_path, image_size, val_paths, val_labels,
+                                                teacher_predictions, class_names)
+        profile = edge_profile(tflite_path, latency_inputs=inputs[:LATENCY_RUNS], latency_runs=args.latency_runs)
+        print_profile(candidate['name'], profile, evaluation)
+        results.append({"candidate": candidate, "tflite_path": tflite_path, "training": training,
+                        "profile": profile, "evaluation": evaluation})
+
+    print(f"\n--- Candidates (budgets: flash {args.flash_budget_kb} KB, arena {args.arena_budget_kb} KB, "
+          f"{args.target_fps} FPS) ---")
+    for result in results:
+        print_profile(result["candidate"]["name"], result["profile"], result["evaluation"])
+    chosen = select_candidate(results, args.flash_budget_kb * 1024, args.arena_budget_kb * 1024, args.target_fps)
+    report = {"teacher": args.teacher, "budgets": {"flash_bytes": args.flash_budget_kb * 1024,
+                                                   "arena_bytes": args.arena_budget_kb * 1024,
+                                                   "target_fps": args.target_fps},
+              "candidates": results, "selected": chosen["candidate"]["name"] if chosen else None}
+    report_path = os.path.join(args.output_dir, 'edge_report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved to: {report_path}")
+
+    if chosen is None:
+        print("No candidate fits every budget. Add smaller candidates (--candidates) or relax the budgets.")
+        return
+
+    # --- Ship the selected student: .tflite + labels.json + C++ header ---
+    shutil.copyfile(chosen["tflite_path"], args.edge_model)
+    class_indices = {name: index for index, name in enumerate(class_names)}
+    labels_path = labels_path_for(args.edge_model)
+    tflite_models = {}
+    if os.path.exists(labels_path):
+        tflite_models = load_labels(labels_path).get("model_info", {}).get("tflite_models", {})
+    # The student's input size goes with its own entry: the top-level input_size belongs to the full model
+    image_size = chosen["candidate"]["image_size"]
+    tflite_models[os.path.basename(args.edge_model)] = dict(quantization_metadata(args.edge_model, 'int8'),
+                                                            input_size=[image_size, image_size],
+                                                            distilled_from=os.path.basename(args.teacher))
+    save_labels(labels_path, class_indices, model_info={"tflite_models": tflite_models})
+    size, crc = write_header(args.edge_model, args.header)
+    print(f"\nSelected '{chosen['candidate']['name']}': {args.edge_model} and {args.header} "
+          f"({size} bytes, CRC32 0x{crc:08x}).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distil the pig disease model into small INT8 students for the ESP32-CAM.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Distil, prune and convert every candidate, then pick one")
+    run_parser.add_argument('--teacher', default=TEACHER_MODEL_PATH)
+    run_parser.add_argument('--data-dir', default=os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER))
+    run_parser.add_argument('--manifest', default=None, help="Take the file list from a dataset_index.py manifest")
+    run_parser.add_argument('--candidates', default=None, help="JSON list of candidates (default: CANDIDATES in this file)")
+    run_parser.add_argument('--epochs', type=int, default=DISTILL_EPOCHS)
+    run_parser.add_argument('--prune-epochs', type=int, default=PRUNE_EPOCHS)
+    run_parser.add_argument('--from-scratch', action='store_true', help="Do not start the students from ImageNet weights")
+    run_parser.add_argument('--calibration-samples', type=int, default=200)
+    run_parser.add_argument('--latency-runs', type=int, default=LATENCY_RUNS)
+    run_parser.add_argument('--flash-budget-kb', type=int, default=FLASH_BUDGET_BYTES // 1024)
+    run_parser.add_argument('--arena-budget-kb', type=int, default=ARENA_BUDGET_BYTES // 1024)
+    run_parser.add_argument('--target-fps', type=float, default=TARGET_FPS)
+    run_parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    run_parser.add_argument('--edge-model', default=EDGE_MODEL_PATH)
+    run_parser.add_argument('--header', default=HEADER_FILE_PATH)
+
+    profile_parser = subparsers.add_parser('profile', help="Flash, arena, compute and latency of existing .tflite files")
+    profile_parser.add_argument('models', nargs='+')
+    profile_parser.add_argument('--latency-runs', type=int, default=LATENCY_RUNS)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        if not os.path.exists(args.teacher):
+            print(f"Error: teacher model '{args.teacher}' not found. Run train_pig_detector.py first.")
+            exit()
+        os.makedirs(args.output_dir, exist_ok=True)
+        run(args)
+    else:
+        for model_path in args.models:
+            profile = edge_profile(model_path, latency_runs=args.latency_runs)
+            print_profile(os.path.basename(model_path), profile)
+            status = "fits" if fits_budget(profile) else "does not fit"
+            print(f"  -> {status} the default ESP32-CAM budgets")
+
+
+if __name__ == "__main__":
+    main()
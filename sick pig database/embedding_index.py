@@ -0,0 +1,400 @@
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+# --- Configuration ---
+DATASET_ROOT_PATH = 'C:/Users/Alfred/Desktop/sick pig database'
+DATA_SUBFOLDER = 'category'
+INDEX_DIR = 'embedding_index'
+INDEX_FILENAME = 'index.json'
+SEARCH_DIM = 128 # PCA dimensions of the in-memory search vectors; full 1280-d vectors are only used to re-rank
+RERANK_FACTOR = 16 # Candidates re-ranked exactly per requested neighbour
+IVF_MIN_REFERENCES = 4096 # Below this an exact scan is already fast enough; above it the index is partitioned
+IVF_NPROBE = 8 # Partitions searched per query
+IVF_ITERATIONS = 20
+KNN_K = 7
+KNN_TEMPERATURE = 0.05 # Softmax temperature over neighbour similarities in the kNN classifier
+EMBEDDING_SIGNATURE = "MobileNetV2-imagenet-avgpool" # Same as feature_cache.py; the served model must have it frozen
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def top_k(scores, k):
+    """Indices of the k largest scores, best first (argpartition, then a sort of only those k)."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(scores, -k)[-k:] if k < len(scores) else np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def kmeans(vectors, num_lists, iterations=IVF_ITERATIONS, seed=0):
+    """Spherical k-means on unit vectors; returns (centroids, assignment)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for index in range(num_lists):
+            members = vectors[assignment == index]
+            # An emptied partition is re-seeded on a random vector rather than dropped
+            centroids[index] = members.sum(axis=0) if len(members) else vectors[rng.integers(len(vectors))]
+        centroids = normalize_rows(centroids)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+# --- Building ---
+def build_index(embeddings, references, index_dir, search_dim=SEARCH_DIM, ivf_lists=None):
+    """
+    Writes an index for `embeddings` (n, 1280) with one reference dict ({"path", "label", ...})
+    per row. Rows are L2-normalized and stored as float16 (embeddings-<build>.npy). A PCA
+    projection to search_dim and the projected search vectors (also float16 on disk) make the
+    first, approximate pass cheap; with ivf_lists the rows are grouped by k-means partition so
+    each partition is one contiguous slice. index.json is replaced last, so a reader never
+    sees a half-written build.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    vectors = normalize_rows(embeddings)
+    count, dim = vectors.shape
+    if ivf_lists is None:
+        ivf_lists = int(np.sqrt(count)) if count >= IVF_MIN_REFERENCES else 0
+
+    search_dim = min(search_dim, dim, count)
+    mean = vectors.mean(axis=0)
+    # Principal directions of the centred unit vectors (SVD of a sample is plenty for the projection)
+    sample = vectors[np.random.default_rng(0).choice(count, min(count, 20000), replace=False)] - mean
+    projection = np.linalg.svd(sample, full_matrices=False)[2][:search_dim].T.astype(np.float32)
+    search = normalize_rows((vectors - mean) @ projection)
+
+    centroids = np.zeros((0, search_dim), dtype=np.float32)
+    offsets = np.array([0, count], dtype=np.int64)
+    if ivf_lists:
+        centroids, assignment = kmeans(search, ivf_lists)
+        order = np.argsort(assignment, kind='stable')
+        vectors, search = vectors[order], search[order]
+        references = [references[row] for row in order]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=ivf_lists))]).astype(np.int64)
+
+    build_id = uuid.uuid4().hex[:12]
+    files = {"embeddings": f"embeddings-{build_id}.npy", "search": f"search-{build_id}.npy",
+             "quantizer": f"quantizer-{build_id}.npz"}
+    np.save(os.path.join(index_dir, files["embeddings"]), vectors.astype(np.float16))
+    np.save(os.path.join(index_dir, files["search"]), search.astype(np.float16))
+    np.savez(os.path.join(index_dir, files["quantizer"]), mean=mean, projection=projection,
+             centroids=centroids, offsets=offsets)
+
+    meta = {"build_id": build_id, "signature": EMBEDDING_SIGNATURE, "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "count": count, "dim": dim, "search_dim": search_dim, "ivf_lists": int(ivf_lists), "files": files,
+            "references": references}
+    index_path = os.path.join(index_dir, INDEX_FILENAME)
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(index_path + '.tmp', index_path)
+
+    # Old builds go once nothing points at them (a reader may still have one mapped on Windows; retried next build)
+    for filename in os.listdir(index_dir):
+        if filename.endswith(('.npy', '.npz')) and build_id not in filename:
+            try:
+                os.remove(os.path.join(index_dir, filename))
+            except OSError:
+                pass
+    return meta
+
+
+class _Snapshot:
+    """One immutable build of the index; EmbeddingIndex swaps whole snapshots on reload."""
+
+    def __init__(self, index_dir, meta):
+        files = meta["files"]
+        self.meta = meta
+        self.references = meta["references"]
+        self.embeddings = np.load(os.path.join(index_dir, files["embeddings"]), mmap_mode='r') # float16, for re-ranking
+        self.search = np.load(os.path.join(index_dir, files["search"])).astype(np.float32) # Small; kept in RAM
+        with np.load(os.path.join(index_dir, files["quantizer"])) as quantizer:
+            self.mean = quantizer["mean"]
+            self.projection = quantizer["projection"]
+            self.centroids = quantizer["centroids"]
+            self.offsets = quantizer["offsets"]
+        self.class_names = sorted({reference["label"] for reference in self.references})
+        self.labels = np.array([self.class_names.index(reference["label"]) for reference in self.references])
+
+
+# --- Querying ---
+class EmbeddingIndex:
+    """
+    Cosine nearest-neighbour search over reference image embeddings.
+
+    A query is projected into the PCA search space and scored against the in-memory search
+    vectors (only the nprobe closest partitions when the index is partitioned), the best
+    k * RERANK_FACTOR candidates are re-scored exactly against the memory-mapped float16
+    1280-d vectors, and the top k returned. classify() turns the neighbours into a kNN class
+    vote over the labels in the index, so a new class only needs `embedding_index.py add`.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, nprobe=IVF_NPROBE):
+        self.index_dir = index_dir
+        self.nprobe = nprobe
+        self._index_path = os.path.join(index_dir, INDEX_FILENAME)
+        self._snapshot = None
+        self._mtime = None
+        self._watching = False
+        self.reload()
+
+    def reload(self):
+        """Loads the current build; returns False if there is none or it has not changed."""
+        if not os.path.exists(self._index_path):
+            return False
+        mtime = os.stat(self._index_path).st_mtime_ns
+        if mtime == self._mtime:
+            return False
+        with open(self._index_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self._snapshot = _Snapshot(self.index_dir, meta) # The swap; searches already running keep the old one
+        self._mtime = mtime
+        return True
+
+    def start_watching(self, interval_seconds=5.0, on_reload=None):
+        """Picks up rebuilds (e.g. after `embedding_index.py add`) without a restart."""
+        if self._watching or interval_seconds <= 0:
+            return
+        self._watching = True
+
+        def watch():
+            while self._watching:
+                time.sleep(interval_seconds)
+                try:
+                    if self.reload():
+                        print(f"Embedding index reloaded ({len(self)} references, classes {self.class_names}).")
+                        if on_reload is not None:
+                            on_reload(self)
+                except Exception as e:
+                    print(f"Embedding index reload failed: {e}")
+
+        threading.Thread(target=watch, name='embedding-index-watch', daemon=True).start()
+
+    @property
+    def class_names(self):
+        return self._snapshot.class_names if self._snapshot is not None else []
+
+    def __len__(self):
+        return len(self._snapshot.references) if self._snapshot is not None else 0
+
+    def _candidates(self, snapshot, query, count):
+        query_search = (query - snapshot.mean) @ snapshot.projection
+        query_search /= max(float(np.linalg.norm(query_search)), 1e-12)
+        if len(snapshot.centroids):
+            # Each partition is a contiguous slice, so it is scored in place without gathering rows
+            spans = [(snapshot.offsets[index], snapshot.offsets[index + 1])
+                     for index in top_k(snapshot.centroids @ query_search, self.nprobe)]
+            scores = np.concatenate([snapshot.search[start:end] @ query_search for start, end in spans])
+            rows = np.concatenate([np.arange(start, end) for start, end in spans])
+            return rows[top_k(scores, count)]
+        return top_k(snapshot.search @ query_search, count)
+
+    def search(self, embedding, k=5, exclude_rows=None):
+        """[(row, cosine similarity)] of the k nearest references, best first."""
+        snapshot = self._snapshot
+        if snapshot is None or k <= 0:
+            return []
+        query = normalize_rows(embedding)
+        rows = self._candidates(snapshot, query, k * RERANK_FACTOR + (len(exclude_rows) if exclude_rows else 0))
+        if exclude_rows:
+            rows = rows[~np.isin(rows, list(exclude_rows))]
+        rows = np.sort(rows) # Sorted reads from the memmap
+        exact = snapshot.embeddings[rows].astype(np.float32) @ query
+        best = top_k(exact, k)
+        return [(int(rows[index]), float(exact[index])) for index in best]
+
+    @staticmethod
+    def _describe(snapshot, neighbours):
+        return [{"label": snapshot.references[row]["label"], "image": snapshot.references[row]["path"],
+                 "similarity": round(score, 4)} for row, score in neighbours]
+
+    def similar(self, embedding, k=5):
+        """Nearest reference images as JSON-ready dicts ({"label", "image", "similarity"})."""
+        snapshot = self._snapshot
+        return self._describe(snapshot, self.search(embedding, k)) if snapshot is not None else []
+
+    def classify(self, embedding, k=KNN_K, temperature=KNN_TEMPERATURE, exclude_rows=None):
+        """
+        kNN vote: a softmax over the neighbours' similarities, summed per label. Returns
+        (probabilities, class_names, neighbours as in similar()), all from the same build.
+        """
+        snapshot = self._snapshot
+        neighbours = self.search(embedding, k, exclude_rows=exclude_rows)
+        probabilities = np.zeros(len(snapshot.class_names), dtype=np.float32)
+        if neighbours:
+            rows = np.array([row for row, _ in neighbours])
+            scores = np.array([score for _, score in neighbours], dtype=np.float32)
+            weights = np.exp((scores - scores.max()) / temperature)
+            np.add.at(probabilities, snapshot.labels[rows], weights)
+            probabilities /= probabilities.sum()
+        return probabilities, snapshot.class_names, self._describe(snapshot, neighbours)
+
+    def stats(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"references": 0}
+        meta = snapshot.meta
+        counts = np.bincount(snapshot.labels, minlength=len(snapshot.class_names))
+        return {"references": meta["count"], "build_id": meta["build_id"], "built_at": meta["built_at"],
+                "search_dim": meta["search_dim"], "ivf_lists": meta["ivf_lists"], "nprobe": self.nprobe,
+                "per_class": {name: int(count) for name, count in zip(snapshot.class_names, counts)}}
+
+
+# --- Embedding Images ---
+def embed_paths(paths, feature_store_dir=None, num_variants=0):
+    """
+    Plain (un-augmented) pooled embeddings for image files. With a feature store the store is
+    reused and refreshed (only new or changed files run through the backbone).
+    """
+    from feature_cache import FeatureStore, embed_images, IMAGE_SIZE
+    if feature_store_dir:
+        store = FeatureStore(feature_store_dir, num_variants=num_variants)
+        hashes = store.update(paths)
+        return np.asarray(store.lookup(hashes, variants=False), dtype=np.float32), hashes
+    return embed_images(paths, IMAGE_SIZE, 0)[:, 0], [None] * len(paths)
+
+
+def load_references(index_dir):
+    """Existing (float32 embeddings, references) of an index, to extend it."""
+    index = EmbeddingIndex(index_dir)
+    if index._snapshot is None:
+        return np.zeros((0, 0), dtype=np.float32), []
+    return np.asarray(index._snapshot.embeddings, dtype=np.float32), list(index._snapshot.references)
+
+
+def leave_one_out(index, k=KNN_K):
+    """kNN accuracy per class with every reference classified by the others (identical files excluded)."""
+    snapshot = index._snapshot
+    by_hash = {}
+    for row, reference in enumerate(snapshot.references):
+        if reference.get("hash"):
+            by_hash.setdefault(reference["hash"], []).append(row)
+    correct = np.zeros(len(snapshot.class_names))
+    totals = np.bincount(snapshot.labels, minlength=len(snapshot.class_names))
+    for row, reference in enumerate(snapshot.references):
+        exclude = set(by_hash.get(reference.get("hash"), [])) | {row}
+        probabilities, _, _ = index.classify(np.asarray(snapshot.embeddings[row], dtype=np.float32), k,
+                                             exclude_rows=exclude)
+        correct[snapshot.labels[row]] += int(np.argmax(probabilities) == snapshot.labels[row])
+    return {name: {"images": int(total), "knn_recall": float(hit / total) if total else None}
+            for name, total, hit in zip(snapshot.class_names, totals, correct)}
+
+
+def benchmark(index_dir, references=20000, queries=500, k=5, noise=0.02, seed=0):
+    """
+    Query latency at a larger scale: synthesizes `references` rows as random blends of two real
+    embeddings (plus a little noise), builds a scratch index next to the real one and reports
+    p50/p99 query time and recall@k against an exact float32 scan.
+    """
+    embeddings, base_references = load_references(index_dir)
+    rng = np.random.default_rng(seed)
+
+    def blends(count):
+        first, second = rng.integers(0, len(embeddings), count), rng.integers(0, len(embeddings), count)
+        weights = rng.uniform(0.0, 1.0, (count, 1))
+        mixed = weights * embeddings[first] + (1.0 - weights) * embeddings[second]
+        return normalize_rows(mixed + noise / np.sqrt(embeddings.shape[1]) * rng.standard_normal(mixed.shape)), first
+
+    vectors, rows = blends(references)
+    scratch_dir = os.path.join(index_dir, 'benchmark')
+    build_index(vectors, [dict(base_references[row], path=f"synthetic-{i}") for i, row in enumerate(rows)], scratch_dir)
+    index = EmbeddingIndex(scratch_dir)
+    exact_vectors = np.asarray(index._snapshot.embeddings, dtype=np.float32)
+    query_vectors, _ = blends(queries)
+    for query in query_vectors[:20]:
+        index.search(query, k) # Warm-up
+    timings, recalls = [], []
+    for query in query_vectors:
+        start = time.perf_counter()
+        found = index.search(query, k)
+        timings.append((time.perf_counter() - start) * 1000.0)
+        truth = set(top_k(exact_vectors @ query, k).tolist())
+        recalls.append(len(truth & {row for row, _ in found}) / k)
+    return {"references": references, "ivf_lists": index.stats()["ivf_lists"], "search_dim": index.stats()["search_dim"],
+            "p50_ms": round(float(np.percentile(timings, 50)), 3), "p99_ms": round(float(np.percentile(timings, 99)), 3),
+            f"recall_at_{k}": round(float(np.mean(recalls)), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the reference image embedding index.")
+    parser.add_argument('--index-dir', default=INDEX_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Index every image of the dataset")
+    build_parser.add_argument('--data-dir', default=os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER))
+    build_parser.add_argument('--manifest', default=None, help="Take the file list from a dataset_index.py manifest")
+    build_parser.add_argument('--feature-store', default='feature_store', help="Reuse/refresh this feature store")
+    build_parser.add_argument('--feature-variants', type=int, default=None,
+                              help="Variants of the feature store (default: feature_cache.py's)")
+    build_parser.add_argument('--ivf-lists', type=int, default=None,
+                              help=f"Partitions (default: sqrt(n) from {IVF_MIN_REFERENCES} references, else none)")
+
+    add_parser = subparsers.add_parser('add', help="Add images under a (possibly new) label, no retraining")
+    add_parser.add_argument('--label', required=True)
+    add_parser.add_argument('images', nargs='+')
+
+    query_parser = subparsers.add_parser('query', help="Nearest references and kNN class of an image")
+    query_parser.add_argument('image')
+    query_parser.add_argument('-k', type=int, default=5)
+
+    subparsers.add_parser('evaluate', help="Leave-one-out kNN recall per class")
+    bench_parser = subparsers.add_parser('benchmark', help="Query latency and recall at a larger synthetic scale")
+    bench_parser.add_argument('--references', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from feature_cache import NUM_AUGMENTED_VARIANTS
+        if args.manifest:
+            from dataset_index import load_manifest
+            paths, labels, class_names = load_manifest(args.manifest, args.data_dir)
+        else:
+            from tfdata_pipeline import list_image_files
+            paths, labels, class_names = list_image_files(args.data_dir)
+        variants = NUM_AUGMENTED_VARIANTS if args.feature_variants is None else args.feature_variants
+        embeddings, hashes = embed_paths(paths, args.feature_store, variants)
+        # Identical files under the same label add nothing; the same file under two labels is kept
+        keep, seen = [], set()
+        for row, (content_hash, label) in enumerate(zip(hashes, labels)):
+            if (content_hash, label) not in seen:
+                seen.add((content_hash, label))
+                keep.append(row)
+        references = [{"path": os.path.relpath(paths[row], args.data_dir), "label": class_names[labels[row]],
+                       "hash": hashes[row]} for row in keep]
+        meta = build_index(embeddings[keep], references, args.index_dir, ivf_lists=args.ivf_lists)
+        print(f"Indexed {meta['count']} images ({len(paths) - len(keep)} same-label duplicates skipped) "
+              f"into '{args.index_dir}' (search dim {meta['search_dim']}, {meta['ivf_lists']} partitions).")
+    elif args.command == 'add':
+        embeddings, references = load_references(args.index_dir)
+        new_embeddings, _ = embed_paths(args.images)
+        new_references = [{"path": os.path.abspath(path), "label": args.label, "hash": None} for path in args.images]
+        combined = np.concatenate([embeddings, new_embeddings]) if len(references) else new_embeddings
+        meta = build_index(combined, references + new_references, args.index_dir)
+        print(f"Added {len(args.images)} images as '{args.label}'; the index now has {meta['count']} references. "
+              f"A running server picks the rebuild up by itself.")
+    elif args.command == 'query':
+        index = EmbeddingIndex(args.index_dir)
+        embedding, _ = embed_paths([args.image])
+        probabilities, class_names, _ = index.classify(embedding[0])
+        for result in index.similar(embedding[0], args.k):
+            print(f"{result['similarity']:.3f}  {result['label']:<20} {result['image']}")
+        best = int(np.argmax(probabilities))
+        print(f"kNN class: {class_names[best]} ({probabilities[best]:.1%})")
+    elif args.command == 'evaluate':
+        for name, row in leave_one_out(EmbeddingIndex(args.index_dir)).items():
+            print(f"{name:<20} {row['images']:>5} images  kNN recall {row['knn_recall']:.1%}")
+    else:
+        print(json.dumps(benchmark(args.index_dir, references=args.references), indent=2))
+
+
+if __name__ == "__main__":
+    main()
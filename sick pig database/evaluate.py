@@ -0,0 +1,447 @@
+import argparse
+import io
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from class_labels import DEFAULT_CONFIDENCE_THRESHOLD, LABELS_FILENAME, labels_path_for, load_labels
+
+# --- Configuration ---
+DATASET_ROOT_PATH = 'C:/Users/Alfred/Desktop/sick pig database'
+DATA_SUBFOLDER = 'category'
+MODEL_PATH = 'pig_disease_detector_model.h5'
+CACHE_PATH = 'evaluation_cache.sqlite' # Per-image predictions keyed by (model hash, image content hash)
+VALIDATION_SPLIT = 0.2 # Same split as training, for --split validation / train
+EVAL_BATCH_SIZE = 32 # Keras models run in batches of this size; TFLite runs one image at a time
+CALIBRATION_BINS = 10
+TARGET_PRECISION = 0.9 # The report suggests, per class, the lowest threshold reaching this precision
+# Bumped when decoding or preprocessing changes, so cached predictions made the old way are not reused
+PREPROCESSING_SIGNATURE = 'decode_frame+nearest/255'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,       -- absolute path of an image or model file
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS predictions (
+    model_key TEXT NOT NULL,     -- model file sha256 + preprocessing signature
+    image_sha256 TEXT NOT NULL,
+    probabilities BLOB,          -- float32 vector in model output order; NULL if the image did not decode
+    format TEXT,                 -- PIL format name (JPEG, PNG, WEBP, ...)
+    bytes INTEGER,
+    decode_ms REAL,              -- decode + resize + scale to model input, single thread
+    inference_ms REAL,           -- per image (batch time / batch size for Keras)
+    error TEXT,
+    evaluated_at REAL NOT NULL,
+    PRIMARY KEY (model_key, image_sha256)
+);
+"""
+
+
+# --- 1. Hashing (skips files whose mtime and size are unchanged) ---
+def open_cache(cache_path):
+    connection = sqlite3.connect(cache_path)
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def hash_files(connection, paths):
+    from feature_cache import file_sha256
+    known = {path: (mtime, size, sha256) for path, mtime, size, sha256 in
+             connection.execute("SELECT path, mtime, size, sha256 FROM files")}
+    hashes, changed = [], []
+    for path in paths:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = known.get(path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            hashes.append(cached[2])
+            continue
+        content_hash = file_sha256(path)
+        changed.append((path, stat.st_mtime, stat.st_size, content_hash))
+        hashes.append(content_hash)
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO files (path, mtime, size, sha256) VALUES (?, ?, ?, ?)", changed)
+    return hashes
+
+
+def model_key(connection, model_path):
+    return f"{hash_files(connection, [model_path])[0]}:{PREPROCESSING_SIGNATURE}"
+
+
+# --- 2. Incremental Scoring ---
+def cached_predictions(connection, key):
+    rows = connection.execute("SELECT image_sha256, probabilities, format, bytes, decode_ms, inference_ms, error "
+                              "FROM predictions WHERE model_key = ?", (key,))
+    cached = {}
+    for image_hash, blob, image_format, size, decode_ms, inference_ms, error in rows:
+        cached[image_hash] = {"probabilities": None if blob is None else np.frombuffer(blob, dtype=np.float32),
+                              "format": image_format, "bytes": size, "decode_ms": decode_ms,
+                              "inference_ms": inference_ms, "error": error}
+    return cached
+
+
+def load_model_backend(model_path):
+    from inference_backends import load_backend
+    backend_name = 'tflite' if model_path.lower().endswith('.tflite') else 'keras'
+    return load_backend(backend_name, keras_model_path=model_path, tflite_model_path=model_path,
+                        tflite_pool_size=1, tflite_num_threads=1)
+
+
+def decode_timed(path, image_size):
+    from PIL import Image
+    from image_pipeline import decode_frame, to_model_input
+    with open(path, 'rb') as f:
+        contents = f.read()
+    record = {"format": None, "bytes": len(contents), "decode_ms": None, "error": None}
+    try:
+        record["format"] = Image.open(io.BytesIO(contents)).format # Header only
+        start = time.perf_counter()
+        sample = to_model_input(decode_frame(contents, target_size=image_size), image_size)
+        record["decode_ms"] = (time.perf_counter() - start) * 1000.0
+        return sample, record
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return None, record
+
+
+def score_missing(connection, key, model_path, paths, hashes, cached, num_classes, batch_size=EVAL_BATCH_SIZE):
+    """
+    Runs the model on the images whose content hash has no cached prediction for this model,
+    and stores the results. The model is only loaded when there is something to score.
+    Raises ValueError, before anything is stored, if the model's output width is not num_classes.
+    Returns the number of images scored.
+    """
+    todo = {}
+    for path, image_hash in zip(paths, hashes):
+        if image_hash not in cached and image_hash not in todo:
+            todo[image_hash] = path
+    if not todo:
+        return 0
+
+    print(f"Scoring {len(todo)} new or changed images with {os.path.basename(model_path)} "
+          f"({len(cached)} cached)...")
+    backend = load_model_backend(model_path)
+    image_size = tuple(backend.input_shape[:2])
+    step = batch_size if backend.supports_batching else 1
+    pending = list(todo.items())
+    now = time.time()
+    for start in range(0, len(pending), step):
+        chunk = pending[start:start + step]
+        samples, records, rows = [], [], []
+        for image_hash, path in chunk:
+            sample, record = decode_timed(path, image_size)
+            if sample is None:
+                rows.append((key, image_hash, None, record["format"], record["bytes"], None, None, record["error"], now))
+                cached[image_hash] = dict(record, probabilities=None, inference_ms=None)
+            else:
+                samples.append(sample)
+                records.append((image_hash, record))
+        if samples:
+            begin = time.perf_counter()
+            probabilities = backend.predict_batch(np.stack(samples)).astype(np.float32)
+            check_output_width(probabilities.shape[1], num_classes, model_path)
+            inference_ms = (time.perf_counter() - begin) * 1000.0 / len(samples)
+            for (image_hash, record), row in zip(records, probabilities):
+                rows.append((key, image_hash, row.tobytes(), record["format"], record["bytes"],
+                             record["decode_ms"], inference_ms, None, now))
+                cached[image_hash] = dict(record, probabilities=row, inference_ms=inference_ms)
+        # One transaction per batch: an interrupted run keeps what it already scored
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO predictions (model_key, image_sha256, probabilities, format, bytes, decode_ms, "
+                "inference_ms, error, evaluated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    return len(todo)
+
+
+def check_output_width(width, num_classes, model_path):
+    # A mismatch would otherwise yield a full report in which some classes can never be predicted
+    if width != num_classes:
+        raise ValueError(f"'{model_path}' has {width} outputs but its labels file lists {num_classes} classes; "
+                         f"pass the labels.json that belongs to this model (--labels).")
+
+
+# --- 3. Metrics ---
+def _class_key(name):
+    # Same matching as class_labels: 'skin changes' (folder) == 'skin_changes' (labels.json)
+    return name.strip().lower().replace(' ', '_')
+
+
+def confusion_matrix(true_labels, predicted, num_classes):
+    matrix = np.zeros((num_classes, num_classes), dtype=np.int64)
+    np.add.at(matrix, (true_labels, predicted), 1)
+    return matrix
+
+
+def per_class_metrics(matrix, class_names):
+    metrics = {}
+    for index, name in enumerate(class_names):
+        true_positives = int(matrix[index, index])
+        support = int(matrix[index].sum())
+        predicted = int(matrix[:, index].sum())
+        precision = true_positives / predicted if predicted else 0.0
+        recall = true_positives / support if support else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        metrics[name] = {"support": support, "predicted": predicted, "precision": precision, "recall": recall, "f1": f1}
+    return metrics
+
+
+def reliability_curve(confidences, correct, bins=CALIBRATION_BINS):
+    """Accuracy vs. mean confidence per equal-width confidence bin, plus the expected calibration error."""
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    which = np.clip(np.digitize(confidences, edges[1:-1]), 0, bins - 1)
+    curve, ece = [], 0.0
+    for index in range(bins):
+        mask = which == index
+        if not mask.any():
+            continue
+        accuracy = float(np.mean(correct[mask]))
+        confidence = float(np.mean(confidences[mask]))
+        ece += mask.sum() / len(confidences) * abs(accuracy - confidence)
+        curve.append({"low": float(edges[index]), "high": float(edges[index + 1]), "images": int(mask.sum()),
+                      "confidence": confidence, "accuracy": accuracy})
+    return curve, float(ece)
+
+
+def threshold_calibration(probabilities, true_labels, class_names, thresholds, target_precision=TARGET_PRECISION):
+    """
+    For each class, what its labels.json confidence_threshold does: of the images predicted as
+    that class, how many pass the threshold (coverage), how often those are right (precision)
+    and how much of the class they find (recall). Also the class's own reliability curve and the
+    lowest threshold that would reach target_precision.
+    """
+    predicted = np.argmax(probabilities, axis=1)
+    confidences = probabilities[np.arange(len(predicted)), predicted]
+    report = {}
+    for index, name in enumerate(class_names):
+        threshold = thresholds[index]
+        mask = predicted == index
+        correct = true_labels[mask] == index
+        class_confidences = confidences[mask]
+        passed = class_confidences >= threshold
+        support = int(np.sum(true_labels == index))
+        curve, ece = reliability_curve(class_confidences, correct) if mask.any() else ([], 0.0)
+
+        suggested = None
+        for candidate in sorted(set(class_confidences.tolist())):
+            kept = class_confidences >= candidate
+            if kept.any() and np.mean(correct[kept]) >= target_precision:
+                suggested = float(candidate)
+                break
+        report[name] = {
+            "threshold": threshold,
+            "predicted": int(mask.sum()),
+            "coverage": float(np.mean(passed)) if mask.any() else 0.0,
+            "precision_at_threshold": float(np.mean(correct[passed])) if passed.any() else None,
+            "recall_at_threshold": float(np.sum(correct[passed]) / support) if support else None,
+            "suggested_threshold": suggested,
+            "ece": ece,
+            "reliability": curve,
+        }
+    return report
+
+
+def decode_cost_by_format(records):
+    by_format = {}
+    for record in records:
+        by_format.setdefault(record["format"] or "unknown", []).append(record)
+    summary = {}
+    for image_format, group in sorted(by_format.items()):
+        timings = [record["decode_ms"] for record in group if record["decode_ms"] is not None]
+        summary[image_format] = {
+            "images": len(group),
+            "errors": sum(1 for record in group if record["error"]),
+            "mean_kb": float(np.mean([record["bytes"] for record in group])) / 1024,
+            "mean_ms": float(np.mean(timings)) if timings else None,
+            "p50_ms": float(np.percentile(timings, 50)) if timings else None,
+            "p95_ms": float(np.percentile(timings, 95)) if timings else None,
+        }
+    return summary
+
+
+def build_report(paths, dataset_labels, dataset_classes, hashes, cached, model_classes, thresholds):
+    """Scores every listed image from the cached predictions; dataset classes are matched to the model's by name."""
+    model_index = {_class_key(name): index for index, name in enumerate(model_classes)}
+    unknown = sorted({dataset_classes[label] for label in dataset_labels
+                      if _class_key(dataset_classes[label]) not in model_index})
+    rows, records, errors = [], [], []
+    for path, label, image_hash in zip(paths, dataset_labels, hashes):
+        record = cached[image_hash]
+        records.append(record)
+        if record["error"]:
+            errors.append({"path": path, "error": record["error"]})
+            continue
+        true_index = model_index.get(_class_key(dataset_classes[label]))
+        if true_index is not None:
+            rows.append((true_index, record))
+
+    num_classes = len(model_classes)
+    true_labels = np.asarray([true_index for true_index, _ in rows], dtype=np.int64)
+    probabilities = np.stack([record["probabilities"] for _, record in rows]) if rows else np.zeros((0, num_classes))
+    predicted = np.argmax(probabilities, axis=1)
+    confidences = probabilities[np.arange(len(predicted)), predicted]
+    matrix = confusion_matrix(true_labels, predicted, num_classes)
+    per_class = per_class_metrics(matrix, model_classes)
+    for index, name in enumerate(model_classes):
+        latencies = [record["decode_ms"] + record["inference_ms"] for true_index, record in rows if true_index == index]
+        per_class[name]["mean_latency_ms"] = float(np.mean(latencies)) if latencies else None
+
+    curve, ece = reliability_curve(confidences, predicted == true_labels) if rows else ([], 0.0)
+    return {
+        "images": len(rows),
+        "accuracy": float(np.mean(predicted == true_labels)) if rows else 0.0,
+        "class_names": list(model_classes),
+        "confusion_matrix": matrix.tolist(),
+        "per_class": per_class,
+        "calibration": {"ece": ece, "reliability": curve,
+                        "per_class": threshold_calibration(probabilities, true_labels, model_classes, thresholds)},
+        "decode_by_format": decode_cost_by_format(records),
+        "mean_inference_ms": float(np.mean([record["inference_ms"] for _, record in rows])) if rows else None,
+        "unknown_classes": unknown,
+        "errors": errors,
+    }
+
+
+# --- 4. Evaluation ---
+def resolve_model(args):
+    """(model path, labels path) from --model, or from a registry version with --version."""
+    if not args.version:
+        return args.model, args.labels or labels_path_for(args.model)
+    from model_registry import METADATA_FILENAME, ModelRegistry, find_model_file
+    version_dir = ModelRegistry(args.registry, backend_name=args.backend).version_dir(args.version)
+    metadata_path = os.path.join(version_dir, METADATA_FILENAME)
+    metadata = {}
+    if os.path.exists(metadata_path):
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+    return find_model_file(version_dir, args.backend, metadata), args.labels or os.path.join(version_dir, LABELS_FILENAME)
+
+
+def evaluate(model_path, labels_path, paths, labels, class_names, cache_path=CACHE_PATH):
+    start = time.perf_counter()
+    labels_document = load_labels(labels_path)
+    classes = sorted(labels_document["classes"], key=lambda entry: entry["id"])
+    model_classes = [entry["name"] for entry in classes]
+    thresholds = [float(entry.get("confidence_threshold", DEFAULT_CONFIDENCE_THRESHOLD)) for entry in classes]
+
+    connection = open_cache(cache_path)
+    try:
+        hashes = hash_files(connection, paths)
+        key = model_key(connection, model_path)
+        cached = cached_predictions(connection, key)
+        for record in cached.values():
+            if record["probabilities"] is not None:
+                check_output_width(len(record["probabilities"]), len(model_classes), model_path)
+                break
+        hits = sum(1 for image_hash in set(hashes) if image_hash in cached)
+        scored = score_missing(connection, key, model_path, paths, hashes, cached, len(model_classes))
+    finally:
+        connection.close()
+    report = build_report(paths, labels, class_names, hashes, cached, model_classes, thresholds)
+    report.update({"model": model_path, "model_key": key, "scored": scored, "cached": hits,
+                   "seconds": time.perf_counter() - start})
+    return report
+
+
+def print_report(report):
+    names = report["class_names"]
+    print(f"\n--- {os.path.basename(report['model'])}: {report['images']} images, "
+          f"accuracy {report['accuracy'] * 100:.2f}% ---")
+    print(f"{report['scored']} unique images run through the model, {report['cached']} from the cache "
+          f"({report['seconds']:.1f} s)")
+    if report["unknown_classes"]:
+        print(f"Skipped dataset classes the model does not have: {report['unknown_classes']}")
+    if report["errors"]:
+        print(f"{len(report['errors'])} images could not be decoded (listed in the JSON report)")
+
+    print("\nConfusion matrix (rows: true class, columns: predicted)")
+    width = max(6, max(len(str(value)) for row in report["confusion_matrix"] for value in row) + 1)
+    print(f"{'':<22}" + "".join(f"{index:>{width}}" for index in range(len(names))))
+    for index, (name, row) in enumerate(zip(names, report["confusion_matrix"])):
+        print(f"{index:>2} {name[:19]:<19}" + "".join(f"{value:>{width}}" for value in row))
+
+    print(f"\n{'Class':<22}{'Support':>8}{'Prec.':>8}{'Recall':>8}{'F1':>7}{'Thresh.':>9}{'Cover.':>8}"
+          f"{'P@thr':>8}{'Suggest':>9}{'ms':>8}")
+    for name in names:
+        row = report["per_class"][name]
+        calibration = report["calibration"]["per_class"][name]
+        precision_at = calibration["precision_at_threshold"]
+        suggested = calibration["suggested_threshold"]
+        latency = row["mean_latency_ms"]
+        print(f"{name[:21]:<22}{row['support']:>8}{row['precision'] * 100:>7.1f}%{row['recall'] * 100:>7.1f}%"
+              f"{row['f1']:>7.2f}{calibration['threshold']:>9.2f}{calibration['coverage'] * 100:>7.1f}%"
+              f"{'-' if precision_at is None else f'{precision_at * 100:.1f}%':>8}"
+              f"{'-' if suggested is None else f'{suggested:.2f}':>9}{'-' if latency is None else f'{latency:.1f}':>8}")
+
+    print(f"\nCalibration (ECE {report['calibration']['ece']:.3f}): confidence -> accuracy")
+    for entry in report["calibration"]["reliability"]:
+        print(f"  {entry['low']:.1f}-{entry['high']:.1f}: {entry['images']:>5} images, "
+              f"confidence {entry['confidence'] * 100:5.1f}% -> accuracy {entry['accuracy'] * 100:5.1f}%")
+
+    print(f"\nDecode cost by format (model inference {report['mean_inference_ms'] or 0:.1f} ms/image)")
+    for image_format, row in report["decode_by_format"].items():
+        timing = "-" if row["mean_ms"] is None else f"{row['mean_ms']:.1f} ms mean, {row['p95_ms']:.1f} ms p95"
+        print(f"  {image_format:<8}{row['images']:>6} images, {row['mean_kb']:>7.0f} KB avg, {timing}"
+              + (f", {row['errors']} errors" if row["errors"] else ""))
+
+
+def list_split(args):
+    from tfdata_pipeline import list_image_files, split_train_validation
+    if args.manifest:
+        from dataset_index import load_manifest
+        paths, labels, class_names = load_manifest(args.manifest, args.data_dir)
+    else:
+        paths, labels, class_names = list_image_files(args.data_dir)
+    if args.split != 'all':
+        train, validation = split_train_validation(paths, labels, VALIDATION_SPLIT)
+        paths, labels = validation if args.split == 'validation' else train
+    return paths, labels, class_names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a Keras or TFLite model on the dataset, re-scoring only what changed.")
+    parser.add_argument('--model', default=MODEL_PATH, help=".h5/.keras or .tflite model file")
+    parser.add_argument('--labels', default=None, help="labels.json of the model (default: next to the model)")
+    parser.add_argument('--version', default=None, help="Evaluate this model registry version instead of --model")
+    parser.add_argument('--registry', default=None, help="Model registry folder (default: model_registry.REGISTRY_DIR)")
+    parser.add_argument('--backend', choices=['keras', 'tflite'], default='keras', help="--version only: which model file")
+    parser.add_argument('--data-dir', default=os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER))
+    parser.add_argument('--manifest', default=None, help="Take the file list from a dataset_index.py manifest")
+    parser.add_argument('--split', choices=['all', 'validation', 'train'], default='validation')
+    parser.add_argument('--cache', default=CACHE_PATH)
+    parser.add_argument('--report', default=None, help="Also write the full report as JSON here")
+    args = parser.parse_args()
+    if args.version and not args.registry:
+        from model_registry import REGISTRY_DIR
+        args.registry = REGISTRY_DIR
+
+    model_path, labels_path = resolve_model(args)
+    for path, what in ((model_path, "Model"), (labels_path, "Labels file")):
+        if not os.path.exists(path):
+            print(f"Error: {what} '{path}' not found.")
+            exit()
+    if not args.manifest and not os.path.isdir(args.data_dir):
+        print(f"Error: dataset folder '{args.data_dir}' does not exist.")
+        exit()
+
+    paths, labels, class_names = list_split(args)
+    try:
+        report = evaluate(model_path, labels_path, paths, labels, class_names, cache_path=args.cache)
+    except ValueError as e:
+        print(f"Error: {e}")
+        exit()
+    report["split"] = args.split
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+# --- Configuration ---
+DATASET_ROOT_PATH = 'C:/Users/Alfred/Desktop/sick pig database'
+DATA_SUBFOLDER = 'category'
+FEATURE_STORE_DIR = 'feature_store' # Holds features.npy (memory-mapped) and index.json
+IMAGE_SIZE = (224, 224)
+NUM_AUGMENTED_VARIANTS = 4 # Extra augmented embeddings per image, on top of the plain one
+EMBED_BATCH_SIZE = 32
+FEATURE_DIM = 1280 # MobileNetV2 pooled output
+
+FEATURES_FILENAME = 'features.npy'
+INDEX_FILENAME = 'index.json'
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FeatureStore:
+    """
+    Pooled MobileNetV2 embeddings of the training images, keyed by file content hash.
+
+    features.npy has shape (num_images, 1 + num_variants, 1280): slot 0 is the plain image,
+    the other slots are fixed augmented variants. It is opened memory-mapped, so training
+    reads straight from the page cache. index.json maps content hash -> row, and remembers
+    each path's (mtime, size, hash) so unchanged files are not even re-hashed.
+    """
+
+    def __init__(self, store_dir, num_variants=NUM_AUGMENTED_VARIANTS, image_size=IMAGE_SIZE):
+        self.store_dir = store_dir
+        self.num_variants = num_variants
+        self.image_size = tuple(image_size)
+        self.features_path = os.path.join(store_dir, FEATURES_FILENAME)
+        self.index_path = os.path.join(store_dir, INDEX_FILENAME)
+        self.rows = {} # { content_hash: row }
+        self.files = {} # { path: [mtime, size, content_hash] }
+        self.features = None
+        self._load()
+
+    def _signature(self):
+        return {"backbone": "MobileNetV2-imagenet-avgpool", "image_size": list(self.image_size),
+                "num_variants": self.num_variants, "feature_dim": FEATURE_DIM}
+
+    def _load(self):
+        if not (os.path.exists(self.index_path) and os.path.exists(self.features_path)):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get("signature") != self._signature():
+            print("Feature store was built with different settings; it will be rebuilt.")
+            return
+        self.rows = index["rows"]
+        self.files = index["files"]
+        self.features = np.load(self.features_path, mmap_mode='r')
+
+    # --- Hashing (skips files whose mtime and size are unchanged) ---
+    def hash_files(self, paths):
+        hashes = []
+        for path in paths:
+            stat = os.stat(path)
+            cached = self.files.get(path)
+            if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+                hashes.append(cached[2])
+                continue
+            content_hash = file_sha256(path)
+            self.files[path] = [stat.st_mtime, stat.st_size, content_hash]
+            hashes.append(content_hash)
+        return hashes
+
+    # --- Incremental Update ---
+    def update(self, paths, batch_size=EMBED_BATCH_SIZE):
+        """
+        Makes sure every path has embeddings. Only images whose content hash is not in the
+        store yet run through the backbone; the rest are copied from the existing file.
+        Rows of images no longer in `paths` are dropped. Returns the content hash per path.
+        """
+        hashes = self.hash_files(paths)
+        self.files = {path: self.files[path] for path in paths}
+        wanted = list(dict.fromkeys(hashes)) # unique, in path order
+        missing = [content_hash for content_hash in wanted if content_hash not in self.rows]
+        if not missing and len(wanted) == len(self.rows):
+            print(f"Feature store up to date ({len(wanted)} images).")
+            self._save_index() # Keep refreshed mtimes so the next run skips hashing
+            return hashes
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = self.features_path + '.tmp.npy'
+        new_features = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                                 shape=(len(wanted), 1 + self.num_variants, FEATURE_DIM))
+        new_rows = {content_hash: row for row, content_hash in enumerate(wanted)}
+        for content_hash, row in new_rows.items():
+            if content_hash in self.rows:
+                new_features[row] = self.features[self.rows[content_hash]]
+
+        if missing:
+            first_path = {}
+            for path, content_hash in zip(paths, hashes):
+                first_path.setdefault(content_hash, path)
+            print(f"Embedding {len(missing)} new or changed images "
+                  f"({len(wanted) - len(missing)} reused from the store)...")
+            start = time.time()
+            embeddings = embed_images([first_path[h] for h in missing], self.image_size,
+                                      self.num_variants, batch_size)
+            for content_hash, embedding in zip(missing, embeddings):
+                new_features[new_rows[content_hash]] = embedding
+            print(f"Embedded {len(missing)} images in {time.time() - start:.1f} s.")
+
+        new_features.flush()
+        del new_features
+        self.features = None # Release the old memmap before replacing the file (needed on Windows)
+        os.replace(tmp_path, self.features_path)
+        self.rows = new_rows
+        self._save_index()
+        self.features = np.load(self.features_path, mmap_mode='r')
+        return hashes
+
+    def _save_index(self):
+        with open(self.index_path, 'w', encoding='utf-8') as f:
+            json.dump({"signature": self._signature(), "rows": self.rows, "files": self.files}, f)
+
+    def lookup(self, hashes, variants=True):
+        """
+        Returns an array of embeddings for the given hashes: (n, 1 + num_variants, 1280)
+        with variants, or just the plain embedding (n, 1280) without.
+        """
+        rows = np.array([self.rows[content_hash] for content_hash in hashes], dtype=np.int64)
+        block = self.features[rows]
+        return block if variants else block[:, 0]
+
+
+def build_backbone(image_size=IMAGE_SIZE):
+    from tensorflow.keras.applications import MobileNetV2
+    return MobileNetV2(weights='imagenet', include_top=False, pooling='avg',
+                       input_shape=(image_size[0], image_size[1], 3))
+
+
+def embed_images(paths, image_size, num_variants, batch_size=EMBED_BATCH_SIZE, backbone=None):
+    """
+    Runs the frozen backbone once over the plain images and once per augmented variant.
+    Images are scaled to [0, 1] exactly like in train_pig_detector.py, so a head trained on
+    these features can be dropped straight onto the same backbone.
+    Returns float32 array (len(paths), 1 + num_variants, 1280).
+    """
+    import tensorflow as tf
+    from tfdata_pipeline import AUTOTUNE, augment_batch, decode_and_resize
+
+    backbone = backbone or build_backbone(image_size)
+    dataset = tf.data.Dataset.from_tensor_slices(list(paths))
+    dataset = dataset.map(lambda path: decode_and_resize(path, image_size), num_parallel_calls=AUTOTUNE)
+    dataset = dataset.batch(batch_size).map(lambda images: tf.cast(images, tf.float32) / 255.0).prefetch(AUTOTUNE)
+
+    output = np.zeros((len(paths), 1 + num_variants, FEATURE_DIM), dtype=np.float32)
+    offset = 0
+    for images in dataset:
+        count = int(images.shape[0])
+        output[offset:offset + count, 0] = backbone.predict_on_batch(images)
+        for variant in range(1, num_variants + 1):
+            # Generator seeded per variant and batch, so a rebuild over the same files repeats the
+            # same augmentations (op seeds alone also depend on TF's global op counter)
+            generator = tf.random.Generator.from_seed(1000 * variant + offset)
+            augmented = augment_batch(images, generator=generator)
+            output[offset:offset + count, variant] = backbone.predict_on_batch(augmented)
+        offset += count
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the MobileNetV2 feature store.")
+    parser.add_argument('--data-dir', default=os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER))
+    parser.add_argument('--store-dir', default=FEATURE_STORE_DIR)
+    parser.add_argument('--variants', type=int, default=NUM_AUGMENTED_VARIANTS)
+    args = parser.parse_args()
+
+    from tfdata_pipeline import list_image_files
+    paths, _, class_names = list_image_files(args.data_dir)
+    print(f"Found {len(paths)} images in {len(class_names)} classes.")
+    store = FeatureStore(args.store_dir, num_variants=args.variants)
+    store.update(paths)
+    print(f"Feature store: {store.features.shape} in '{store.features_path}'")
+
+
+if __name__ == "__main__":
+    main()
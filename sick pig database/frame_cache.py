@@ -0,0 +1,92 @@
+import collections
+import threading
+import time
+
+# --- Configuration ---
+FRAME_CACHE_TTL_SECONDS = 30.0 # A cached prediction is reused for at most this long, then the model runs again
+FRAME_CACHE_MAX_DISTANCE = 4 # Max differing bits (of 64) between frame hashes to count as the same scene
+FRAME_CACHE_ENTRIES_PER_CAMERA = 8 # Recent distinct scenes remembered per camera (LRU)
+FRAME_CACHE_MAX_CAMERAS = 256 # Cameras tracked at once (LRU)
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count('1')
+
+
+class FrameCache:
+    """
+    Per-camera cache of recent predictions, keyed by a perceptual hash of the frame
+    (image_pipeline.difference_hash). A frame whose hash is within max_distance bits of a
+    recent entry for the same camera gets that entry's prediction instead of a model run.
+
+    Entries expire ttl_seconds after the model produced them (hits do not extend this), so a
+    slowly changing scene is still re-scored regularly. Each camera keeps its
+    entries_per_camera most recently used scenes, and the least recently seen cameras are
+    dropped beyond max_cameras.
+    """
+
+    def __init__(self, ttl_seconds=FRAME_CACHE_TTL_SECONDS, max_distance=FRAME_CACHE_MAX_DISTANCE,
+                 entries_per_camera=FRAME_CACHE_ENTRIES_PER_CAMERA, max_cameras=FRAME_CACHE_MAX_CAMERAS):
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.entries_per_camera = entries_per_camera
+        self.max_cameras = max_cameras
+        self._lock = threading.Lock()
+        self._cameras = collections.OrderedDict() # { camera_id: OrderedDict{ frame_hash: (created, value) } }
+        self._counters = {"hits": 0, "misses": 0, "bypassed": 0, "expired": 0, "evicted": 0}
+
+    def lookup(self, camera_id, frame_hash):
+        """Returns the cached value for a near-identical recent frame, or None."""
+        now = time.monotonic()
+        with self._lock:
+            entries = self._cameras.get(camera_id)
+            if entries is not None:
+                self._cameras.move_to_end(camera_id)
+                for cached_hash in list(entries):
+                    created, value = entries[cached_hash]
+                    if now - created > self.ttl_seconds:
+                        del entries[cached_hash]
+                        self._counters["expired"] += 1
+                        continue
+                    if hamming_distance(cached_hash, frame_hash) <= self.max_distance:
+                        entries.move_to_end(cached_hash)
+                        self._counters["hits"] += 1
+                        return value
+            self._counters["misses"] += 1
+            return None
+
+    def store(self, camera_id, frame_hash, value):
+        with self._lock:
+            entries = self._cameras.get(camera_id)
+            if entries is None:
+                entries = self._cameras[camera_id] = collections.OrderedDict()
+                while len(self._cameras) > self.max_cameras:
+                    _, dropped = self._cameras.popitem(last=False)
+                    self._counters["evicted"] += len(dropped)
+            self._cameras.move_to_end(camera_id)
+            entries[frame_hash] = (time.monotonic(), value)
+            entries.move_to_end(frame_hash)
+            while len(entries) > self.entries_per_camera:
+                entries.popitem(last=False)
+                self._counters["evicted"] += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self._counters["bypassed"] += 1
+
+    def clear(self, camera_id=None):
+        with self._lock:
+            if camera_id is None:
+                self._cameras.clear()
+            else:
+                self._cameras.pop(camera_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return dict(self._counters,
+                        hit_rate=self._counters["hits"] / lookups if lookups else 0.0,
+                        cameras=len(self._cameras),
+                        entries=sum(len(entries) for entries in self._cameras.values()),
+                        ttl_seconds=self.ttl_seconds,
+                        max_distance=self.max_distance)
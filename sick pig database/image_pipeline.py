@@ -0,0 +1,84 @@
+import base64
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+# --- Configuration ---
+IMAGE_SIZE = (224, 224) # Model input size, must match training
+THUMBNAIL_SIZE = (320, 240) # Preview size served by /latest_prediction
+
+
+def decode_frame(img_bytes, target_size=IMAGE_SIZE, thumbnail_size=THUMBNAIL_SIZE):
+    """
+    Decodes an uploaded frame exactly once and returns it as an RGB PIL image.
+
+    For JPEGs, draft mode lets libjpeg scale by 1/2, 1/4 or 1/8 while decoding, so a
+    1600x1200 ESP32-CAM frame is decoded straight to 400x300 instead of full resolution.
+    The requested draft size is the larger of the model input and the thumbnail, so
+    both can still be cut from the same decoded buffer. Other formats decode normally.
+    """
+    img = Image.open(io.BytesIO(img_bytes))
+    draft_size = (max(target_size[0], thumbnail_size[0]), max(target_size[1], thumbnail_size[1]))
+    img.draft('RGB', draft_size)
+    return img.convert('RGB')
+
+
+def to_model_input(img, target_size=IMAGE_SIZE):
+    """
+    Resizes a decoded frame to the model input and scales it to [0, 1], shape (H, W, 3).
+    Uses nearest-neighbour resizing, the same default as keras image.load_img in training.
+    """
+    if img.size != target_size:
+        img = img.resize(target_size, Image.NEAREST)
+    return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def difference_hash(img, hash_size=8):
+    """
+    64-bit perceptual hash (dHash) of a decoded frame: the frame is shrunk to a
+    (hash_size + 1) x hash_size grayscale thumbnail and each bit says whether a pixel is
+    brighter than its right-hand neighbour. Near-identical frames differ in only a few bits.
+    """
+    small = np.asarray(img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def motion_thumbnail(img_bytes, size=(32, 24)):
+    """
+    Tiny grayscale version of an encoded frame for cheap motion checks. JPEG draft mode
+    decodes at 1/8 scale in grayscale, so this costs a fraction of a full decode_frame.
+    """
+    img = Image.open(io.BytesIO(img_bytes))
+    img.draft('L', (size[0] * 2, size[1] * 2))
+    return np.asarray(img.convert('L').resize(size, Image.BILINEAR), dtype=np.int16)
+
+
+class LazyThumbnail:
+    """
+    Holds a reference to a decoded frame and only builds the JPEG/base64 preview when
+    someone actually asks for it. The encoded result is cached, so repeated reads are free.
+    """
+
+    def __init__(self, img, size=THUMBNAIL_SIZE, quality=75):
+        self._img = img
+        self._size = size
+        self._quality = quality
+        self._jpeg = None
+        self._lock = threading.Lock()
+
+    def jpeg_bytes(self):
+        with self._lock:
+            if self._jpeg is None:
+                preview = self._img.copy()
+                preview.thumbnail(self._size)
+                buffered = io.BytesIO()
+                preview.save(buffered, format="JPEG", quality=self._quality)
+                self._jpeg = buffered.getvalue()
+                self._img = None # Drop the decoded frame once the preview exists
+            return self._jpeg
+
+    def base64(self):
+        return base64.b64encode(self.jpeg_bytes()).decode('utf-8')
@@ -0,0 +1,132 @@
+import queue
+
+import numpy as np
+
+# TensorFlow is imported inside the backends so that picking the TFLite backend
+# on a box with only tflite_runtime installed does not pull in the full framework.
+
+
+# --- Keras Backend (full .h5 model) ---
+class KerasBackend:
+    """Serves predictions from the full Keras .h5 model. Kept for A/B comparison with TFLite."""
+
+    name = 'keras'
+    supports_batching = True # one predict_on_batch call can take many frames
+
+    def __init__(self, model_path, with_embedding=False):
+        import tensorflow as tf
+        self.model_path = model_path
+        self.model = tf.keras.models.load_model(model_path)
+        self.input_shape = tuple(self.model.input_shape[1:])
+        self.embedding_dim = None
+        if with_embedding:
+            # Second output at the pooled backbone features, so one forward pass gives both
+            pooled = [layer for layer in self.model.layers if type(layer).__name__ == 'GlobalAveragePooling2D']
+            if not pooled:
+                raise ValueError(f"'{model_path}' has no GlobalAveragePooling2D layer to take embeddings from.")
+            self._joint_model = tf.keras.Model(self.model.input, [self.model.output, pooled[-1].output])
+            self.embedding_dim = int(pooled[-1].output.shape[-1])
+
+    def predict_batch(self, batch):
+        # predict_on_batch skips the per-call tf.data setup that model.predict does.
+        return np.asarray(self.model.predict_on_batch(batch))
+
+    def predict_batch_with_embeddings(self, batch):
+        """(N, num_classes + embedding_dim): probabilities followed by the pooled features, one row per frame."""
+        probabilities, embeddings = self._joint_model.predict_on_batch(batch)
+        return np.concatenate([np.asarray(probabilities), np.asarray(embeddings)], axis=1)
+
+    def predict(self, sample):
+        return self.predict_batch(np.expand_dims(sample, axis=0))[0]
+
+
+# --- TFLite Backend (quantized .tflite model with an interpreter pool) ---
+def _load_interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter # Lightweight runtime, if installed
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class _PooledInterpreter:
+    """One interpreter with its tensors already allocated and its I/O details looked up once."""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        input_details = interpreter.get_input_details()[0]
+        output_details = interpreter.get_output_details()[0]
+        self.input_index = input_details['index']
+        self.input_dtype = input_details['dtype']
+        self.input_scale, self.input_zero_point = input_details['quantization']
+        self.output_index = output_details['index']
+        self.output_dtype = output_details['dtype']
+        self.output_scale, self.output_zero_point = output_details['quantization']
+
+    def run(self, sample):
+        # Full-integer models take uint8/int8 input: quantize the [0, 1] float image first.
+        if self.input_dtype in (np.uint8, np.int8):
+            info = np.iinfo(self.input_dtype)
+            sample = np.round(sample / self.input_scale + self.input_zero_point)
+            sample = np.clip(sample, info.min, info.max)
+        input_tensor = np.expand_dims(sample, axis=0).astype(self.input_dtype)
+
+        self.interpreter.set_tensor(self.input_index, input_tensor)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output_index)[0]
+
+        if self.output_dtype in (np.uint8, np.int8):
+            output = (output.astype(np.float32) - self.output_zero_point) * self.output_scale
+        return output
+
+
+class TFLiteBackend:
+    """
+    Serves predictions from a .tflite model using a pool of pre-allocated interpreters.
+
+    An interpreter is not thread-safe, so each request thread checks one out of the pool,
+    runs set_tensor/invoke/get_tensor on it and hands it back. allocate_tensors() only
+    ever runs here at startup, never on the request path. Size the pool to the number of
+    request threads expected to run inference at the same time.
+    """
+
+    name = 'tflite'
+    supports_batching = False # interpreters are allocated for batch size 1
+    embedding_dim = None # Only the classifier output is exported
+
+    def __init__(self, model_path, pool_size=4, num_threads=1):
+        Interpreter = _load_interpreter_class()
+        self.model_path = model_path
+        self.pool_size = pool_size
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+            interpreter.allocate_tensors()
+            self._pool.put(_PooledInterpreter(interpreter))
+        self.input_shape = tuple(int(d) for d in self._peek().interpreter.get_input_details()[0]['shape'][1:])
+
+    def _peek(self):
+        slot = self._pool.get()
+        self._pool.put(slot)
+        return slot
+
+    def predict(self, sample):
+        slot = self._pool.get()
+        try:
+            return slot.run(sample)
+        finally:
+            self._pool.put(slot)
+
+    def predict_batch(self, batch):
+        return np.stack([self.predict(sample) for sample in batch], axis=0)
+
+
+# --- Backend Factory ---
+def load_backend(backend_name, keras_model_path=None, tflite_model_path=None,
+                 tflite_pool_size=4, tflite_num_threads=1, with_embedding=False):
+    if backend_name == 'keras':
+        return KerasBackend(keras_model_path, with_embedding=with_embedding)
+    if backend_name == 'tflite':
+        return TFLiteBackend(tflite_model_path, pool_size=tflite_pool_size, num_threads=tflite_num_threads)
+    raise ValueError(f"Unknown inference backend '{backend_name}' (expected 'keras' or 'tflite')")
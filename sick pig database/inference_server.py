@@ -1,21 +1,31 @@
 import os
-import io
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
-from email.mime.multipart import MIMEMultipart
+import time
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.preprocessing import image
-from flask import Flask, request, jsonify
-from PIL import Image # Import PIL for image processing
+from flask import Flask, Response, request, jsonify, stream_with_context
 import datetime # Import datetime for timestamps and cooldown
+from alert_dispatcher import AlertDispatcher
+from image_pipeline import decode_frame, to_model_input, difference_hash, LazyThumbnail
+from class_labels import resolve_class_names
+from prediction_feed import PredictionFeed, normalize_camera_id
+from frame_cache import FrameCache
+from cascade import CascadeClassifier, load_model_backend
+from prediction_store import PredictionStore, parse_time
+from tta import TestTimeAugmenter
+from model_registry import ModelRegistry, ACTIVE_POINTER
+from stream_ingest import StreamIngest, load_cameras
+from embedding_index import EmbeddingIndex
+from metrics import MetricsRegistry, RequestInstruments, SamplingProfiler
+# TensorFlow itself is only imported when a backend loads a model (see inference_backends.py).
 
 # --- Flask App Setup ---
 app = Flask(__name__)
 
 # --- Configuration ---
 MODEL_PATH = 'C:/Users/Alfred/Desktop/sick pig database/pig_disease_detector_model.h5'
+TFLITE_MODEL_PATH = 'C:/Users/Alfred/Desktop/sick pig database/quantized_pig_detector.tflite'
+# Class-index mapping written next to the model by train_pig_detector.py / convert_to_tflite.py.
+# The dataset folder is only used as a fallback when this file is missing.
+LABELS_PATH = 'C:/Users/Alfred/Desktop/sick pig database/labels.json'
 DATASET_ROOT_PATH = 'C:/Users/Alfred/Desktop/sick pig database'
 DATA_SUBFOLDER = 'category'
 IMAGE_SIZE = (224, 224)
@@ -32,161 +42,685 @@ RECIPIENT_EMAILS = ["community.a.i.s.d@gmail.com","seanice877@gmail.com"]
 # This prevents spamming if the camera keeps seeing the same sick pig.
 ALERT_COOLDOWN_SECONDS = 3600 # 1 hour (3600 seconds).
 
+# --- THRESHOLD HERE ---
+# Minimum confidence (%) of a disease prediction before an alert email goes out.
+REQUIRED_CONFIDENCE_THRESHOLD = 80.0 # <--- INCREASED THRESHOLD
+
+# --- Alert Dispatcher Configuration ---
+# Emails are sent from a background thread (see alert_dispatcher.py) so /predict never waits on SMTP.
+ALERT_COALESCE_WINDOW_SECONDS = 30 # Alerts firing within this window go out as one digest email
+ALERT_QUEUE_SIZE = 100 # Alerts beyond this many pending are dropped instead of blocking requests
+ALERT_MAX_RETRIES = 5 # Send attempts after the first one, with exponential backoff
+ALERT_RETRY_BACKOFF_SECONDS = 2.0
+
+# --- Inference Backend Configuration ---
+# 'keras'  -> full .h5 model through tf.keras (kept for A/B comparison)
+# 'tflite' -> quantized .tflite model through a pool of pre-allocated interpreters
+INFERENCE_BACKEND = os.environ.get('PIGCAM_BACKEND', 'keras')
+TFLITE_POOL_SIZE = int(os.environ.get('PIGCAM_TFLITE_POOL_SIZE', 4)) # Interpreters = concurrent inference threads
+TFLITE_NUM_THREADS = int(os.environ.get('PIGCAM_TFLITE_NUM_THREADS', 1)) # Threads used inside each interpreter
+
+# --- Micro-Batching Configuration ---
+# Concurrent /predict requests are queued and run through the model together.
+# MAX_BATCH_SIZE caps how many frames go into one forward pass, and MAX_BATCH_WAIT_MS
+# is the longest a frame waits for others to join its batch (this is the latency price).
+ENABLE_MICRO_BATCHING = os.environ.get('PIGCAM_MICRO_BATCHING', '1') != '0'
+MAX_BATCH_SIZE = int(os.environ.get('PIGCAM_MAX_BATCH_SIZE', 16))
+MAX_BATCH_WAIT_MS = float(os.environ.get('PIGCAM_MAX_BATCH_WAIT_MS', 10))
+
+# --- Model Registry Configuration ---
+# Versioned models live in MODEL_REGISTRY_DIR (see model_registry.py). If its ACTIVE file names a
+# version, the server starts on that version; otherwise it serves MODEL_PATH / TFLITE_MODEL_PATH as
+# version 'default'. Later versions are loaded, warmed up and swapped in without a restart, either with
+# POST /models/activate or by rewriting the ACTIVE file (checked every MODEL_WATCH_SECONDS, 0 = off).
+MODEL_REGISTRY_DIR = os.environ.get('PIGCAM_MODEL_REGISTRY', 'C:/Users/Alfred/Desktop/sick pig database/model_registry')
+MODEL_WATCH_SECONDS = float(os.environ.get('PIGCAM_MODEL_WATCH_SECONDS', 5))
+ADMIN_TOKEN = os.environ.get('PIGCAM_ADMIN_TOKEN') # When set, POST /models/* needs it in an X-Admin-Token header
+
+# --- Frame Cache Configuration ---
+# Cameras re-post nearly identical frames of a static pen; a frame whose perceptual hash is within
+# FRAME_CACHE_MAX_DISTANCE bits of a recent frame from the same camera reuses that prediction.
+# A request can skip the cache with "Cache-Control: no-cache" or ?nocache=1.
+ENABLE_FRAME_CACHE = os.environ.get('PIGCAM_FRAME_CACHE', '1') != '0'
+FRAME_CACHE_TTL_SECONDS = float(os.environ.get('PIGCAM_FRAME_CACHE_TTL', 30))
+FRAME_CACHE_MAX_DISTANCE = int(os.environ.get('PIGCAM_FRAME_CACHE_DISTANCE', 4))
+
+# --- Cascade Configuration ---
+# Cascade mode puts a small 96x96 healthy/not-healthy model (train_pig_detector.py --stage-one) in
+# front of the full classifier. Frames it calls Healthy with at least CASCADE_MARGIN probability are
+# answered without the full model. Pick the margin from `python cascade.py` (disease recall vs. cost).
+ENABLE_CASCADE = os.environ.get('PIGCAM_CASCADE', '0') == '1'
+STAGE_ONE_MODEL_PATH = os.environ.get('PIGCAM_STAGE_ONE_MODEL',
+                                      'C:/Users/Alfred/Desktop/sick pig database/pig_healthy_prefilter_model.h5')
+CASCADE_MARGIN = float(os.environ.get('PIGCAM_CASCADE_MARGIN', 0.9))
+
+# --- Test-Time Augmentation Configuration ---
+# Opt-in: frames whose top confidence lands in TTA_BAND (percent) are re-scored on flipped,
+# cropped and slightly rotated views in one batch, and the probabilities are averaged.
+ENABLE_TTA = os.environ.get('PIGCAM_TTA', '0') == '1'
+TTA_BAND = tuple(float(value) for value in os.environ.get('PIGCAM_TTA_BAND', '65,90').split(','))
+
+# --- Prediction History Configuration ---
+# Every prediction is appended to an SQLite (WAL) log by a background writer, see prediction_store.py.
+ENABLE_PREDICTION_STORE = os.environ.get('PIGCAM_PREDICTION_STORE', '1') != '0'
+PREDICTION_DB_PATH = os.environ.get('PIGCAM_PREDICTION_DB', 'C:/Users/Alfred/Desktop/sick pig database/predictions.sqlite')
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 1000
+
+# --- Stream Ingest Configuration ---
+# Optional camera list (see stream_ingest.py) of MJPEG/RTSP feeds the server pulls itself instead of
+# waiting for POSTs. Frames are sampled by motion and go through the same path as /predict uploads.
+STREAMS_CONFIG_PATH = os.environ.get('PIGCAM_STREAMS') # e.g. C:/Users/Alfred/Desktop/sick pig database/cameras.json
+STREAM_INFERENCE_WORKERS = int(os.environ.get('PIGCAM_STREAM_WORKERS', 2))
+
+# --- Embedding Index Configuration ---
+# Optional index of reference images built by embedding_index.py. The model's pooled features come out
+# of the same forward pass as its probabilities, and the SIMILAR_IMAGES_K nearest references are returned
+# with each prediction. With KNN_CLASSIFIER on, the class itself is a kNN vote over the index labels, so a
+# class added with `embedding_index.py add` is served without retraining. Keras backend only.
+EMBEDDING_INDEX_DIR = os.environ.get('PIGCAM_EMBEDDING_INDEX') # e.g. C:/Users/Alfred/Desktop/sick pig database/embedding_index
+SIMILAR_IMAGES_K = int(os.environ.get('PIGCAM_SIMILAR_K', 3))
+KNN_CLASSIFIER = os.environ.get('PIGCAM_KNN', '0') == '1'
+
+# --- Metrics Configuration ---
+# /metrics serves per-stage latency histograms, prediction/error/alert counts, queue depths and RSS in
+# Prometheus text format (see metrics.py). The sampling profiler behind /debug/profile is opt-in, and
+# also needs the X-Admin-Token header when PIGCAM_ADMIN_TOKEN is set.
+ENABLE_PROFILER = os.environ.get('PIGCAM_PROFILER', '0') == '1'
+PROFILE_DEFAULT_SECONDS = 10
+
 # --- Global Variables for Model, Class Names, Latest Prediction, and Alert Tracking ---
-model = None
-class_names = []
-latest_prediction_data = {
+model_registry = None # ModelRegistry; its active ModelVersion owns the backend and micro-batcher
+cascade = None # CascadeClassifier when cascade mode is on
+tta = None # TestTimeAugmenter when TTA is on
+stream_ingest = None # StreamIngest when PIGCAM_STREAMS names a camera list
+embedding_index = None # EmbeddingIndex when PIGCAM_EMBEDDING_INDEX is set
+class_names = [] # Labels of the active model version
+# Returned by /latest_prediction until a camera has posted its first frame
+NO_PREDICTION_YET = {
     "prediction": "No data yet",
     "confidence": "0.00%",
     "timestamp": "N/A",
-    "image": None # Store base64 encoded image if needed
+    "image": None
 }
-# --- NEW: Dictionary to track the last alert time for each disease class ---
-last_alert_times = {} # Stores { 'disease_name': datetime_object, ... }
+# Per-camera perceptual-hash cache of recent predictions (see frame_cache.py)
+frame_cache = FrameCache(ttl_seconds=FRAME_CACHE_TTL_SECONDS,
+                         max_distance=FRAME_CACHE_MAX_DISTANCE) if ENABLE_FRAME_CACHE else None
+# Append-only prediction history (None when disabled); started in __main__
+prediction_store = PredictionStore(PREDICTION_DB_PATH) if ENABLE_PREDICTION_STORE else None
+# Latest prediction and thumbnail per camera, and the push feed behind /events (see prediction_feed.py)
+prediction_feed = PredictionFeed()
+# Hot-path timing and counters behind /metrics; profiler only when PIGCAM_PROFILER=1
+metrics_registry = MetricsRegistry()
+instruments = RequestInstruments(metrics_registry)
+profiler = SamplingProfiler() if ENABLE_PROFILER else None
+# Background email sender; it also owns the per-disease cooldown (last_alert_times).
+alert_dispatcher = AlertDispatcher(SMTP_SERVER, SMTP_PORT, SENDER_EMAIL, SENDER_PASSWORD, RECIPIENT_EMAILS,
+                                   cooldown_seconds=ALERT_COOLDOWN_SECONDS,
+                                   coalesce_window_seconds=ALERT_COALESCE_WINDOW_SECONDS,
+                                   max_queue_size=ALERT_QUEUE_SIZE,
+                                   max_retries=ALERT_MAX_RETRIES,
+                                   retry_backoff_seconds=ALERT_RETRY_BACKOFF_SECONDS,
+                                   on_send=lambda seconds, succeeded: instruments.stage_seconds.observe(
+                                       seconds, ('smtp_send',)))
+
+# --- Metrics Read at Scrape Time (nothing here runs per request) ---
+def queue_depths():
+    depths = {"alerts": alert_dispatcher.queue_depth()}
+    if model_registry is not None:
+        model = model_registry.active
+        if model is not None and model.batcher is not None:
+            depths["micro_batcher"] = model.batcher.queue_depth()
+        depths["shadow"] = model_registry.shadow_queue_depth()
+    if prediction_store is not None:
+        depths["history"] = prediction_store.queue_depth()
+    if stream_ingest is not None:
+        depths["stream_frames"] = len(stream_ingest.frame_queue)
+    return depths
+
+def alert_counts():
+    return {outcome: count for outcome, count in alert_dispatcher.stats().items() if outcome != "queue_depth"}
+
+metrics_registry.gauge_callback('pigcam_queue_depth', "Items waiting in each internal queue", queue_depths, ('queue',))
+metrics_registry.counter_callback('pigcam_alerts_total', "Alert emails by outcome (see /alert_stats)", alert_counts,
+                                  ('outcome',))
+if frame_cache is not None:
+    metrics_registry.gauge_callback('pigcam_frame_cache_entries', "Frames held by the perceptual-hash cache",
+                                    lambda: frame_cache.stats().get("entries"))
 
 # --- Function to Load Model and Class Names ---
 def load_model_and_classes():
-    global model, class_names
+    global model_registry, cascade, tta, embedding_index
     print("Loading model and inferring class names...")
     try:
-        model = tf.keras.models.load_model(MODEL_PATH)
-        print("Model loaded successfully.")
-
-        dummy_datagen = image.ImageDataGenerator(rescale=1./255)
-        dummy_generator = dummy_datagen.flow_from_directory(
-            os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER),
-            target_size=IMAGE_SIZE,
-            batch_size=1,
-            class_mode='categorical',
-            shuffle=False
-        )
-        class_names = list(dummy_generator.class_indices.keys())
-        print(f"Inferred {len(class_names)} classes: {class_names}")
+        if EMBEDDING_INDEX_DIR:
+            if INFERENCE_BACKEND != 'keras':
+                print("Embedding index needs the keras backend (the .tflite export has no embedding output); "
+                      "similar images are off.")
+            else:
+                embedding_index = EmbeddingIndex(EMBEDDING_INDEX_DIR)
+                print(f"Embedding index loaded from {EMBEDDING_INDEX_DIR} ({len(embedding_index)} references).")
+        if KNN_CLASSIFIER and (embedding_index is None or not len(embedding_index)):
+            raise RuntimeError("kNN classifier mode needs a non-empty embedding index (PIGCAM_EMBEDDING_INDEX).")
+
+        warm_up_batch_sizes = [1]
+        if ENABLE_TTA and not KNN_CLASSIFIER:
+            # The views go to the leased model version as one batch (TFLite runs them one after another)
+            tta = TestTimeAugmenter(predict_batch_probabilities, band=TTA_BAND, image_size=IMAGE_SIZE,
+                                    alert_threshold=REQUIRED_CONFIDENCE_THRESHOLD)
+            warm_up_batch_sizes.append(tta.batch_size) # Batch shape of the TTA views traces during warm-up
+            print(f"Test-time augmentation enabled for confidences in {TTA_BAND}% "
+                  f"({tta.num_views} views, batches of {tta.batch_size} warmed up).")
+
+        # TFLite interpreters run one frame at a time in the request thread, so batching only helps Keras.
+        model_registry = ModelRegistry(MODEL_REGISTRY_DIR,
+                                       backend_name=INFERENCE_BACKEND,
+                                       tflite_pool_size=TFLITE_POOL_SIZE,
+                                       tflite_num_threads=TFLITE_NUM_THREADS,
+                                       micro_batching=ENABLE_MICRO_BATCHING,
+                                       max_batch_size=MAX_BATCH_SIZE,
+                                       max_wait_ms=MAX_BATCH_WAIT_MS,
+                                       warm_up_batch_sizes=warm_up_batch_sizes,
+                                       with_embeddings=embedding_index is not None,
+                                       validate=validate_model_version,
+                                       on_activate=on_model_activated)
+        initial_version = model_registry.read_pointer(ACTIVE_POINTER) if os.path.isdir(MODEL_REGISTRY_DIR) else None
+        if initial_version:
+            if not model_registry.activate(initial_version, background=False):
+                raise RuntimeError(f"Could not load model version '{initial_version}' from {MODEL_REGISTRY_DIR}")
+        else:
+            model_path = TFLITE_MODEL_PATH if INFERENCE_BACKEND == 'tflite' else MODEL_PATH
+            default_classes = resolve_class_names(LABELS_PATH, os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER))
+            model_registry.install(model_registry.load_files('default', model_path, LABELS_PATH,
+                                                             class_names=default_classes))
+        model = model_registry.active
+        print(f"Model loaded successfully ({model.backend.name} backend, version '{model.version}').")
+        if model.batcher is not None:
+            print(f"Micro-batching enabled (max batch {MAX_BATCH_SIZE}, max wait {MAX_BATCH_WAIT_MS} ms).")
+        print(f"Loaded {len(class_names)} classes: {class_names}")
+
+        if ENABLE_CASCADE and KNN_CLASSIFIER:
+            print("Cascade mode is ignored in kNN classifier mode (stage one answers without an embedding).")
+        elif ENABLE_CASCADE:
+            stage_one = load_model_backend(STAGE_ONE_MODEL_PATH, tflite_pool_size=TFLITE_POOL_SIZE,
+                                           tflite_num_threads=TFLITE_NUM_THREADS)
+            cascade = CascadeClassifier(stage_one, predict_probabilities, class_names, margin=CASCADE_MARGIN)
+            print(f"Cascade mode enabled (stage one: {STAGE_ONE_MODEL_PATH}, margin {CASCADE_MARGIN}).")
+
+        warm_up_model()
+        model_registry.start_watching(MODEL_WATCH_SECONDS)
+        if embedding_index is not None:
+            embedding_index.start_watching(MODEL_WATCH_SECONDS, on_reload=on_index_reloaded)
     except Exception as e:
         print(f"Error loading model or inferring class names: {e}")
         exit()
 
-# --- Function to Send Email Alert ---
-def send_email_alert(subject, message, image_data=None):
+# --- Hooks Called by the Model Registry ---
+def validate_model_version(model_version):
+    """Rejects a version the rest of the pipeline cannot serve, before it is swapped in."""
+    if ENABLE_CASCADE and 'Healthy' not in model_version.class_names:
+        raise ValueError(f"Cascade mode needs a 'Healthy' class; version '{model_version.version}' "
+                         f"has {model_version.class_names}.")
+    if embedding_index is not None and not model_version.embedding_dim:
+        raise ValueError(f"Version '{model_version.version}' gives no embeddings for the embedding index.")
+
+def on_model_activated(model_version):
+    global class_names
+    class_names = model_version.class_names
+    if cascade is not None:
+        cascade.set_class_names(class_names)
+    if frame_cache is not None:
+        frame_cache.clear() # Cached predictions came from the previous version
+
+def on_index_reloaded(index):
+    if KNN_CLASSIFIER and frame_cache is not None:
+        frame_cache.clear() # Cached kNN votes were over the previous build's labels
+
+# --- Function to Warm Up the Model Before the Port Opens ---
+def warm_up_model():
+    """
+    The registry already warmed up the model version (and the TTA batch shape) and checked
+    its labels; this runs the cascade's stage-one model once so it is traced before the port opens.
+    """
+    if cascade is not None:
+        cascade.stage_one.predict(np.zeros(cascade.stage_one.input_shape, dtype=np.float32))
+    print("Model warm-up inference done.")
+
+# --- Function to Start Pulling Camera Streams ---
+def start_stream_ingest():
+    global stream_ingest
+    if not STREAMS_CONFIG_PATH:
+        return
+    stream_ingest = StreamIngest(load_cameras(STREAMS_CONFIG_PATH),
+                                 lambda camera_id, jpeg_bytes: process_frame(jpeg_bytes, camera_id),
+                                 workers=STREAM_INFERENCE_WORKERS).start()
+
+# --- Functions to Run the Active Model Version ---
+def predict_probabilities(img_array):
+    """
+    Takes one preprocessed image of shape (H, W, 3) and returns its class probability vector.
+    Goes through the active version's micro-batcher when enabled so concurrent requests share a forward pass.
+    """
+    with model_registry.lease() as model:
+        return model.predict(img_array)
+
+def predict_batch_probabilities(batch):
+    with model_registry.lease() as model:
+        return model.predict_batch(batch)
+
+# --- One Uploaded Frame, End to End ---
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before its frame reached the model (see asgi_server.py)."""
+
+def process_frame(img_bytes, camera_id, bypass_cache=False, request_start=None, deadline=None, timer=None):
+    """
+    Decodes, scores, publishes, records and (if needed) alerts on one camera frame and returns
+    the /predict response body. Shared by the Flask route, the ASGI front end and stream ingest.
+    deadline is a time.monotonic() value; past it the model is skipped and DeadlineExceeded raised.
+    timer is the caller's metrics.StageTimer; without one the frame gets its own, finished here.
+    """
+    if request_start is None:
+        request_start = time.perf_counter()
+    if timer is not None:
+        return _process_frame(img_bytes, camera_id, bypass_cache, request_start, deadline, timer)
+    timer = instruments.timer(request_start)
+    timer.mark('wait') # Upload read (ASGI) or executor queue before the frame got here
     try:
-        msg = MIMEMultipart()
-        msg['From'] = SENDER_EMAIL
-        msg['To'] = ", ".join(RECIPIENT_EMAILS)
-        msg['Subject'] = subject
-
-        msg.attach(MIMEText(message, 'plain'))
-
-        if image_data:
-            img_part = MIMEImage(image_data, name='detected_pig_image.jpg')
-            msg.attach(img_part)
-
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SENDER_EMAIL, SENDER_PASSWORD)
-            server.sendmail(SENDER_EMAIL, RECIPIENT_EMAILS, msg.as_string())
-        print("Email alert sent successfully!")
-        return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
+        result = _process_frame(img_bytes, camera_id, bypass_cache, request_start, deadline, timer)
+    except DeadlineExceeded:
+        instruments.errors.inc(('deadline',))
+        timer.finish('deadline')
+        raise
+    except Exception:
+        instruments.errors.inc(('processing',))
+        timer.finish('error')
+        raise
+    timer.finish()
+    return result
+
+def _process_frame(img_bytes, camera_id, bypass_cache, request_start, deadline, timer):
+    # One decode per frame (JPEG draft mode decodes straight to ~1/4 scale); the model
+    # input and the thumbnail are both cut from this same buffer.
+    frame = decode_frame(img_bytes, target_size=IMAGE_SIZE)
+    timer.mark('decode')
+
+    # Same scene as a recent frame from this camera? Then reuse its prediction.
+    probabilities = None
+    if frame_cache is not None:
+        frame_hash = difference_hash(frame)
+        if bypass_cache:
+            frame_cache.record_bypass()
+        else:
+            probabilities = frame_cache.lookup(camera_id, frame_hash)
+        timer.mark('cache')
+    cached = probabilities is not None
+
+    # A cached answer is still cheap enough to return; a model run for a client that gave up is not
+    if not cached and deadline is not None and time.monotonic() > deadline:
+        raise DeadlineExceeded("Request deadline passed before inference")
+
+    stage = None
+    tta_fired = False
+    embedding = None
+    similar = None
+    # The whole request uses one model version, even if a new one is swapped in meanwhile
+    with model_registry.lease() as model:
+        if not cached:
+            if cascade is not None:
+                # Stage one answers confidently healthy frames; the rest go to the full model
+                probabilities, stage = cascade.predict(frame, full_predict_fn=model.predict)
+            else:
+                img_array = to_model_input(frame, IMAGE_SIZE)
+                if embedding_index is not None:
+                    probabilities, embedding = model.predict_with_embedding(img_array)
+                else:
+                    probabilities = model.predict(img_array)
+            timer.mark('inference') # Includes the wait for the micro-batch to fill
+            if stage != 1 and (tta is not None or model_registry.shadow is not None):
+                if cascade is not None:
+                    img_array = to_model_input(frame, IMAGE_SIZE)
+                # Shadow candidate scores the same input off the request thread
+                model_registry.submit_shadow(model, img_array, probabilities)
+                if tta is not None:
+                    probabilities, tta_fired = tta.refine(img_array, probabilities,
+                                                          predict_batch_fn=model.predict_batch)
+                timer.mark('tta')
+            if embedding is not None:
+                if KNN_CLASSIFIER:
+                    probabilities, knn_class_names, similar = embedding_index.classify(embedding)
+                    similar = similar[:SIMILAR_IMAGES_K]
+                else:
+                    similar = embedding_index.similar(embedding, SIMILAR_IMAGES_K)
+                timer.mark('similar')
+            if frame_cache is not None:
+                frame_cache.store(camera_id, frame_hash, probabilities)
+    model_version = model.version
+    # In kNN mode the probabilities are over the index labels (cached ones too; the cache is cleared on reload)
+    label_names = model.class_names
+    if KNN_CLASSIFIER:
+        label_names = knn_class_names if embedding is not None else embedding_index.class_names
+
+    predicted_class_index = np.argmax(probabilities)
+    predicted_class_name = label_names[predicted_class_index]
+    confidence = probabilities[predicted_class_index] * 100
+
+    response_message = f"[{camera_id}] Predicted: {predicted_class_name} (Confidence: {confidence:.2f}%)"
+    if cached:
+        response_message += " [cached]"
+    elif stage == 1:
+        response_message += " [stage one]"
+    if tta_fired:
+        response_message += " [TTA]"
+    print(response_message)
+
+    # Define your disease classes (excluding 'Healthy' and any 'background' class)
+    disease_classes = [name for name in label_names if name != 'Healthy' and name != 'Background' and name != 'Not_Pig']
+
+    # --- Publish to the per-camera state and to /events subscribers ---
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # The thumbnail is only encoded when /thumbnail or /latest_prediction actually asks for it.
+    event = prediction_feed.publish(camera_id, predicted_class_name, confidence, timestamp,
+                                    thumbnail=LazyThumbnail(frame),
+                                    extra={"cached": cached, "stage": stage, "tta": tta_fired,
+                                           "model_version": model_version})
+
+    # History row; only queued here, the store's writer thread does the disk work
+    if prediction_store is not None:
+        prediction_store.record(camera_id, predicted_class_name, confidence, probabilities=probabilities,
+                                latency_ms=(time.perf_counter() - request_start) * 1000.0,
+                                image_ref=event["thumbnail_url"], event_id=event["id"],
+                                cached=cached, stage=stage)
+    timer.mark('publish')
+    source = "cache" if cached else "stage_one" if stage == 1 else "knn" if KNN_CLASSIFIER else "model"
+    instruments.predictions.inc((predicted_class_name, source))
+
+    # --- NEW: Alerting Logic with Cooldown and Higher Threshold ---
+    # Check if it's a disease class AND confidence is high enough (REQUIRED_CONFIDENCE_THRESHOLD)
+    if predicted_class_name in disease_classes and confidence >= REQUIRED_CONFIDENCE_THRESHOLD:
+        # The dispatcher checks the cooldown and queues the email; sending happens in the background.
+        if alert_dispatcher.submit(predicted_class_name, confidence, timestamp, image_data=img_bytes):
+            print(f"Alert for '{predicted_class_name}' queued for sending.")
+    else:
+        print(f"Prediction: {predicted_class_name} (Confidence: {confidence:.2f}%). No alert sent (not a disease or confidence too low).")
+    # --- END NEW ALERTING LOGIC ---
+    timer.mark('alert')
+
+    return {
+        "camera_id": camera_id,
+        "prediction": predicted_class_name,
+        "confidence": f"{confidence:.2f}%",
+        "cached": cached,
+        "stage": stage, # 1 or 2 in cascade mode, otherwise None
+        "tta": tta_fired,
+        "model_version": model_version,
+        "classifier": "knn" if KNN_CLASSIFIER else "model",
+        "similar": similar, # Nearest reference images when the embedding index is on (None for cached frames)
+        "message": response_message
+    }
 
 # --- Flask Route for Image Inference ---
 @app.route('/predict', methods=['POST'])
 def predict_image_route():
-    global latest_prediction_data, last_alert_times # Allow modification of global variables
+    request_start = time.perf_counter()
+    timer = instruments.timer(request_start)
     img_bytes = request.get_data()
+    timer.mark('read')
 
     if not img_bytes:
+        instruments.errors.inc(('bad_request',))
+        timer.finish('bad_request')
         return jsonify({"error": "No image data provided in request body"}), 400
 
+    # Cameras identify themselves with an X-Camera-Id header or ?camera_id=, so they don't overwrite each other
     try:
-        img = image.load_img(io.BytesIO(img_bytes), target_size=IMAGE_SIZE)
-        img_array = image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = img_array / 255.0
-
-        predictions = model.predict(img_array)
-        predicted_class_index = np.argmax(predictions[0])
-        predicted_class_name = class_names[predicted_class_index]
-        confidence = predictions[0][predicted_class_index] * 100
-
-        response_message = f"Predicted: {predicted_class_name} (Confidence: {confidence:.2f}%)"
-        print(response_message)
-
-        # Define your disease classes (excluding 'Healthy' and any 'background' class)
-        disease_classes = [name for name in class_names if name != 'Healthy' and name != 'Background' and name != 'Not_Pig']
-
-        # --- NEW: Update latest_prediction_data ---
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        import base64 # Ensure base64 is imported here if not at top level
-        img_base64 = None
-        try:
-            display_img = Image.open(io.BytesIO(img_bytes))
-            display_img.thumbnail((320, 240))
-            buffered = io.BytesIO()
-            display_img.save(buffered, format="JPEG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        except Exception as img_e:
-            print(f"Error converting image to base64: {img_e}")
-            img_base64 = None
-
-        latest_prediction_data.update({
-            "prediction": predicted_class_name,
-            "confidence": f"{confidence:.2f}%",
-            "timestamp": timestamp,
-            "image": img_base64
-        })
-        # --- END NEW ---
-
-        # --- NEW: Alerting Logic with Cooldown and Higher Threshold ---
-        # Check if it's a disease class AND confidence is high enough
-        # --- THRESHOLD HERE ---
-        REQUIRED_CONFIDENCE_THRESHOLD = 80.0 # <--- INCREASED THRESHOLD 
-    
-
-        if predicted_class_name in disease_classes and confidence >= REQUIRED_CONFIDENCE_THRESHOLD:
-            current_time = datetime.datetime.now()
-            # Check if cooldown for this specific disease has passed
-            if predicted_class_name not in last_alert_times or \
-               (current_time - last_alert_times[predicted_class_name]).total_seconds() > ALERT_COOLDOWN_SECONDS:
-                
-                subject = f"Pig Health ALERT: {predicted_class_name} (High Confidence)"
-                email_message = f"A pig has been detected with potential symptoms of '{predicted_class_name}'.\n" \
-                                f"Confidence: {confidence:.2f}%\n" \
-                                f"Time: {timestamp}\n" \
-                                f"Please investigate immediately."
-                
-                if send_email_alert(subject, email_message, image_data=img_bytes):
-                    last_alert_times[predicted_class_name] = current_time # Update last alert time
-                
-            else:
-                time_since_last_alert = (current_time - last_alert_times[predicted_class_name]).total_seconds()
-                print(f"Alert for '{predicted_class_name}' is on cooldown. Last sent {time_since_last_alert:.0f} seconds ago. Next alert in {ALERT_COOLDOWN_SECONDS - time_since_last_alert:.0f} seconds.")
-        else:
-            print(f"Prediction: {predicted_class_name} (Confidence: {confidence:.2f}%). No alert sent (not a disease or confidence too low).")
-        # --- END NEW ALERTING LOGIC ---
+        camera_id = normalize_camera_id(request.headers.get('X-Camera-Id') or request.args.get('camera_id'))
+    except ValueError as e:
+        instruments.errors.inc(('bad_request',))
+        timer.finish('bad_request')
+        return jsonify({"error": str(e)}), 400
 
-        return jsonify({
-            "prediction": predicted_class_name,
-            "confidence": f"{confidence:.2f}%",
-            "message": response_message
-        }), 200
+    try:
+        bypass_cache = request.cache_control.no_cache or request.args.get('nocache') == '1'
+        response = jsonify(process_frame(img_bytes, camera_id, bypass_cache=bypass_cache,
+                                         request_start=request_start, timer=timer))
+        timer.mark('respond')
+        timer.finish()
+        return response, 200
 
     except Exception as e:
         print(f"Error during prediction or processing: {e}")
+        instruments.errors.inc(('processing',))
+        timer.finish('error')
         return jsonify({"error": str(e)}), 500
 
 # --- NEW: Endpoint to get the latest prediction ---
 @app.route('/latest_prediction', methods=['GET'])
 def get_latest_prediction():
-    # Return the stored latest prediction data
-    return jsonify(latest_prediction_data), 200
+    # Polling endpoint kept for existing dashboards. ?camera_id= picks a camera (default: most
+    # recent of any camera); ?include_image=0 skips the inline base64 thumbnail.
+    camera_id = request.args.get('camera_id')
+    event = prediction_feed.latest(camera_id)
+    if event is None:
+        return jsonify(NO_PREDICTION_YET), 200
+
+    response_data = dict(event)
+    response_data["image"] = None
+    if request.args.get('include_image', '1') != '0':
+        _, thumbnail = prediction_feed.thumbnail(event["camera_id"])
+        if thumbnail is not None:
+            try:
+                encode_start = time.perf_counter()
+                response_data["image"] = thumbnail.base64()
+                instruments.stage_seconds.observe(time.perf_counter() - encode_start, ('thumbnail_encode',))
+            except Exception as img_e:
+                print(f"Error converting image to base64: {img_e}")
+    return jsonify(response_data), 200
+
+# --- Push feed of prediction events (Server-Sent Events) ---
+@app.route('/events', methods=['GET'])
+def prediction_events():
+    # Optional ?camera_id= filter. Reconnecting EventSource clients send Last-Event-ID and only get newer events.
+    camera_id = request.args.get('camera_id')
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    stream = prediction_feed.stream(camera_id=camera_id, last_event_id=last_event_id)
+    return Response(stream_with_context(stream), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- Latest thumbnail per camera, with ETag so unchanged images are answered with 304 ---
+@app.route('/thumbnail/<camera_id>', methods=['GET'])
+def get_thumbnail(camera_id):
+    etag, thumbnail = prediction_feed.thumbnail(camera_id)
+    if thumbnail is None:
+        return jsonify({"error": f"No thumbnail for camera '{camera_id}'"}), 404
+    response = Response(mimetype='image/jpeg')
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache" # Always revalidate; a matching ETag costs no image bytes
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+    encode_start = time.perf_counter()
+    response.set_data(thumbnail.jpeg_bytes()) # Encoded on the first request for this frame, cached after
+    instruments.stage_seconds.observe(time.perf_counter() - encode_start, ('thumbnail_encode',))
+    return response
+
+# --- Latest state of every camera (no images) ---
+@app.route('/cameras', methods=['GET'])
+def get_cameras():
+    return jsonify(prediction_feed.snapshot()), 200
+
+# --- Endpoint to check on the background alert dispatcher ---
+@app.route('/alert_stats', methods=['GET'])
+def get_alert_stats():
+    return jsonify(alert_dispatcher.stats()), 200
+
+# --- Endpoint to report the batch sizes the micro-batcher actually formed ---
+@app.route('/batch_stats', methods=['GET'])
+def get_batch_stats():
+    model = model_registry.active
+    if model.batcher is None:
+        return jsonify({"backend": model.backend.name, "version": model.version, "micro_batching": False}), 200
+    return jsonify(dict(model.batcher.stats(), backend=model.backend.name, version=model.version,
+                        micro_batching=True)), 200
+
+# --- Endpoint to check how many frames the frame cache answered without the model ---
+@app.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    if frame_cache is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(frame_cache.stats(), enabled=True)), 200
+
+# --- Endpoint to report how many frames the cascade answered at stage one ---
+@app.route('/cascade_stats', methods=['GET'])
+def get_cascade_stats():
+    if cascade is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(cascade.stats(), enabled=True)), 200
+
+# --- Endpoint to report how often TTA fired and what it cost ---
+@app.route('/tta_stats', methods=['GET'])
+def get_tta_stats():
+    if tta is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(tta.stats(), enabled=True)), 200
+
+# --- Endpoint to report what the stream ingest pulled, sampled and scored per camera ---
+@app.route('/stream_stats', methods=['GET'])
+def get_stream_stats():
+    if stream_ingest is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(stream_ingest.stats(), enabled=True)), 200
+
+# --- Endpoint to describe the embedding index behind "similar" (and kNN mode) ---
+@app.route('/index_stats', methods=['GET'])
+def get_index_stats():
+    if embedding_index is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(embedding_index.stats(), enabled=True, knn_classifier=KNN_CLASSIFIER)), 200
+
+# --- Prometheus scrape endpoint ---
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+# --- Opt-in sampling profiler: folded stacks of every thread for N seconds (flamegraph.pl / speedscope) ---
+@app.route('/debug/profile', methods=['GET'])
+def capture_profile():
+    if profiler is None:
+        return jsonify({"error": "Profiler is off; start the server with PIGCAM_PROFILER=1"}), 404
+    denied = _admin_denied()
+    if denied:
+        return denied
+    try:
+        seconds = float(request.args.get('seconds', PROFILE_DEFAULT_SECONDS))
+        interval_ms = request.args.get('interval_ms')
+        interval = float(interval_ms) / 1000.0 if interval_ms else None
+    except ValueError:
+        return jsonify({"error": "seconds and interval_ms must be numbers"}), 400
+    try:
+        folded, rounds = profiler.capture(seconds, interval, include_idle=request.args.get('idle') == '1')
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    return Response(folded, mimetype='text/plain', headers={"X-Profile-Samples": str(rounds)})
+
+# --- Model versions: what is active, shadowed and loading, with per-version latency ---
+@app.route('/models', methods=['GET'])
+def get_models():
+    return jsonify(model_registry.describe()), 200
+
+def _admin_denied():
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({"error": "Missing or wrong X-Admin-Token"}), 403
+    return None
+
+def _requested_version():
+    body = request.get_json(silent=True) or {}
+    return body.get('version', request.args.get('version'))
+
+# --- Load a registry version in the background and swap it in once it is warmed up ---
+@app.route('/models/activate', methods=['POST'])
+def activate_model():
+    # {"version": "v3"} or ?version=v3; ?wait=1 answers only after the swap (or the failure)
+    denied = _admin_denied()
+    if denied:
+        return denied
+    version = _requested_version()
+    if version not in model_registry.list_versions():
+        return jsonify({"error": f"Unknown model version '{version}'",
+                        "available_versions": model_registry.list_versions()}), 404
+    wait = request.args.get('wait') == '1'
+    if not model_registry.activate(version, background=not wait):
+        if wait:
+            return jsonify({"error": f"Could not activate '{version}'", "status": model_registry.describe()}), 500
+        return jsonify({"error": f"Version '{version}' is already loading"}), 409
+    if wait:
+        return jsonify({"active": model_registry.active.version}), 200
+    return jsonify({"loading": version, "active": model_registry.active.version}), 202
+
+# --- Send a copy of the live frames to a candidate version for comparison ---
+@app.route('/models/shadow', methods=['POST', 'DELETE'])
+def shadow_model():
+    # POST {"version": "v4"} starts shadowing (loads in the background); DELETE stops it
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if request.method == 'DELETE':
+        model_registry.set_shadow(None)
+        return jsonify({"shadow": None}), 200
+    version = _requested_version()
+    if version not in model_registry.list_versions():
+        return jsonify({"error": f"Unknown model version '{version}'",
+                        "available_versions": model_registry.list_versions()}), 404
+    if not model_registry.set_shadow(version):
+        return jsonify({"error": f"Version '{version}' is already loading"}), 409
+    return jsonify({"loading": version, "role": "shadow"}), 202
+
+# --- Prediction history: counts per class per time bucket ---
+@app.route('/history/counts', methods=['GET'])
+def get_history_counts():
+    # ?bucket=<seconds> (default 3600), ?since= / ?until= (Unix time or ISO date), ?camera_id=
+    if prediction_store is None:
+        return jsonify({"error": "Prediction history is disabled"}), 404
+    try:
+        bucket_seconds = int(request.args.get('bucket', 3600))
+        since = parse_time(request.args.get('since'))
+        until = parse_time(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+    buckets = prediction_store.class_counts(bucket_seconds, since=since, until=until,
+                                            camera_id=request.args.get('camera_id'))
+    return jsonify({"bucket_seconds": bucket_seconds, "buckets": buckets}), 200
+
+# --- Prediction history: last N events ---
+@app.route('/history/recent', methods=['GET'])
+def get_history_recent():
+    # ?camera_id= (default: all cameras), ?limit= (default 50)
+    if prediction_store is None:
+        return jsonify({"error": "Prediction history is disabled"}), 404
+    try:
+        limit = min(int(request.args.get('limit', HISTORY_DEFAULT_LIMIT)), HISTORY_MAX_LIMIT)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+    events = prediction_store.recent(request.args.get('camera_id'), limit=limit, class_names=class_names)
+    return jsonify(events), 200
+
+# --- Endpoint to check on the background history writer ---
+@app.route('/history/stats', methods=['GET'])
+def get_history_stats():
+    if prediction_store is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(prediction_store.stats(), enabled=True)), 200
 
 # --- Main Execution ---
 if __name__ == '__main__':
-    # Ensure base64 is imported for image encoding (moved here for clarity)
-    import base64 
     load_model_and_classes()
+    alert_dispatcher.start()
+    if prediction_store is not None:
+        prediction_store.start()
+    start_stream_ingest()
     print("\n--- Starting Flask Server ---")
-    app.run(host='0.0.0.0', port=5000)
+    app.run(host='0.0.0.0', port=5000, threaded=True) # threaded so concurrent frames can share a batch
@@ -0,0 +1,386 @@
+import argparse
+import bisect
+import linecache
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as _TallyCounter
+
+# --- Configuration ---
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implied
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+NUM_STRIPES = 8 # Independent lock+table pairs per metric; a thread always uses the same one
+PROFILE_INTERVAL_SECONDS = 0.005 # Sampling profiler: one stack sample of every thread per interval
+PROFILE_MAX_SECONDS = 120
+# A thread whose innermost Python frame is one of these functions, or is on a line making one of these
+# calls (C calls like time.sleep have no frame of their own), is parked; left out of profiles unless asked for
+IDLE_FUNCTIONS = {'wait', 'select', 'poll', 'accept', '_wait_for_tstate_lock'}
+IDLE_CALLS = ('sleep(', '.wait(', 'queue.get(', 'select(', '.accept(', '.recv(', '.recv_into(', '.readinto(',
+              '.join(', '.result(')
+
+
+def _stripe_index():
+    return threading.get_ident() % NUM_STRIPES
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# --- Metric Types ---
+class Counter:
+    """
+    Monotonic counter with labels. Updates go to one of NUM_STRIPES tables picked by thread id,
+    each with its own lock, so request threads rarely wait on each other; a scrape sums the stripes.
+    """
+
+    type_name = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._stripes = [(threading.Lock(), {}) for _ in range(NUM_STRIPES)]
+
+    def inc(self, label_values=(), amount=1):
+        lock, table = self._stripes[_stripe_index()]
+        with lock:
+            table[label_values] = table.get(label_values, 0) + amount
+
+    def values(self):
+        totals = {}
+        for lock, table in self._stripes:
+            with lock:
+                for labels, value in table.items():
+                    totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+                for labels, value in sorted(self.values().items())]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels (Prometheus semantics), striped like Counter."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._stripes = [(threading.Lock(), {}) for _ in range(NUM_STRIPES)]
+
+    def _cell(self, table, label_values):
+        cell = table.get(label_values)
+        if cell is None:
+            cell = table[label_values] = [0] * (len(self.buckets) + 1) + [0.0] # bucket counts (+Inf last), sum
+        return cell
+
+    def observe(self, value, label_values=()):
+        self.observe_many([(label_values, value)])
+
+    def observe_many(self, observations):
+        """[(label_values, value)] under one lock acquisition (one request's stages at once)."""
+        buckets = self.buckets
+        lock, table = self._stripes[_stripe_index()]
+        with lock:
+            for label_values, value in observations:
+                cell = self._cell(table, label_values)
+                cell[bisect.bisect_left(buckets, value)] += 1
+                cell[-1] += value
+
+    def values(self):
+        totals = {}
+        for lock, table in self._stripes:
+            with lock:
+                for labels, cell in table.items():
+                    total = totals.setdefault(labels, [0] * len(cell))
+                    for index, value in enumerate(cell):
+                        total[index] += value
+        return totals
+
+    def render(self):
+        lines = []
+        for labels, cell in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), cell[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(cell[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Gauge or counter read at scrape time from a function returning a number, or a dict of
+    {label value (or tuple of them): number}. Used for state other modules already keep
+    (queue depths, the alert dispatcher's counts), so nothing extra runs on the hot path.
+    """
+
+    def __init__(self, name, help_text, fn, label_names=(), type_name='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        self.label_names = tuple(label_names)
+        self.type_name = type_name
+
+    def render(self):
+        value = self.fn()
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            return [f"{self.name} {_format_value(value)}"]
+        lines = []
+        for labels, number in sorted(value.items(), key=lambda item: str(item[0])):
+            if number is None:
+                continue
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(number)}")
+        return lines
+
+
+# --- Registry ---
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self.add(Counter(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help_text, label_names, buckets))
+
+    def gauge_callback(self, name, help_text, fn, label_names=()):
+        return self.add(CallbackMetric(name, help_text, fn, label_names, 'gauge'))
+
+    def counter_callback(self, name, help_text, fn, label_names=()):
+        return self.add(CallbackMetric(name, help_text, fn, label_names, 'counter'))
+
+    def render(self):
+        """The Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.render()
+            except Exception as e: # One broken callback must not take the whole scrape down
+                print(f"Metric '{metric.name}' failed to render: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+# --- Per-Request Stage Timing ---
+class StageTimer:
+    """
+    Splits one request into consecutive stages with a single perf_counter() call per stage:
+    mark('decode') records the time since the previous mark as the 'decode' stage. finish()
+    writes all stages and the total into the histograms under one lock, and adds its own cost
+    to the instrumentation-overhead counter so the overhead is measured, not guessed.
+    """
+
+    __slots__ = ('_instruments', '_start', '_last', '_stages')
+
+    def __init__(self, instruments, start=None):
+        self._instruments = instruments
+        self._start = self._last = start if start is not None else time.perf_counter()
+        self._stages = []
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self._stages.append(((stage,), now - self._last))
+        self._last = now
+
+    def finish(self, outcome='ok'):
+        end = time.perf_counter()
+        instruments = self._instruments
+        instruments.stage_seconds.observe_many(self._stages)
+        instruments.request_seconds.observe(end - self._start, (outcome,))
+        # finish() itself, plus the calibrated cost of each mark() (measuring every mark would double it)
+        overhead = time.perf_counter() - end + len(self._stages) * instruments.mark_cost_seconds
+        instruments.overhead_seconds.inc((), overhead)
+
+
+class RequestInstruments:
+    """The hot-path metrics of the inference server, created on a registry."""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.stage_seconds = registry.histogram(
+            'pigcam_stage_seconds', "Time per request stage (read, decode, cache, inference, ...)", ('stage',))
+        self.request_seconds = registry.histogram(
+            'pigcam_request_seconds', "End-to-end time of instrumented requests", ('outcome',))
+        self.predictions = registry.counter(
+            'pigcam_predictions_total', "Predictions by predicted class and where the answer came from",
+            ('class', 'source'))
+        self.errors = registry.counter('pigcam_errors_total', "Failed requests by kind", ('kind',))
+        self.overhead_seconds = registry.counter(
+            'pigcam_instrumentation_seconds_total', "Time spent recording these metrics on the request path")
+        registry.gauge_callback('pigcam_instrumentation_overhead_ratio',
+                                "Instrumentation time as a fraction of instrumented request time",
+                                self.overhead_ratio)
+        registry.gauge_callback('process_resident_memory_bytes', "Resident set size of the server process",
+                                resident_memory_bytes)
+        self.mark_cost_seconds = calibrate_mark_cost()
+
+    def timer(self, start=None):
+        return StageTimer(self, start)
+
+    def overhead_ratio(self):
+        total = sum(cell[-1] for cell in self.request_seconds.values().values())
+        return self.overhead_seconds.values().get((), 0.0) / total if total else None
+
+
+def calibrate_mark_cost(iterations=2000):
+    """Seconds one StageTimer.mark() takes on this machine (measured once at start-up)."""
+    timer = StageTimer(None)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        timer.mark('calibration')
+    return (time.perf_counter() - start) / iterations
+
+
+def resident_memory_bytes():
+    """Current RSS: psutil when installed, /proc on Linux, otherwise unknown (None)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# --- Sampling Profiler ---
+class SamplingProfiler:
+    """
+    Samples the Python stack of every thread at a fixed interval for a few seconds and returns
+    the counts in the "folded" format (`thread;outer;...;inner count` per line) that
+    flamegraph.pl, inferno and speedscope read directly. Only runs while a capture is asked for,
+    and only one capture at a time.
+    """
+
+    def __init__(self, interval_seconds=PROFILE_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self._capture_lock = threading.Lock()
+        self._idle_lines = {} # (filename, line) -> parked?, so each source line is looked at once
+
+    def _is_idle(self, frame):
+        key = (frame.f_code.co_filename, frame.f_lineno)
+        idle = self._idle_lines.get(key)
+        if idle is None:
+            line = linecache.getline(*key)
+            idle = frame.f_code.co_name in IDLE_FUNCTIONS or any(call in line for call in IDLE_CALLS)
+            self._idle_lines[key] = idle
+        return idle
+
+    @staticmethod
+    def _stack(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        names.reverse()
+        return names
+
+    def capture(self, seconds, interval_seconds=None, include_idle=False):
+        """Returns (folded stack text, number of sampling rounds); raises RuntimeError if a capture is running."""
+        if not self._capture_lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already being captured")
+        try:
+            interval = interval_seconds or self.interval_seconds
+            seconds = min(float(seconds), PROFILE_MAX_SECONDS)
+            own_id = threading.get_ident()
+            tallies = _TallyCounter()
+            rounds = 0
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                # Pool and per-request threads (Thread-95, inference_3) fold into one name each
+                names = {thread.ident: re.sub(r'[-_]\d+', '', thread.name).replace(';', ':')
+                         for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    if not include_idle and self._is_idle(frame):
+                        continue
+                    stack = self._stack(frame)
+                    tallies[';'.join([names.get(thread_id, 'thread')] + stack)] += 1
+                rounds += 1
+                time.sleep(interval)
+            return ''.join(f"{stack} {count}\n" for stack, count in tallies.most_common()), rounds
+        finally:
+            self._capture_lock.release()
+
+
+# --- Overhead Benchmark ---
+def benchmark_overhead(requests=20000, stages=8, request_ms=None):
+    """
+    Cost of the instrumentation of one request (stage marks, finish, a prediction count) in
+    microseconds, and as a share of request_ms (default: 20 ms, a fast Keras request on a PC).
+    """
+    registry = MetricsRegistry()
+    instruments = RequestInstruments(registry)
+    stage_names = [f"stage{index}" for index in range(stages)]
+    start = time.perf_counter()
+    for _ in range(requests):
+        timer = instruments.timer()
+        for name in stage_names:
+            timer.mark(name)
+        timer.finish()
+        instruments.predictions.inc(('Healthy', 'model'))
+    per_request = (time.perf_counter() - start) / requests
+    request_ms = request_ms or 20.0
+    render_start = time.perf_counter()
+    registry.render()
+    return {"stages": stages, "microseconds_per_request": per_request * 1e6,
+            "share_of_request": per_request * 1000.0 / request_ms, "request_ms": request_ms,
+            "self_measured_seconds_per_request": instruments.overhead_seconds.values()[()] / requests,
+            "scrape_ms": (time.perf_counter() - render_start) * 1000.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference server metrics helpers.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    overhead_parser = subparsers.add_parser('overhead', help="Measure the per-request instrumentation cost")
+    overhead_parser.add_argument('--requests', type=int, default=20000)
+    overhead_parser.add_argument('--stages', type=int, default=8)
+    overhead_parser.add_argument('--request-ms', type=float, default=None,
+                                 help="Typical request time to compare against (default 20 ms)")
+    args = parser.parse_args()
+
+    result = benchmark_overhead(args.requests, args.stages, args.request_ms)
+    print(f"{result['microseconds_per_request']:.1f} us per request with {result['stages']} stages "
+          f"({result['share_of_request']:.3%} of a {result['request_ms']:.0f} ms request); "
+          f"self-measured {result['self_measured_seconds_per_request'] * 1e6:.1f} us; scrape {result['scrape_ms']:.2f} ms.")
+
+
+if __name__ == "__main__":
+    main()
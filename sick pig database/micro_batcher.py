@@ -0,0 +1,120 @@
+import threading
+import queue
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Collects single-frame inference requests coming from concurrent HTTP threads
+    and runs them through the model as one batched forward pass.
+
+    A background worker waits for the first queued frame, then keeps draining the
+    queue until it has max_batch_size frames or max_wait_ms has passed since that
+    first frame arrived. Each caller gets back only its own row of the result.
+    """
+
+    def __init__(self, predict_batch_fn, max_batch_size=16, max_wait_ms=10, name='micro-batcher'):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_batch_fn = predict_batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_size_counts = Counter()
+        self._frames_processed = 0
+        self._batches_run = 0
+        self._running = True
+        self._close_lock = threading.Lock() # Makes predict()'s check-and-queue atomic with close()
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def predict(self, sample, timeout=None):
+        """
+        Queues one preprocessed sample (shape without the batch axis, e.g. (224, 224, 3))
+        and blocks until its prediction row is available.
+        """
+        future = Future()
+        with self._close_lock:
+            # No frame can land behind the shutdown sentinel, where the worker would never see it
+            if not self._running:
+                raise RuntimeError("MicroBatcher has been closed")
+            self._queue.put((sample, future))
+        return future.result(timeout=timeout)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """Returns the batch sizes actually formed so far, for tuning max_batch_size / max_wait_ms."""
+        with self._stats_lock:
+            batches = self._batches_run
+            frames = self._frames_processed
+            histogram = {str(size): count for size, count in sorted(self._batch_size_counts.items())}
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_seconds * 1000.0,
+            "batches_run": batches,
+            "frames_processed": frames,
+            "average_batch_size": (frames / batches) if batches else 0.0,
+            "batch_size_histogram": histogram,
+            "queue_depth": self.queue_depth(),
+        }
+
+    def close(self, timeout=None):
+        """Stops accepting new frames, lets the worker finish what is already queued and exits."""
+        with self._close_lock:
+            if not self._running:
+                return
+            self._running = False
+            self._queue.put(None)
+        self._worker.join(timeout)
+
+    # --- Worker ---
+    def _collect_batch(self, first_item):
+        batch = [first_item]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Frames that are already waiting are taken without sleeping at all.
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Shutdown sentinel: put it back so the outer loop sees it after this batch.
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                if self._queue.empty():
+                    return
+                # Frames were still queued behind the sentinel: serve them first.
+                self._queue.put(None)
+                continue
+
+            batch = self._collect_batch(item)
+            futures = [future for _, future in batch]
+            try:
+                inputs = np.stack([sample for sample, _ in batch], axis=0)
+                outputs = self.predict_batch_fn(inputs)
+                for index, future in enumerate(futures):
+                    future.set_result(outputs[index])
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+            with self._stats_lock:
+                self._batch_size_counts[len(batch)] += 1
+                self._batches_run += 1
+                self._frames_processed += len(batch)
@@ -0,0 +1,635 @@
+import argparse
+import collections
+import contextlib
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+import numpy as np
+from micro_batcher import MicroBatcher
+from class_labels import LABELS_FILENAME, load_class_names
+
+# --- Configuration ---
+# Registry layout (one folder per version, plus two pointer files):
+#   model_registry/
+#     ACTIVE                 <- name of the version the server should serve
+#     SHADOW                 <- optional: candidate version that gets a copy of the traffic
+#     v1/  pig_disease_detector_model.h5, quantized_pig_detector.tflite, labels.json, metadata.json
+#     v2/  ...
+REGISTRY_DIR = 'C:/Users/Alfred/Desktop/sick pig database/model_registry'
+ACTIVE_POINTER = 'ACTIVE'
+SHADOW_POINTER = 'SHADOW'
+METADATA_FILENAME = 'metadata.json'
+MODEL_EXTENSIONS = {'keras': ('.h5', '.keras'), 'tflite': ('.tflite',)}
+LATENCY_WINDOW = 1000 # Recent timings kept per version for the percentiles in stats()
+SHADOW_QUEUE_SIZE = 64 # Shadow frames waiting beyond this are dropped, never the live request
+RETIRE_TIMEOUT_SECONDS = 60.0 # Longest a replaced version waits for its in-flight requests before closing
+
+
+def _latency_summary(timings):
+    if not timings:
+        return None
+    values = np.array(timings)
+    return {"count": int(len(values)), "mean": float(values.mean()),
+            "p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+            "p99": float(np.percentile(values, 99))}
+
+
+def find_model_file(version_dir, backend_name, metadata=None):
+    """The model file of a version: metadata.json's "model_files" entry for the backend, else the first match by extension."""
+    named = (metadata or {}).get('model_files', {}).get(backend_name)
+    if named:
+        return os.path.join(version_dir, named)
+    for filename in sorted(os.listdir(version_dir)):
+        if filename.lower().endswith(MODEL_EXTENSIONS[backend_name]):
+            return os.path.join(version_dir, filename)
+    raise FileNotFoundError(f"No {backend_name} model file in '{version_dir}'.")
+
+
+def warm_up(model_version, batch_sizes=(1,)):
+    """
+    Runs dummy batches of each size straight through the backend, so graph tracing and
+    interpreter setup happen before the version takes traffic. Also checks that the model
+    output matches the version's labels.
+    """
+    for batch_size in batch_sizes:
+        dummy = np.zeros((batch_size,) + tuple(model_version.backend.input_shape), dtype=np.float32)
+        outputs = model_version.backend.predict_batch(dummy)
+        if outputs.shape[-1] != len(model_version.class_names):
+            raise ValueError(f"Version '{model_version.version}' outputs {outputs.shape[-1]} classes "
+                             f"but its labels list {len(model_version.class_names)}.")
+    if model_version.embedding_dim:
+        dummy = np.zeros((1,) + tuple(model_version.backend.input_shape), dtype=np.float32)
+        model_version.backend.predict_batch_with_embeddings(dummy) # The joint model traces separately
+
+
+# --- One Loaded Model Version ---
+class ModelVersion:
+    """
+    A loaded model with its labels, metadata and its own micro-batcher (so frames of two
+    versions never end up in the same batch). Requests lease a version for their whole
+    duration; a version that has been swapped out is only closed once its leases are returned.
+
+    When the backend also exposes embeddings, the batcher runs the joint model and each row
+    carries the probabilities followed by the pooled features; predict() strips the latter.
+    """
+
+    def __init__(self, version, backend, class_names, metadata=None, micro_batching=True,
+                 max_batch_size=16, max_wait_ms=10):
+        self.version = version
+        self.backend = backend
+        self.class_names = list(class_names)
+        self.metadata = metadata or {}
+        self.loaded_at = time.time()
+        self.load_seconds = None
+        self.embedding_dim = getattr(backend, 'embedding_dim', None)
+        self._row_fn = self._timed_predict_batch_with_embeddings if self.embedding_dim else self._timed_predict_batch
+        self.batcher = None
+        if micro_batching and backend.supports_batching:
+            self.batcher = MicroBatcher(self._row_fn, max_batch_size=max_batch_size,
+                                        max_wait_ms=max_wait_ms, name=f'micro-batcher-{version}')
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._predict_ms = collections.deque(maxlen=LATENCY_WINDOW)
+        self._inference_ms = collections.deque(maxlen=LATENCY_WINDOW)
+        self._counts = {"predictions": 0, "batches": 0, "errors": 0}
+
+    # --- Inference ---
+    def predict(self, sample):
+        """One preprocessed (H, W, 3) image -> probability vector, through this version's batcher."""
+        return self._predict_row(sample)[:len(self.class_names)]
+
+    def predict_with_embedding(self, sample):
+        """(probabilities, pooled embedding) from the same forward pass; needs a backend with embeddings."""
+        row = self._predict_row(sample)
+        return row[:len(self.class_names)], row[len(self.class_names):]
+
+    def _predict_row(self, sample):
+        start = time.perf_counter()
+        try:
+            if self.batcher is not None:
+                row = self.batcher.predict(sample)
+            else:
+                row = self._row_fn(np.expand_dims(sample, axis=0))[0]
+        except Exception:
+            self._count("errors")
+            raise
+        self._record(self._predict_ms, start, "predictions")
+        return row
+
+    def predict_batch(self, batch):
+        """A whole batch in one backend call, bypassing the batcher (used for the TTA views)."""
+        return self._timed_predict_batch(batch)
+
+    def _timed_predict_batch(self, batch):
+        start = time.perf_counter()
+        outputs = np.asarray(self.backend.predict_batch(batch))
+        self._record(self._inference_ms, start, "batches")
+        return outputs
+
+    def _timed_predict_batch_with_embeddings(self, batch):
+        start = time.perf_counter()
+        outputs = self.backend.predict_batch_with_embeddings(batch)
+        self._record(self._inference_ms, start, "batches")
+        return outputs
+
+    # --- Leases ---
+    def acquire(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout=None):
+        with self._lock:
+            return self._idle.wait_for(lambda: self._in_flight == 0, timeout)
+
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+
+    # --- Stats ---
+    def _record(self, timings, start, counter):
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            timings.append(elapsed_ms)
+            self._counts[counter] += 1
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            predict_ms = list(self._predict_ms)
+            inference_ms = list(self._inference_ms)
+            in_flight = self._in_flight
+        counts.update({
+            "version": self.version,
+            "backend": self.backend.name,
+            "model_path": self.backend.model_path,
+            "num_classes": len(self.class_names),
+            "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.loaded_at)),
+            "load_seconds": self.load_seconds,
+            "in_flight": in_flight,
+            # predict = what a request waits (batcher queue + forward pass); inference = one backend call
+            "predict_ms": _latency_summary(predict_ms),
+            "inference_ms": _latency_summary(inference_ms),
+            "batching": self.batcher.stats() if self.batcher is not None else None,
+            "metadata": self.metadata,
+        })
+        return counts
+
+
+# --- Shadow Comparison ---
+class ShadowComparison:
+    """Agreement between the active version and a shadow candidate on the same frames."""
+
+    def __init__(self, active_version, shadow_version):
+        self.active_version = active_version
+        self.shadow_version = shadow_version
+        self._lock = threading.Lock()
+        self._frames = 0
+        self._agreements = 0
+        self._confidence_delta = 0.0
+        self._disagreements = collections.Counter() # "active_class -> shadow_class": n
+        self._dropped = 0 # Frames the full shadow queue had no room for
+
+    def record(self, active_probabilities, shadow_probabilities, active_names, shadow_names):
+        active_class = active_names[int(np.argmax(active_probabilities))]
+        shadow_class = shadow_names[int(np.argmax(shadow_probabilities))]
+        with self._lock:
+            self._frames += 1
+            if active_class == shadow_class:
+                self._agreements += 1
+            else:
+                self._disagreements[f"{active_class} -> {shadow_class}"] += 1
+            self._confidence_delta += float(np.max(shadow_probabilities) - np.max(active_probabilities)) * 100
+
+    def count_dropped(self):
+        with self._lock:
+            self._dropped += 1
+
+    def stats(self):
+        with self._lock:
+            frames = self._frames
+            return {
+                "active_version": self.active_version,
+                "shadow_version": self.shadow_version,
+                "frames_compared": frames,
+                "frames_dropped": self._dropped,
+                "top1_agreement": self._agreements / frames if frames else None,
+                "mean_confidence_delta": self._confidence_delta / frames if frames else None,
+                "disagreements": dict(self._disagreements.most_common()),
+            }
+
+
+# --- Registry ---
+class ModelRegistry:
+    """
+    Serves one active model version out of a registry folder and swaps it without a restart.
+
+    activate() loads the new version in a background thread, warms it up and only then
+    replaces the active reference in one assignment. Requests that leased the old version
+    finish on it; the old version's batcher is closed after they have all returned. A shadow
+    version can be set to receive a copy of each live frame on a separate worker thread;
+    its answers are only compared with the active ones, never returned.
+    """
+
+    def __init__(self, registry_dir=REGISTRY_DIR, backend_name='keras', tflite_pool_size=4, tflite_num_threads=1,
+                 micro_batching=True, max_batch_size=16, max_wait_ms=10, warm_up_batch_sizes=(1,), with_embeddings=False,
+                 validate=None, on_activate=None, shadow_queue_size=SHADOW_QUEUE_SIZE):
+        self.registry_dir = registry_dir
+        self.backend_name = backend_name
+        self.tflite_pool_size = tflite_pool_size
+        self.tflite_num_threads = tflite_num_threads
+        self.micro_batching = micro_batching
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.warm_up_batch_sizes = tuple(warm_up_batch_sizes)
+        self.with_embeddings = with_embeddings # Keras versions also return pooled features (embedding_index.py)
+        self.validate = validate # Called with each newly loaded version before it can serve; raise to reject it
+        self.on_activate = on_activate # Called with the new ModelVersion right after each swap
+        self._active = None
+        self._shadow = None
+        self._comparison = None
+        self._retired = [] # Swapped-out versions still finishing their requests
+        self._lock = threading.Lock() # Guards the swaps and the bookkeeping below
+        self._loading = {} # { version: "activate" | "shadow" } while a background load runs
+        self._history = collections.deque(maxlen=20)
+        self._last_error = None
+        self._shadow_queue = queue.Queue(maxsize=shadow_queue_size)
+        self._shadow_worker = None
+        self._watcher = None
+        self._watching = False
+
+    # --- Versions on disk ---
+    def version_dir(self, version):
+        if not version or os.path.basename(version) != version or version.startswith('.'):
+            raise ValueError(f"Invalid model version name '{version}'.")
+        return os.path.join(self.registry_dir, version)
+
+    def list_versions(self):
+        if not os.path.isdir(self.registry_dir):
+            return []
+        return sorted(name for name in os.listdir(self.registry_dir)
+                      if os.path.isfile(os.path.join(self.registry_dir, name, LABELS_FILENAME)))
+
+    def read_pointer(self, name):
+        path = os.path.join(self.registry_dir, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+
+    # --- Loading ---
+    def load_version(self, version):
+        """Loads and warms up one registry version; the caller decides what to do with it."""
+        version_dir = self.version_dir(version)
+        if not os.path.isdir(version_dir):
+            raise FileNotFoundError(f"Model version '{version}' not found in '{self.registry_dir}'.")
+        metadata_path = os.path.join(version_dir, METADATA_FILENAME)
+        metadata = {}
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        return self.load_files(version, find_model_file(version_dir, self.backend_name, metadata),
+                               os.path.join(version_dir, LABELS_FILENAME), metadata)
+
+    def load_files(self, version, model_path, labels_path, metadata=None, class_names=None):
+        """Loads a version from explicit paths (also how a server without a registry folder starts)."""
+        from inference_backends import load_backend
+        start = time.perf_counter()
+        backend = load_backend(self.backend_name, keras_model_path=model_path, tflite_model_path=model_path,
+                               tflite_pool_size=self.tflite_pool_size, tflite_num_threads=self.tflite_num_threads,
+                               with_embedding=self.with_embeddings)
+        model_version = ModelVersion(version, backend, class_names or load_class_names(labels_path), metadata,
+                                     micro_batching=self.micro_batching, max_batch_size=self.max_batch_size,
+                                     max_wait_ms=self.max_wait_ms)
+        try:
+            warm_up(model_version, self.warm_up_batch_sizes)
+            if self.validate is not None:
+                self.validate(model_version)
+        except Exception:
+            model_version.close()
+            raise
+        model_version.load_seconds = time.perf_counter() - start
+        return model_version
+
+    def activate(self, version, background=True):
+        """
+        Loads `version` and makes it the active one. With background=True this returns at once
+        (False if that version is already loading); the current version keeps serving meanwhile.
+        """
+        return self._start_load(version, "activate", background)
+
+    def set_shadow(self, version, background=True):
+        """Loads `version` as the shadow candidate; None stops shadowing."""
+        if version is None:
+            self._swap_shadow(None)
+            return True
+        return self._start_load(version, "shadow", background)
+
+    def install(self, model_version):
+        """Makes an already loaded and warmed-up version the active one."""
+        with self._lock:
+            old = self._active
+            self._active = model_version # The swap itself: requests that start after this see the new version
+            if self._shadow is model_version:
+                # Promoted shadow: nothing left to compare it with
+                self._shadow = None
+                self._comparison = None
+            elif self._comparison is not None:
+                self._comparison = ShadowComparison(model_version.version, self._comparison.shadow_version)
+            self._history.append({"version": model_version.version, "role": "active",
+                                  "at": time.strftime("%Y-%m-%d %H:%M:%S")})
+        print(f"Model version '{model_version.version}' is now active "
+              f"({model_version.backend.name}, loaded in {model_version.load_seconds or 0:.1f} s).")
+        if self.on_activate is not None:
+            self.on_activate(model_version)
+        if old is not None and old is not model_version and old is not self._shadow:
+            self._retire(old)
+
+    def _start_load(self, version, role, background):
+        self.version_dir(version) # Validates the name before any thread starts
+        with self._lock:
+            if version in self._loading:
+                return False
+            self._loading[version] = role
+        if not background:
+            return self._load(version, role)
+        threading.Thread(target=self._load, args=(version, role), name=f'model-load-{version}', daemon=True).start()
+        return True
+
+    def _load(self, version, role):
+        print(f"Loading model version '{version}' ({role})...")
+        try:
+            # A version that is already loaded (e.g. promoting the shadow) is reused as is
+            current = self._shadow if role == "activate" else self._active
+            if current is not None and current.version == version:
+                model_version = current
+            else:
+                model_version = self.load_version(version)
+            if role == "activate":
+                self.install(model_version)
+            else:
+                self._swap_shadow(model_version)
+            return True
+        except Exception as e:
+            self._last_error = {"version": version, "role": role, "error": str(e),
+                                "at": time.strftime("%Y-%m-%d %H:%M:%S")}
+            print(f"Could not load model version '{version}': {e}. Still serving the current version.")
+            return False
+        finally:
+            with self._lock:
+                self._loading.pop(version, None)
+
+    def _swap_shadow(self, model_version):
+        with self._lock:
+            old = self._shadow
+            self._shadow = model_version
+            active_name = self._active.version if self._active is not None else None
+            self._comparison = ShadowComparison(active_name, model_version.version) if model_version else None
+            if model_version is not None:
+                self._history.append({"version": model_version.version, "role": "shadow",
+                                      "at": time.strftime("%Y-%m-%d %H:%M:%S")})
+        if model_version is not None:
+            self._start_shadow_worker()
+            print(f"Model version '{model_version.version}' now receives shadow traffic.")
+        if old is not None and old is not model_version and old is not self._active:
+            self._retire(old)
+
+    def _retire(self, old):
+        def finish():
+            if not old.wait_idle(RETIRE_TIMEOUT_SECONDS):
+                print(f"Model version '{old.version}' still had requests after {RETIRE_TIMEOUT_SECONDS:.0f} s; closing anyway.")
+            old.close()
+            with self._lock:
+                if old in self._retired:
+                    self._retired.remove(old)
+            print(f"Model version '{old.version}' retired.")
+
+        with self._lock:
+            self._retired.append(old)
+        threading.Thread(target=finish, name=f'model-retire-{old.version}', daemon=True).start()
+
+    # --- Requests ---
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def shadow(self):
+        return self._shadow
+
+    @contextlib.contextmanager
+    def lease(self):
+        """
+        The active version for the duration of one request. Everything inside the block uses
+        this same version even if a swap happens meanwhile.
+        """
+        # Read and acquire under the swap lock: a version swapped out in between would
+        # otherwise look idle to _retire and be closed under this request.
+        with self._lock:
+            model_version = self._active
+            if model_version is None:
+                raise RuntimeError("No model version is active yet.")
+            model_version.acquire()
+        try:
+            yield model_version
+        finally:
+            model_version.release()
+
+    # --- Shadow Traffic ---
+    def submit_shadow(self, active_version, sample, active_probabilities):
+        """Queues a frame the active version has just scored for the shadow version. Never blocks."""
+        comparison = self._comparison
+        if self._shadow is None or comparison is None:
+            return False
+        try:
+            self._shadow_queue.put_nowait((active_version, sample, active_probabilities, comparison))
+            return True
+        except queue.Full:
+            comparison.count_dropped()
+            return False
+
+    def _start_shadow_worker(self):
+        with self._lock:
+            if self._shadow_worker is not None:
+                return
+            self._shadow_worker = threading.Thread(target=self._run_shadow, name='model-shadow', daemon=True)
+        self._shadow_worker.start()
+
+    def _run_shadow(self):
+        while True:
+            active_version, sample, active_probabilities, comparison = self._shadow_queue.get()
+            # Check and acquire under the swap lock, as lease() does: a shadow stopped or replaced
+            # in between would otherwise look idle to _retire and be closed under this frame.
+            with self._lock:
+                shadow = self._shadow
+                if shadow is None or comparison is not self._comparison:
+                    continue # Shadow was stopped or replaced since this frame was queued
+                shadow.acquire()
+            try:
+                shadow_probabilities = shadow.predict(sample)
+                comparison.record(active_probabilities, shadow_probabilities,
+                                  active_version.class_names, shadow.class_names)
+            except Exception as e:
+                print(f"Shadow version '{shadow.version}' failed on a frame: {e}")
+            finally:
+                shadow.release()
+
+    # --- File Watch ---
+    def start_watching(self, interval_seconds=5.0):
+        """
+        Polls the ACTIVE and SHADOW pointer files; writing a version name into ACTIVE (e.g.
+        `python model_registry.py activate v3`) switches the server over without an HTTP call.
+        Only writes to the files count (not a mismatch with what is loaded), so a switch made
+        through the admin endpoint is not undone until someone writes a pointer again.
+        """
+        if self._watching or interval_seconds <= 0:
+            return
+        self._watching = True
+        seen = {name: self._pointer_state(name) for name in (ACTIVE_POINTER, SHADOW_POINTER)}
+
+        def watch():
+            while self._watching:
+                time.sleep(interval_seconds)
+                try:
+                    state = self._pointer_state(ACTIVE_POINTER)
+                    if state != seen[ACTIVE_POINTER]:
+                        seen[ACTIVE_POINTER] = state
+                        active = self._active
+                        if state[0] and (active is None or state[0] != active.version):
+                            self.activate(state[0])
+                    state = self._pointer_state(SHADOW_POINTER)
+                    if state != seen[SHADOW_POINTER]:
+                        seen[SHADOW_POINTER] = state
+                        self.set_shadow(state[0])
+                except Exception as e:
+                    print(f"Model registry watch error: {e}")
+
+        self._watcher = threading.Thread(target=watch, name='model-registry-watch', daemon=True)
+        self._watcher.start()
+
+    def _pointer_state(self, name):
+        path = os.path.join(self.registry_dir, name)
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        return self.read_pointer(name), mtime
+
+    def stop_watching(self):
+        self._watching = False
+
+    # --- Status ---
+    def shadow_queue_depth(self):
+        return self._shadow_queue.qsize()
+
+    def describe(self):
+        with self._lock:
+            active, shadow = self._active, self._shadow
+            comparison = self._comparison
+            retired = list(self._retired)
+            loading = dict(self._loading)
+            history = list(self._history)
+        return {
+            "registry_dir": self.registry_dir,
+            "backend": self.backend_name,
+            "available_versions": self.list_versions(),
+            "active": active.version if active is not None else None,
+            "shadow": shadow.version if shadow is not None else None,
+            "loading": loading,
+            "last_error": self._last_error,
+            "history": history,
+            "versions": {model_version.version: model_version.stats()
+                         for model_version in [active, shadow] + retired if model_version is not None},
+            "shadow_comparison": comparison.stats() if comparison is not None else None,
+        }
+
+
+# --- Command Line: publish versions and move the pointers ---
+def write_pointer(registry_dir, name, version):
+    """Rewrites a pointer file atomically, so the watching server never reads half a name."""
+    path = os.path.join(registry_dir, name)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write((version or '') + '\n')
+    os.replace(temp_path, path)
+
+
+def publish(registry_dir, version, model_paths, labels_path, notes=None):
+    """Copies model files and labels into registry_dir/version/ and writes its metadata.json."""
+    version_dir = os.path.join(registry_dir, version)
+    if os.path.exists(version_dir):
+        raise FileExistsError(f"Version '{version}' already exists in '{registry_dir}'.")
+    temp_dir = version_dir + '.partial'
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    model_files = {}
+    for model_path in model_paths:
+        filename = os.path.basename(model_path)
+        shutil.copy2(model_path, os.path.join(temp_dir, filename))
+        for backend_name, extensions in MODEL_EXTENSIONS.items():
+            if filename.lower().endswith(extensions):
+                model_files.setdefault(backend_name, filename)
+    shutil.copy2(labels_path, os.path.join(temp_dir, LABELS_FILENAME))
+    metadata = {"version": version, "published_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "model_files": model_files, "source_files": [os.path.abspath(path) for path in model_paths],
+                "notes": notes or ''}
+    with open(os.path.join(temp_dir, METADATA_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(temp_dir, version_dir) # A half-copied version is never visible under its real name
+    return version_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry the inference server serves from.")
+    parser.add_argument('--registry', default=REGISTRY_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    publish_parser = subparsers.add_parser('publish', help="Copy a trained model into the registry as a new version")
+    publish_parser.add_argument('version')
+    publish_parser.add_argument('--model', action='append', required=True,
+                                help="Model file (.h5/.keras/.tflite); repeat to publish several formats")
+    publish_parser.add_argument('--labels', required=True)
+    publish_parser.add_argument('--notes', default=None)
+    publish_parser.add_argument('--activate', action='store_true', help="Also point ACTIVE at the new version")
+
+    activate_parser = subparsers.add_parser('activate', help="Point ACTIVE at a version (a watching server switches)")
+    activate_parser.add_argument('version')
+    shadow_parser = subparsers.add_parser('shadow', help="Point SHADOW at a version, or clear it with 'none'")
+    shadow_parser.add_argument('version')
+    subparsers.add_parser('list', help="List versions and the pointers")
+    args = parser.parse_args()
+
+    os.makedirs(args.registry, exist_ok=True)
+    registry = ModelRegistry(args.registry)
+    if args.command == 'publish':
+        print(f"Published '{args.version}' to {publish(args.registry, args.version, args.model, args.labels, args.notes)}")
+        if args.activate:
+            write_pointer(args.registry, ACTIVE_POINTER, args.version)
+            print(f"ACTIVE -> {args.version}")
+    elif args.command in ('activate', 'shadow'):
+        version = None if args.version.lower() == 'none' else args.version
+        if version is not None and version not in registry.list_versions():
+            parser.error(f"Unknown version '{version}' (available: {registry.list_versions()})")
+        pointer = ACTIVE_POINTER if args.command == 'activate' else SHADOW_POINTER
+        write_pointer(args.registry, pointer, version)
+        print(f"{pointer} -> {version}")
+    else:
+        active, shadow = registry.read_pointer(ACTIVE_POINTER), registry.read_pointer(SHADOW_POINTER)
+        for version in registry.list_versions():
+            marker = " (active)" if version == active else " (shadow)" if version == shadow else ""
+            print(f"{version}{marker}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
-import tensorflow as tf
-from tensorflow.keras.preprocessing import image
-import numpy as np
+import argparse
+import collections
+import concurrent.futures
+import csv
+import glob
+import json
 import os
-import matplotlib.pyplot as plt
+import time
+import numpy as np
+from PIL import Image
+from class_labels import labels_path_for, resolve_class_names
+from image_pipeline import decode_frame
+
+# TensorFlow and matplotlib are imported inside the functions that need them, so the
+# decode worker processes (which re-import this module on Windows) stay lightweight.
 
 # --- Configuration ---
 # IMPORTANT: This path should point to your 'sick pig database' folder.
@@ -13,46 +23,62 @@ DATA_SUBFOLDER = 'category' # Must match what you used for training
 
 MODEL_PATH = 'pig_disease_detector_model.h5' # Path to your saved model
 
+LABELS_PATH = labels_path_for(MODEL_PATH) # labels.json written next to the model by train_pig_detector.py
+
 IMAGE_SIZE = (224, 224) # Must match the size used during training
 
+# --- Batch Mode Configuration ---
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp') # Same formats as tfdata_pipeline.py
+BATCH_SIZE = 64 # Images per model call; the last batch is padded so every call has the same shape
+DECODE_WORKERS = None # Decode processes; None = one per CPU core
+DECODE_CHUNK_SIZE = 32 # Files handed to a worker per task
+MAX_CHUNKS_IN_FLIGHT = 4 # Per worker; bounds the memory used by decoded images waiting for the model
+
+
 # --- 1. Load the Trained Model ---
-print("--- Loading the Trained Model ---")
-try:
-    model = tf.keras.models.load_model(MODEL_PATH)
-    print(f"Model '{MODEL_PATH}' loaded successfully.")
-except Exception as e:
-    print(f"Error loading model: {e}")
-    print("Please ensure 'pig_disease_detector_model.h5' is in the same directory as this script.")
-    exit()
-
-# --- 2. Get Class Names (from your training data) ---
-# We need to know the order of classes the model was trained on.
-# We can infer this from the directory structure used by ImageDataGenerator.
-print("\n--- Inferring Class Names ---")
-dummy_datagen = image.ImageDataGenerator(rescale=1./255)
-dummy_generator = dummy_datagen.flow_from_directory(
-    os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER),
-    target_size=IMAGE_SIZE,
-    batch_size=1, # Only need 1 for getting class names
-    class_mode='categorical',
-    shuffle=False
-)
-class_names = list(dummy_generator.class_indices.keys())
-print(f"Inferred {len(class_names)} classes: {class_names}")
+def load_model(model_path=MODEL_PATH):
+    import tensorflow as tf
+    print("--- Loading the Trained Model ---")
+    try:
+        model = tf.keras.models.load_model(model_path)
+        print(f"Model '{model_path}' loaded successfully.")
+        return model
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        print("Please ensure 'pig_disease_detector_model.h5' is in the same directory as this script.")
+        exit()
+
+
+# --- 2. Get Class Names (from the labels.json saved with the model) ---
+def load_class_names(labels_path=LABELS_PATH):
+    # We need to know the order of classes the model was trained on.
+    # train_pig_detector.py saves it next to the model; the dataset folders are only a fallback.
+    print("\n--- Loading Class Names ---")
+    class_names = resolve_class_names(labels_path, os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER))
+    print(f"Loaded {len(class_names)} classes: {class_names}")
+    return class_names
+
+
+def load_image(img_path, image_size=IMAGE_SIZE):
+    """Decodes any supported format (GIFs: first frame) to a uint8 (H, W, 3) array of image_size."""
+    with open(img_path, 'rb') as f:
+        img = decode_frame(f.read(), target_size=image_size, thumbnail_size=image_size)
+    if img.size != image_size:
+        img = img.resize(image_size, Image.NEAREST) # Same as keras image.load_img
+    return np.asarray(img, dtype=np.uint8)
+
 
 # --- 3. Function to Predict on a Single Image ---
-def predict_image(img_path):
+def predict_image(model, class_names, img_path, show_plot=True):
     print(f"\n--- Predicting for image: {img_path} ---")
     try:
-        # Load the image and resize it to the target size
-        img = image.load_img(img_path, target_size=IMAGE_SIZE)
-        img_array = image.img_to_array(img) # Convert image to numpy array
-        img_array = np.expand_dims(img_array, axis=0) # Add batch dimension (1, H, W, C)
-        img_array = img_array / 255.0 # Normalize pixel values (0-1)
+        # Load the image, resize it to the target size and add a batch dimension (1, H, W, C)
+        img = load_image(img_path)
+        img_array = np.expand_dims(img, axis=0).astype(np.float32) / 255.0 # Normalize pixel values (0-1)
 
         # Make prediction
-        predictions = model.predict(img_array)
-        
+        predictions = model.predict_on_batch(img_array)
+
         # Get the predicted class index (highest probability)
         predicted_class_index = np.argmax(predictions[0])
         predicted_class_name = class_names[predicted_class_index]
@@ -62,10 +88,12 @@ def predict_image(img_path):
         print(f"Confidence: {confidence:.2f}%")
 
         # Display the image with prediction
-        plt.imshow(img)
-        plt.title(f"Predicted: {predicted_class_name} ({confidence:.2f}%)")
-        plt.axis('off')
-        plt.show()
+        if show_plot:
+            import matplotlib.pyplot as plt
+            plt.imshow(img)
+            plt.title(f"Predicted: {predicted_class_name} ({confidence:.2f}%)")
+            plt.axis('off')
+            plt.show()
 
     except FileNotFoundError:
         print(f"Error: Image file not found at '{img_path}'.")
@@ -73,34 +101,271 @@ def predict_image(img_path):
     except Exception as e:
         print(f"An error occurred during prediction: {e}")
 
-# --- 4. Example Usage ---
-# IMPORTANT: You MUST replace these placeholder filenames with actual image filenames
-# from YOUR dataset! Go into the specified folders and find real .jpg or .png files.
 
-# Example 1: Pick an image from 'abnormal secretion'
-# Find a real image file in 'C:/Users/Alfred/Desktop/sick pig database/category/abnormal secretion/'
-sample_image_path_1 = os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER, 'abnormal secretion', 'abnormal secretion44.jpg') # <--- REPLACE 'example_image_1.jpg' with a real filename!
-predict_image(sample_image_path_1)
+# --- 4. Batch Mode: Collect Files ---
+def collect_image_files(inputs):
+    """Expands directories (recursively), glob patterns and plain file paths into a sorted, unique file list."""
+    files = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, file_names in os.walk(item):
+                files.update(os.path.join(root, name) for name in file_names if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif os.path.isfile(item):
+            files.add(item)
+        else:
+            matches = [path for path in glob.glob(item, recursive=True)
+                       if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)]
+            if not matches:
+                print(f"Warning: '{item}' matched no image files.")
+            files.update(matches)
+    return sorted(os.path.abspath(path) for path in files)
+
+
+# --- 5. Batch Mode: Parallel Decode ---
+def _decode_chunk(paths, image_size):
+    # Runs in a worker process; returns uint8 images (4x smaller to send back than float32)
+    results = []
+    for path in paths:
+        try:
+            results.append((path, load_image(path, image_size), None))
+        except Exception as e:
+            results.append((path, None, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def decode_in_parallel(paths, image_size, workers=DECODE_WORKERS, chunk_size=DECODE_CHUNK_SIZE):
+    """
+    Yields (path, uint8 image or None, error) in input order. Only a bounded number of chunks
+    is submitted ahead of the consumer, so an overnight run over a huge folder never holds
+    more than a few hundred decoded images in memory.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        next_chunk = 0
+        while next_chunk < len(chunks) or pending:
+            while next_chunk < len(chunks) and len(pending) < workers * MAX_CHUNKS_IN_FLIGHT:
+                pending.append(executor.submit(_decode_chunk, chunks[next_chunk], image_size))
+                next_chunk += 1
+            for result in pending.popleft().result():
+                yield result
+
+
+# --- 6. Batch Mode: Incremental Result Writers ---
+class ResultWriter:
+    """
+    Appends one row per scored file to a CSV or JSONL file and flushes after every batch,
+    so an interrupted run loses at most one batch. Files already in the output are skipped
+    on the next run (resume).
+    """
+
+    def __init__(self, output_path, class_names, output_format=None):
+        self.output_path = output_path
+        self.class_names = list(class_names)
+        self.format = output_format or ('jsonl' if output_path.lower().endswith(('.jsonl', '.json')) else 'csv')
+        self.header = ['path', 'predicted_class', 'confidence', 'error'] + [f"prob_{name}" for name in self.class_names]
+        self._drop_partial_line()
+        self.done = self._load_done()
+        is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self._file = open(output_path, 'a', newline='', encoding='utf-8')
+        self._csv = csv.writer(self._file) if self.format == 'csv' else None
+        if self._csv and is_new:
+            self._csv.writerow(self.header)
+
+    def _drop_partial_line(self):
+        """
+        A run killed mid-write leaves a last line without its newline. Cut the file back to the
+        last complete line, so that file is scored again and new rows do not continue the broken one.
+        """
+        if not os.path.exists(self.output_path):
+            return
+        with open(self.output_path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+            f.seek(end - 1)
+            if f.read(1) == b'\n':
+                return
+            position = end
+            while position > 0:
+                step = min(64 * 1024, position)
+                f.seek(position - step)
+                newline = f.read(step).rfind(b'\n')
+                if newline != -1:
+                    position = position - step + newline + 1
+                    break
+                position -= step
+            f.truncate(position)
+        print(f"Dropped a half-written last line from '{self.output_path}' (interrupted run).")
+
+    def _load_done(self):
+        if not os.path.exists(self.output_path):
+            return set()
+        done = set()
+        with open(self.output_path, 'r', newline='', encoding='utf-8') as f:
+            if self.format == 'csv':
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is not None and header != self.header:
+                    raise ValueError(f"'{self.output_path}' was written for different classes; use a new output file.")
+                # Only complete rows count; anything shorter is scored again
+                done.update(row[0] for row in reader if len(row) == len(self.header))
+            else:
+                for line in f:
+                    try:
+                        done.add(json.loads(line)["path"])
+                    except (ValueError, KeyError):
+                        pass # A half-written last line from an interrupted run is scored again
+        return done
+
+    def write(self, path, probabilities=None, error=None):
+        if probabilities is not None:
+            index = int(np.argmax(probabilities))
+            predicted_class, confidence = self.class_names[index], float(probabilities[index])
+        else:
+            predicted_class, confidence = None, None
+        if self._csv:
+            probs = [f"{p:.6f}" for p in probabilities] if probabilities is not None else [''] * len(self.class_names)
+            self._csv.writerow([path, predicted_class or '', f"{confidence:.6f}" if confidence is not None else '',
+                                error or ''] + probs)
+        else:
+            record = {"path": path, "predicted_class": predicted_class, "confidence": confidence, "error": error}
+            if probabilities is not None:
+                record["probabilities"] = {name: round(float(p), 6) for name, p in zip(self.class_names, probabilities)}
+            self._file.write(json.dumps(record) + '\n')
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+# --- 7. Batch Mode: Run ---
+def run_batch(model, class_names, inputs, output_path, output_format=None, batch_size=BATCH_SIZE,
+              workers=DECODE_WORKERS):
+    files = collect_image_files(inputs)
+    writer = ResultWriter(output_path, class_names, output_format)
+    todo = [path for path in files if path not in writer.done]
+    print(f"\n--- Batch Prediction: {len(files)} files found, {len(files) - len(todo)} already scored, "
+          f"{len(todo)} to go -> {output_path} ({writer.format}) ---")
+
+    counts = collections.Counter()
+    batch = np.zeros((batch_size, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.uint8)
+    batch_paths = []
+    scored = failed = 0
+    start = time.time()
+
+    def flush_batch():
+        # Fixed batch shape every call (unused rows are left over from the previous batch)
+        probabilities = model.predict_on_batch(batch.astype(np.float32) / 255.0) # Normalize pixel values (0-1)
+        probabilities = np.asarray(probabilities)[:len(batch_paths)]
+        for path, probs in zip(batch_paths, probabilities):
+            writer.write(path, probs)
+            counts[class_names[int(np.argmax(probs))]] += 1
+        writer.flush()
+        batch_paths.clear()
+
+    try:
+        for path, img, error in decode_in_parallel(todo, IMAGE_SIZE, workers=workers):
+            if error is not None:
+                writer.write(path, error=error)
+                failed += 1
+                continue
+            batch[len(batch_paths)] = img
+            batch_paths.append(path)
+            if len(batch_paths) == batch_size:
+                flush_batch()
+                scored += batch_size
+                elapsed = time.time() - start
+                print(f"Scored {scored}/{len(todo)} images ({scored / elapsed * 60:.0f} images/min)")
+        if batch_paths:
+            scored += len(batch_paths)
+            flush_batch()
+    finally:
+        writer.flush()
+        writer.close()
+
+    elapsed = time.time() - start
+    print(f"\nScored {scored} images in {elapsed:.1f} s ({scored / max(elapsed, 1e-9) * 60:.0f} images/min), "
+          f"{failed} could not be decoded.")
+    for class_name in class_names:
+        print(f"  {class_name:<22}{counts[class_name]:>7}")
+    return counts
+
+
+def plot_class_counts(counts, class_names):
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(10, 4))
+    plt.bar(class_names, [counts[name] for name in class_names])
+    plt.title('Predicted Classes')
+    plt.ylabel('Images')
+    plt.xticks(rotation=30, ha='right')
+    plt.tight_layout()
+    plt.show()
+
+
+# --- 8. Example Usage ---
+def run_examples(model, class_names, show_plot=True):
+    # IMPORTANT: You MUST replace these placeholder filenames with actual image filenames
+    # from YOUR dataset! Go into the specified folders and find real .jpg or .png files.
+    data_dir = os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER)
+
+    # Example 1: Pick an image from 'abnormal secretion'
+    # Find a real image file in 'C:/Users/Alfred/Desktop/sick pig database/category/abnormal secretion/'
+    sample_image_path_1 = os.path.join(data_dir, 'abnormal secretion', 'abnormal secretion44.jpg') # <--- REPLACE 'example_image_1.jpg' with a real filename!
+    predict_image(model, class_names, sample_image_path_1, show_plot)
+
+    # Example 2: Pick an image from 'skin changes'
+    # Find a real image file in 'C:/Users/Alfred/Desktop/sick pig database/category/skin changes/'
+    sample_image_path_2 = os.path.join(data_dir, 'skin changes', 'skin13.jpg') # <--- REPLACE 'example_image_2.jpg' with a real filename!
+    predict_image(model, class_names, sample_image_path_2, show_plot)
+
+    # Example 3: Pick an image from 'hernia'
+    # Find a real image file in 'C:/Users/Alfred/Desktop/sick pig database/category/hernia/'
+    sample_image_path_3 = os.path.join(data_dir, 'hernia', 'fig3.jpg') # <--- REPLACE 'example_image_3.jpg' with a real filename!
+    predict_image(model, class_names, sample_image_path_3, show_plot)
+
+    sample_image_path_4 = os.path.join(data_dir, 'cenker', 'centker6.jpg')
+    predict_image(model, class_names, sample_image_path_4, show_plot)
+
+    sample_image_path_5 = os.path.join(data_dir, 'skin chnages', 'skin6.jpg')
+    predict_image(model, class_names, sample_image_path_5, show_plot)
+
+    sample_image_path_6 = os.path.join(data_dir, 'Healthy', 'dave.jpg')
+    predict_image(model, class_names, sample_image_path_6, show_plot)
+
+    print("\n--- Prediction script finished. ---")
+    print("Remember to replace the 'example_image_X.jpg' placeholders with actual filenames from your dataset!")
 
-# Example 2: Pick an image from 'skin changes'
-# Find a real image file in 'C:/Users/Alfred/Desktop/sick pig database/category/skin changes/'
-sample_image_path_2 = os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER, 'skin changes', 'skin13.jpg') # <--- REPLACE 'example_image_2.jpg' with a real filename!
-predict_image(sample_image_path_2)
 
-# Example 3: Pick an image from 'hernia'
-# Find a real image file in 'C:/Users/Alfred/Desktop/sick pig database/category/hernia/'
-sample_image_path_3 = os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER, 'hernia', 'fig3.jpg') # <--- REPLACE 'example_image_3.jpg' with a real filename!
-predict_image(sample_image_path_3)
+def main():
+    parser = argparse.ArgumentParser(
+        description="Predict pig diseases. Without inputs, runs the example images; with inputs, "
+                    "scores every image in the given folders/globs/files headlessly.")
+    parser.add_argument('inputs', nargs='*', help="Image files, folders (searched recursively) or glob patterns")
+    parser.add_argument('--output', default='predictions.csv',
+                        help="Results file; .jsonl for JSON lines, anything else is CSV (default: %(default)s)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None, help="Override the output format")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=DECODE_WORKERS, help="Decode processes (default: CPU count)")
+    parser.add_argument('--plot', action='store_true', help="Batch mode: show a chart of predicted classes at the end")
+    parser.add_argument('--no-plot', action='store_true', help="Example mode: do not display each image")
+    args = parser.parse_args()
 
+    model = load_model()
+    class_names = load_class_names()
 
-sample_image_path_4 = os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER, 'cenker', 'centker6.jpg') 
-predict_image(sample_image_path_4)
+    if not args.inputs:
+        run_examples(model, class_names, show_plot=not args.no_plot)
+        return
 
-sample_image_path_5 = os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER, 'skin chnages', 'skin6.jpg')  
-predict_image(sample_image_path_5)
+    counts = run_batch(model, class_names, args.inputs, args.output, output_format=args.format,
+                       batch_size=args.batch_size, workers=args.workers)
+    if args.plot:
+        plot_class_counts(counts, class_names)
 
-sample_image_path_6 = os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER, 'Healthy', 'dave.jpg')  
-predict_image(sample_image_path_6)
 
-print("\n--- Prediction script finished. ---")
-print("Remember to replace the 'example_image_X.jpg' placeholders with actual filenames from your dataset!")
+if __name__ == "__main__":
+    main()
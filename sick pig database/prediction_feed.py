@@ -0,0 +1,147 @@
+import json
+import queue
+import re
+import threading
+
+DEFAULT_CAMERA_ID = 'default'
+_CAMERA_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+def normalize_camera_id(camera_id):
+    """Camera IDs end up in URLs and event payloads, so only simple names are accepted."""
+    if not camera_id:
+        return DEFAULT_CAMERA_ID
+    camera_id = camera_id.strip()
+    if not _CAMERA_ID_PATTERN.match(camera_id):
+        raise ValueError("camera_id may only contain letters, digits, '.', '_' and '-' (max 64 characters)")
+    return camera_id
+
+
+class PredictionFeed:
+    """
+    Thread-safe per-camera store of the latest prediction, plus fan-out of new
+    prediction events to Server-Sent Events subscribers.
+
+    Events carry a thumbnail URL instead of inline base64; the thumbnail itself is
+    kept here (as a LazyThumbnail) and served separately with an ETag, so clients only
+    download an image when it has actually changed.
+    """
+
+    def __init__(self, subscriber_queue_size=256):
+        self._lock = threading.Lock()
+        self._latest = {} # { camera_id: event_dict }
+        self._thumbnails = {} # { camera_id: (etag, LazyThumbnail) }
+        self._subscribers = set()
+        self._subscriber_queue_size = subscriber_queue_size
+        self._next_event_id = 1
+        self._latest_camera_id = None
+
+    # --- Writers ---
+    def publish(self, camera_id, prediction, confidence, timestamp, thumbnail=None, extra=None):
+        with self._lock:
+            event_id = self._next_event_id
+            self._next_event_id += 1
+            event = {
+                "id": event_id,
+                "camera_id": camera_id,
+                "prediction": prediction,
+                "confidence": f"{confidence:.2f}%",
+                "timestamp": timestamp,
+                "thumbnail_url": f"/thumbnail/{camera_id}?v={event_id}" if thumbnail is not None else None,
+            }
+            if extra:
+                event.update(extra)
+            self._latest[camera_id] = event
+            self._latest_camera_id = camera_id
+            if thumbnail is not None:
+                self._thumbnails[camera_id] = (f"{camera_id}-{event_id}", thumbnail)
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            self._offer(subscriber, event)
+        return event
+
+    @staticmethod
+    def _offer(subscriber, event):
+        # A slow dashboard must never block /predict: drop its oldest pending event instead.
+        try:
+            subscriber.put_nowait(event)
+        except queue.Full:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                pass
+
+    # --- Readers ---
+    def latest(self, camera_id=None):
+        """Latest event for one camera, or the most recent event from any camera."""
+        with self._lock:
+            if camera_id is None:
+                camera_id = self._latest_camera_id
+            event = self._latest.get(camera_id)
+            return dict(event) if event is not None else None
+
+    def snapshot(self):
+        with self._lock:
+            return {camera_id: dict(event) for camera_id, event in self._latest.items()}
+
+    def thumbnail(self, camera_id):
+        """Returns (etag, LazyThumbnail) for the camera, or (None, None)."""
+        with self._lock:
+            return self._thumbnails.get(camera_id, (None, None))
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    # --- Server-Sent Events ---
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self._subscriber_queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @staticmethod
+    def format_event(event):
+        return f"id: {event['id']}\nevent: prediction\ndata: {json.dumps(event)}\n\n"
+
+    def stream(self, camera_id=None, last_event_id=None, heartbeat_seconds=15.0):
+        """
+        Generator of SSE text. Starts with the current state of every camera newer than
+        last_event_id (so reconnecting clients catch up), then pushes events as they happen.
+        A comment line is sent every heartbeat_seconds to keep proxies from closing the stream.
+        """
+        subscriber = self.subscribe()
+        try:
+            # Subscribed before the snapshot, so events published in between may show up
+            # in both; anything at or below the newest replayed id is skipped later.
+            sent_up_to = last_event_id if last_event_id is not None else 0
+            for event in sorted(self.snapshot().values(), key=lambda e: e["id"]):
+                if camera_id is not None and event["camera_id"] != camera_id:
+                    continue
+                if event["id"] <= sent_up_to:
+                    continue
+                sent_up_to = event["id"]
+                yield self.format_event(event)
+
+            while True:
+                try:
+                    event = subscriber.get(timeout=heartbeat_seconds)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event["id"] <= sent_up_to:
+                    continue
+                if camera_id is not None and event["camera_id"] != camera_id:
+                    continue
+                yield self.format_event(event)
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,221 @@
+import datetime
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,            -- Unix time of the prediction
+    camera_id TEXT NOT NULL,
+    class_name TEXT NOT NULL,
+    confidence REAL NOT NULL,    -- 0..100, as shown to users
+    probabilities BLOB,          -- float32 vector in model output order
+    latency_ms REAL,             -- /predict time from request to response
+    image_ref TEXT,              -- thumbnail URL of the event (the newest one per camera stays servable)
+    event_id INTEGER,
+    cached INTEGER NOT NULL DEFAULT 0,
+    stage INTEGER
+);
+CREATE INDEX IF NOT EXISTS predictions_camera_ts ON predictions (camera_id, ts);
+CREATE INDEX IF NOT EXISTS predictions_ts_class ON predictions (ts, class_name);
+"""
+
+_INSERT = ("INSERT INTO predictions (ts, camera_id, class_name, confidence, probabilities, latency_ms, "
+           "image_ref, event_id, cached, stage) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+def parse_time(value):
+    """Accepts Unix seconds or an ISO date/time ('2024-05-01', '2024-05-01 13:00:00'); None stays None."""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def _iso(ts):
+    return datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class PredictionStore:
+    """
+    Append-only prediction history in SQLite (WAL mode).
+
+    /predict only puts a row on an in-memory queue; a background writer thread takes rows off
+    in batches (up to batch_size, or whatever arrived within flush_interval_seconds) and
+    inserts each batch in one transaction. When the queue is full, rows are dropped and counted
+    rather than making the request wait. Readers use their own connections, which WAL lets run
+    alongside the writer.
+    """
+
+    def __init__(self, db_path, batch_size=500, flush_interval_seconds=0.5, max_queue_size=20000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stats_lock = threading.Lock()
+        self._counts = {"queued": 0, "written": 0, "batches": 0, "dropped_queue_full": 0, "write_errors": 0}
+        self._local = threading.local()
+        self._running = False
+        self._worker = None
+
+    # --- Public API ---
+    def start(self):
+        if self._running:
+            return self
+        connection = self._connect()
+        connection.executescript(_SCHEMA)
+        connection.close()
+        self._running = True
+        self._worker = threading.Thread(target=self._run, name='prediction-store', daemon=True)
+        self._worker.start()
+        return self
+
+    def record(self, camera_id, class_name, confidence, probabilities=None, latency_ms=None,
+               image_ref=None, event_id=None, cached=False, stage=None, ts=None):
+        """Queues one prediction. Never blocks; returns False if the row had to be dropped."""
+        blob = np.asarray(probabilities, dtype=np.float32).tobytes() if probabilities is not None else None
+        row = (ts if ts is not None else time.time(), camera_id, class_name, float(confidence), blob,
+               latency_ms, image_ref, event_id, int(bool(cached)), stage)
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count("dropped_queue_full")
+            return False
+        self._count("queued")
+        return True
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            counts = dict(self._counts)
+        counts["queue_depth"] = self.queue_depth()
+        return counts
+
+    def close(self, timeout=None):
+        """Writes whatever is still queued, then stops the writer."""
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(None)
+        self._worker.join(timeout)
+
+    # --- Queries ---
+    def class_counts(self, bucket_seconds=3600, since=None, until=None, camera_id=None):
+        """
+        Number of predictions per class per time bucket:
+        [{"bucket_start": ..., "counts": {class: n}}], oldest bucket first.
+        """
+        bucket_seconds = max(int(bucket_seconds), 1)
+        where, params = self._time_filter(since, until, camera_id)
+        rows = self._reader().execute(
+            f"SELECT CAST(ts / ? AS INTEGER) AS bucket, class_name, COUNT(*) FROM predictions {where} "
+            f"GROUP BY bucket, class_name ORDER BY bucket", [bucket_seconds] + params).fetchall()
+        buckets = {}
+        for bucket, class_name, count in rows:
+            buckets.setdefault(bucket, {})[class_name] = count
+        return [{"bucket_start": _iso(bucket * bucket_seconds), "bucket_start_ts": bucket * bucket_seconds,
+                 "counts": counts} for bucket, counts in buckets.items()]
+
+    def recent(self, camera_id=None, limit=50, class_names=None):
+        """Newest `limit` predictions (of one camera, or of all), newest first."""
+        where, params = self._time_filter(None, None, camera_id)
+        rows = self._reader().execute(
+            f"SELECT id, ts, camera_id, class_name, confidence, probabilities, latency_ms, image_ref, event_id, "
+            f"cached, stage FROM predictions {where} ORDER BY ts DESC LIMIT ?", params + [int(limit)]).fetchall()
+        events = []
+        for row_id, ts, cam, class_name, confidence, blob, latency_ms, image_ref, event_id, cached, stage in rows:
+            event = {"id": row_id, "timestamp": _iso(ts), "ts": ts, "camera_id": cam, "prediction": class_name,
+                     "confidence": round(confidence, 2), "latency_ms": latency_ms, "image_ref": image_ref,
+                     "event_id": event_id, "cached": bool(cached), "stage": stage}
+            if blob is not None:
+                probabilities = np.frombuffer(blob, dtype=np.float32)
+                if class_names is not None and len(class_names) == len(probabilities):
+                    event["probabilities"] = {name: round(float(p), 6) for name, p in zip(class_names, probabilities)}
+                else:
+                    event["probabilities"] = [round(float(p), 6) for p in probabilities]
+            events.append(event)
+        return events
+
+    @staticmethod
+    def _time_filter(since, until, camera_id):
+        clauses, params = [], []
+        if camera_id is not None:
+            clauses.append("camera_id = ?")
+            params.append(camera_id)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    # --- Connections ---
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL") # WAL + NORMAL: durable on app crash, fsync per checkpoint
+        return connection
+
+    def _reader(self):
+        # One read connection per request thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    # --- Writer ---
+    def _run(self):
+        connection = self._connect()
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            rows = [first]
+            deadline = time.monotonic() + self.flush_interval_seconds
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    row = self._queue.get(timeout=remaining) if remaining > 0 and self._running \
+                        else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                rows.append(row)
+            try:
+                with connection:
+                    connection.executemany(_INSERT, rows)
+                self._count("written", len(rows))
+                self._count("batches")
+            except sqlite3.Error as e:
+                print(f"Prediction store: could not write {len(rows)} rows: {e}")
+                self._count("write_errors", len(rows))
+        # Drain anything queued after the stop sentinel was seen
+        leftover = []
+        while True:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not None:
+                leftover.append(row)
+        if leftover:
+            with connection:
+                connection.executemany(_INSERT, leftover)
+            self._count("written", len(leftover))
+        connection.close()
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._counts[key] += amount
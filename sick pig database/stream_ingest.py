@@ -0,0 +1,494 @@
+import argparse
+import collections
+import glob
+import json
+import os
+import re
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from image_pipeline import motion_thumbnail
+from prediction_feed import normalize_camera_id
+
+# --- Configuration ---
+# Camera list: a JSON file with [{"camera_id": "pen-01", "url": "http://192.168.1.50:81/stream"}, ...]
+# (or {"cameras": [...]}). http(s) URLs are read as MJPEG; rtsp:// URLs need OpenCV (pip install opencv-python).
+CAMERAS_PATH = 'C:/Users/Alfred/Desktop/sick pig database/cameras.json'
+READ_CHUNK_BYTES = 64 * 1024
+MAX_FRAME_BYTES = 4 * 1024 * 1024 # A part growing past this without ending means a broken stream: resync
+CONNECT_TIMEOUT_SECONDS = 10
+RECONNECT_BACKOFF_SECONDS = (1, 2, 5, 10, 30) # Waits between reconnect attempts, the last one repeats
+
+# --- Adaptive Sampling Configuration ---
+# Frames that arrive between motion checks are only parsed, never decoded. A motion check decodes a
+# 32x24 grayscale thumbnail and compares it with the previous one (mean absolute difference, 0-255).
+MOTION_THRESHOLD = 6.0 # Mean pixel change above this counts as motion
+MIN_SAMPLE_INTERVAL_SECONDS = 1.0 # A moving scene is sent for inference at most this often
+MAX_SAMPLE_INTERVAL_SECONDS = 60.0 # A static scene is still sent this often
+MIN_CHECK_INTERVAL_SECONDS = 0.2 # Motion checks while the scene moves...
+MAX_CHECK_INTERVAL_SECONDS = 2.0 # ...backing off to this on a static scene
+CHECK_BACKOFF = 1.5
+INFERENCE_WORKERS = 2 # Threads feeding sampled frames into the inference path (shared by all cameras)
+
+
+def load_cameras(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        cameras = json.load(f)
+    if isinstance(cameras, dict):
+        cameras = cameras.get('cameras', [])
+    return [{"camera_id": normalize_camera_id(camera['camera_id']), "url": camera['url']} for camera in cameras]
+
+
+# --- MJPEG Parsing ---
+_CONTENT_LENGTH = re.compile(rb'content-length:\s*(\d+)', re.IGNORECASE)
+
+
+class MJPEGParser:
+    """
+    Incremental parser for multipart/x-mixed-replace MJPEG streams. feed() takes whatever bytes
+    the socket returned and gives back the JPEG frames completed by them.
+
+    Parts with a Content-Length header (what the ESP32-CAM sends) are cut by length; parts
+    without one are cut at the next boundary. A stream of bare concatenated JPEGs is cut at the
+    end-of-image marker. Only the unfinished part stays buffered, consumed bytes are dropped
+    right away, and searches resume where the previous one stopped instead of rescanning.
+    """
+
+    def __init__(self, boundary=None, max_frame_bytes=MAX_FRAME_BYTES):
+        self.boundary = (b'--' + boundary.encode('latin1').lstrip(b'-')) if boundary else None
+        self.max_frame_bytes = max_frame_bytes
+        self._buffer = bytearray()
+        self._state = 'headers' # 'headers' -> 'body' (known length) or 'scan' (until the next boundary / EOI)
+        self._expected = 0
+        self._scan_from = 0
+        self.resyncs = 0
+
+    def feed(self, data):
+        self._buffer += data
+        frames = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            if frame:
+                frames.append(frame)
+        if len(self._buffer) > self.max_frame_bytes:
+            self._buffer.clear()
+            self._state, self._scan_from = 'headers', 0
+            self.resyncs += 1
+        return frames
+
+    def _next_frame(self):
+        buffer = self._buffer
+        if self._state == 'headers':
+            if buffer[:2] == b'\xff\xd8':
+                self._state, self._scan_from = 'scan', 2 # Bare JPEG, no multipart headers
+                return b''
+            end = buffer.find(b'\r\n\r\n', self._scan_from)
+            if end < 0:
+                self._scan_from = max(len(buffer) - 3, 0)
+                return None
+            headers = bytes(buffer[:end])
+            del buffer[:end + 4]
+            self._scan_from = 0
+            if self.boundary is None:
+                first_line = headers.lstrip(b'\r\n').split(b'\r\n', 1)[0].strip()
+                if first_line.startswith(b'--'):
+                    self.boundary = first_line
+            match = _CONTENT_LENGTH.search(headers)
+            if match:
+                self._state, self._expected = 'body', int(match.group(1))
+            else:
+                self._state = 'scan'
+            return b''
+
+        if self._state == 'body':
+            if len(buffer) < self._expected:
+                return None
+            frame = bytes(buffer[:self._expected])
+            del buffer[:self._expected]
+            self._state = 'headers'
+            return frame
+
+        # 'scan': the part ends at the next boundary line, or (bare JPEGs) at the EOI marker
+        marker = (b'\r\n' + self.boundary) if self.boundary is not None else b'\xff\xd9'
+        index = buffer.find(marker, self._scan_from)
+        if index < 0:
+            self._scan_from = max(len(buffer) - len(marker) + 1, 0)
+            return None
+        if self.boundary is not None:
+            frame = bytes(buffer[:index])
+            del buffer[:index + 2] # Keep the boundary line; it is read as the next part's headers
+        else:
+            frame = bytes(buffer[:index + 2])
+            del buffer[:index + 2]
+        self._state, self._scan_from = 'headers', 0
+        return frame
+
+
+# --- Adaptive Sampling ---
+class AdaptiveSampler:
+    """
+    Decides per camera which frames are worth a motion check and which go on to inference.
+    Motion checks happen every MIN..MAX_CHECK_INTERVAL seconds (backing off while the scene is
+    static, back to the minimum as soon as it moves). A checked frame is sampled when it moved
+    and MIN_SAMPLE_INTERVAL has passed, or when MAX_SAMPLE_INTERVAL has passed regardless.
+    """
+
+    def __init__(self, motion_threshold=MOTION_THRESHOLD, min_sample_interval=MIN_SAMPLE_INTERVAL_SECONDS,
+                 max_sample_interval=MAX_SAMPLE_INTERVAL_SECONDS, min_check_interval=MIN_CHECK_INTERVAL_SECONDS,
+                 max_check_interval=MAX_CHECK_INTERVAL_SECONDS, backoff=CHECK_BACKOFF):
+        self.motion_threshold = motion_threshold
+        self.min_sample_interval = min_sample_interval
+        self.max_sample_interval = max_sample_interval
+        self.min_check_interval = min_check_interval
+        self.max_check_interval = max_check_interval
+        self.backoff = backoff
+        self.check_interval = min_check_interval
+        self.last_motion = 0.0
+        self._last_check = None
+        self._last_sample = None
+        self._reference = None
+
+    def should_check(self, now):
+        return self._last_check is None or now - self._last_check >= self.check_interval
+
+    def update(self, thumbnail, now):
+        """Takes the motion thumbnail of a checked frame; returns True when the frame should be scored."""
+        self._last_check = now
+        if self._reference is None or self._reference.shape != thumbnail.shape:
+            motion = float('inf') # First frame (or a resolution change) always counts as new
+        else:
+            motion = float(np.mean(np.abs(thumbnail - self._reference)))
+        self._reference = thumbnail
+        self.last_motion = motion if motion != float('inf') else 0.0
+        moving = motion >= self.motion_threshold
+        self.check_interval = self.min_check_interval if moving else \
+            min(self.check_interval * self.backoff, self.max_check_interval)
+
+        since_sample = None if self._last_sample is None else now - self._last_sample
+        if since_sample is None or since_sample >= self.max_sample_interval or \
+                (moving and since_sample >= self.min_sample_interval):
+            self._last_sample = now
+            return True
+        return False
+
+
+# --- Sampled Frames Waiting for Inference ---
+class LatestFrameQueue:
+    """
+    At most one waiting frame per camera: a newer sample from the same camera replaces the older
+    one (counted as superseded), so a slow model never builds a backlog of stale frames and the
+    memory used is bounded by the number of cameras.
+    """
+
+    def __init__(self):
+        self._frames = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self.superseded = 0
+        self._closed = False
+
+    def put(self, camera_id, jpeg_bytes):
+        with self._condition:
+            if camera_id in self._frames:
+                self.superseded += 1
+            self._frames[camera_id] = jpeg_bytes # Keeps its place in line, carries the newest frame
+            self._condition.notify()
+
+    def get(self):
+        """(camera_id, jpeg_bytes) of the camera waiting longest; None once closed."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._frames or self._closed)
+            if not self._frames:
+                return None
+            return self._frames.popitem(last=False)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._frames)
+
+
+# --- One Camera ---
+class CameraStream:
+    """Reader thread for one camera: keeps the stream drained, samples frames, reconnects with backoff."""
+
+    def __init__(self, camera_id, url, frame_queue, sampler):
+        self.camera_id = camera_id
+        self.url = url
+        self.frame_queue = frame_queue
+        self.sampler = sampler
+        self._running = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counts = {"frames": 0, "checked": 0, "sampled": 0, "bytes": 0, "connects": 0, "errors": 0,
+                        "resyncs": 0}
+        self.last_error = None
+        self.connected = False
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f'stream-{self.camera_id}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        attempt = 0
+        while self._running:
+            try:
+                self._count("connects")
+                if self.url.lower().startswith('rtsp://'):
+                    self._read_rtsp()
+                else:
+                    self._read_mjpeg()
+                attempt = 0 # Stream ended cleanly (e.g. camera reboot): reconnect right away
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                self._count("errors")
+                wait = RECONNECT_BACKOFF_SECONDS[min(attempt, len(RECONNECT_BACKOFF_SECONDS) - 1)]
+                print(f"Stream '{self.camera_id}': {self.last_error}. Reconnecting in {wait} s.")
+                attempt += 1
+                time.sleep(wait)
+            finally:
+                self.connected = False
+
+    def _read_mjpeg(self):
+        with urllib.request.urlopen(self.url, timeout=CONNECT_TIMEOUT_SECONDS) as response:
+            parser = MJPEGParser(boundary=response.headers.get_param('boundary'))
+            self.connected = True
+            while self._running:
+                chunk = response.read1(READ_CHUNK_BYTES)
+                if not chunk:
+                    return
+                self._count("bytes", len(chunk))
+                resyncs = parser.resyncs
+                for jpeg_bytes in parser.feed(chunk):
+                    self.on_frame(jpeg_bytes, time.monotonic())
+                if parser.resyncs != resyncs:
+                    self._count("resyncs")
+
+    def _read_rtsp(self):
+        try:
+            import cv2
+        except ImportError:
+            raise RuntimeError("rtsp:// cameras need OpenCV (pip install opencv-python)")
+        capture = cv2.VideoCapture(self.url)
+        if not capture.isOpened():
+            raise ConnectionError(f"Could not open {self.url}")
+        self.connected = True
+        try:
+            while self._running:
+                # grab() keeps the stream drained; colour conversion (retrieve) only for checked frames
+                if not capture.grab():
+                    return
+                self._count("frames")
+                now = time.monotonic()
+                if not self.sampler.should_check(now):
+                    continue
+                ok, image = capture.retrieve()
+                if not ok:
+                    continue
+                ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+                if ok:
+                    self._check(encoded.tobytes(), now)
+        finally:
+            capture.release()
+
+    def on_frame(self, jpeg_bytes, now):
+        self._count("frames")
+        if self.sampler.should_check(now):
+            self._check(jpeg_bytes, now)
+
+    def _check(self, jpeg_bytes, now):
+        try:
+            thumbnail = motion_thumbnail(jpeg_bytes)
+        except Exception:
+            self._count("errors") # Truncated or corrupt frame: skip it, the next one will do
+            return
+        self._count("checked")
+        if self.sampler.update(thumbnail, now):
+            self._count("sampled")
+            self.frame_queue.put(self.camera_id, jpeg_bytes)
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._counts[key] += amount
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        counts.update({"url": self.url, "connected": self.connected, "last_error": self.last_error,
+                       "motion": round(self.sampler.last_motion, 2),
+                       "check_interval_s": round(self.sampler.check_interval, 2)})
+        return counts
+
+
+# --- All Cameras ---
+class StreamIngest:
+    """
+    Watches a list of cameras (one lightweight reader thread each) and hands sampled frames to
+    sink(camera_id, jpeg_bytes) on a small shared worker pool. Inside the server the sink is
+    inference_server.process_frame, so sampled frames take the same inference, history and
+    alert path as POSTed ones.
+    """
+
+    def __init__(self, cameras, sink, workers=INFERENCE_WORKERS, sampler_options=None):
+        self.sink = sink
+        self.frame_queue = LatestFrameQueue()
+        self.streams = [CameraStream(camera["camera_id"], camera["url"], self.frame_queue,
+                                     AdaptiveSampler(**(sampler_options or {}))) for camera in cameras]
+        self.workers = workers
+        self._threads = []
+        self._lock = threading.Lock()
+        self._counts = {"processed": 0, "sink_errors": 0}
+
+    def start(self):
+        for stream in self.streams:
+            stream.start()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'stream-inference-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"Stream ingest started for {len(self.streams)} cameras ({self.workers} inference workers).")
+        return self
+
+    def close(self):
+        for stream in self.streams:
+            stream.stop()
+        self.frame_queue.close()
+
+    def _work(self):
+        while True:
+            item = self.frame_queue.get()
+            if item is None:
+                return
+            camera_id, jpeg_bytes = item
+            try:
+                self.sink(camera_id, jpeg_bytes)
+                key = "processed"
+            except Exception as e:
+                print(f"Stream '{camera_id}': inference failed: {e}")
+                key = "sink_errors"
+            with self._lock:
+                self._counts[key] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        cameras = {stream.camera_id: stream.stats() for stream in self.streams}
+        frames = sum(camera["frames"] for camera in cameras.values())
+        sampled = sum(camera["sampled"] for camera in cameras.values())
+        counts.update({"cameras": cameras, "frames": frames, "sampled": sampled,
+                       "sample_rate": sampled / frames if frames else 0.0,
+                       "waiting": len(self.frame_queue), "superseded": self.frame_queue.superseded})
+        return counts
+
+
+def http_sink(predict_url):
+    """Sink that POSTs sampled frames to a running inference server instead of scoring in-process."""
+    def post(camera_id, jpeg_bytes):
+        request = urllib.request.Request(predict_url, data=jpeg_bytes, method='POST',
+                                         headers={"Content-Type": "image/jpeg", "X-Camera-Id": camera_id})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+    return post
+
+
+# --- Stand-in Camera Server (file-backed MJPEG, for testing without hardware) ---
+def serve_stand_in(frames_dir, port=8081, cameras=4, fps=10.0, hold_seconds=5.0):
+    """
+    Serves /stream/<n> for n in 0..cameras-1 as multipart MJPEG, like an ESP32-CAM. Each stream
+    repeats one image from frames_dir for hold_seconds (a static pen) and then moves on to the
+    next (motion). Streams start at different images so the cameras do not look alike.
+    """
+    paths = sorted(path for path in glob.glob(os.path.join(frames_dir, '**', '*'), recursive=True)
+                   if path.lower().endswith(('.jpg', '.jpeg')))
+    if not paths:
+        raise FileNotFoundError(f"No JPEG files under '{frames_dir}'.")
+    frames = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            frames.append(f.read())
+    boundary = 'pigcamframe'
+
+    class StreamHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = re.fullmatch(r'/stream/(\d+)', self.path)
+            if not match or int(match.group(1)) >= cameras:
+                self.send_error(404)
+                return
+            offset = int(match.group(1)) * 7
+            self.send_response(200)
+            self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={boundary}')
+            self.end_headers()
+            start = time.monotonic()
+            sent = 0
+            try:
+                while True:
+                    frame = frames[(offset + int((time.monotonic() - start) / hold_seconds)) % len(frames)]
+                    self.wfile.write(f"--{boundary}\r\nContent-Type: image/jpeg\r\n"
+                                     f"Content-Length: {len(frame)}\r\n\r\n".encode('ascii') + frame + b"\r\n")
+                    sent += 1
+                    time.sleep(max(start + sent / fps - time.monotonic(), 0))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), StreamHandler)
+    server.daemon_threads = True
+    print(f"Stand-in MJPEG server: {cameras} streams at http://127.0.0.1:{port}/stream/<0..{cameras - 1}> "
+          f"({fps} fps, new image every {hold_seconds} s, {len(frames)} images).")
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pull MJPEG/RTSP camera streams and score adaptively sampled frames.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    watch_parser = subparsers.add_parser('watch', help="Watch the cameras and POST sampled frames to the server")
+    watch_parser.add_argument('--cameras', default=CAMERAS_PATH)
+    watch_parser.add_argument('--post-to', default='http://127.0.0.1:5000/predict')
+    watch_parser.add_argument('--dry-run', action='store_true', help="Sample but do not send (to measure ingest cost)")
+    watch_parser.add_argument('--workers', type=int, default=INFERENCE_WORKERS)
+    watch_parser.add_argument('--report-every', type=float, default=10.0)
+
+    stand_in_parser = subparsers.add_parser('stand-in', help="Serve image files as MJPEG streams for testing")
+    stand_in_parser.add_argument('--frames-dir', required=True)
+    stand_in_parser.add_argument('--port', type=int, default=8081)
+    stand_in_parser.add_argument('--cameras', type=int, default=4)
+    stand_in_parser.add_argument('--fps', type=float, default=10.0)
+    stand_in_parser.add_argument('--hold', type=float, default=5.0, help="Seconds each image is repeated")
+    args = parser.parse_args()
+
+    if args.command == 'stand-in':
+        serve_stand_in(args.frames_dir, args.port, args.cameras, args.fps, args.hold)
+        return
+
+    sink = (lambda camera_id, jpeg_bytes: None) if args.dry_run else http_sink(args.post_to)
+    ingest = StreamIngest(load_cameras(args.cameras), sink, workers=args.workers).start()
+    start_cpu, start = time.process_time(), time.monotonic()
+    try:
+        while True:
+            time.sleep(args.report_every)
+            stats = ingest.stats()
+            elapsed = time.monotonic() - start
+            print(f"{stats['frames']} frames, {stats['sampled']} sampled ({stats['sample_rate']:.1%}), "
+                  f"{stats['processed']} scored, {stats['superseded']} superseded, "
+                  f"CPU {100.0 * (time.process_time() - start_cpu) / elapsed:.0f}% of one core")
+    except KeyboardInterrupt:
+        ingest.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+
+import numpy as np
+
+# --- Configuration ---
+DATASET_ROOT_PATH = 'C:/Users/Alfred/Desktop/sick pig database'
+DATA_SUBFOLDER = 'category'
+RESULTS_PATH = 'sweep_results.jsonl' # One JSON line per finished (config, fold) trial; read back to resume
+CHECKPOINT_DIR = 'sweep_checkpoints' # Best-epoch weights of every trial
+FEATURE_STORE_DIR = 'feature_store'
+FEATURE_VARIANTS = 4
+NUM_FOLDS = 5
+SEED = 0
+MAX_EPOCHS = 500 # Same ceiling as train_pig_detector.py; early stopping ends trials long before
+THREADS_PER_TRIAL = 2 # TF intra-op threads per worker; workers = cores // this
+
+# Hyperparameters of train_pig_detector.py that the sweep varies. A list is a set of choices
+# (grid search takes every combination); {"min", "max", "log"} is a range for random search.
+SEARCH_SPACE = {
+    "learning_rate": [0.0001, 0.0003, 0.001],
+    "batch_size": [16, 32, 64],
+    "head_units": [64, 128, 256],
+    "patience": [10, 20],
+}
+
+
+# --- Search Space ---
+def load_search_space(path):
+    if not path:
+        return SEARCH_SPACE
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def grid_configs(space):
+    keys = sorted(space)
+    for key in keys:
+        if not isinstance(space[key], list):
+            raise ValueError(f"Grid search needs a list of choices for '{key}', got {space[key]!r}.")
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+
+
+def random_configs(space, num_trials, seed=SEED):
+    """num_trials configs drawn from the space; the same seed always gives the same configs."""
+    rng = np.random.default_rng(seed)
+    configs = []
+    for _ in range(num_trials):
+        config = {}
+        for key in sorted(space):
+            spec = space[key]
+            if isinstance(spec, list):
+                config[key] = spec[int(rng.integers(len(spec)))]
+            elif spec.get("log"):
+                config[key] = float(math.exp(rng.uniform(math.log(spec["min"]), math.log(spec["max"]))))
+            else:
+                config[key] = float(rng.uniform(spec["min"], spec["max"]))
+            if not isinstance(spec, list) and isinstance(spec["min"], int) and isinstance(spec["max"], int):
+                config[key] = int(round(config[key]))
+        configs.append(config)
+    return configs
+
+
+def config_id(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+
+
+def trial_key(config, fold, settings):
+    """Identifies a trial across runs: same config, fold and split settings -> same key."""
+    payload = json.dumps({"config": config, "fold": fold, "settings": settings}, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+# --- Results File (append-only, so an interrupted sweep loses at most the running trials) ---
+def read_results(results_path):
+    results = []
+    if not os.path.exists(results_path):
+        return results
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass # Half-written last line of a killed run; that trial simply runs again
+    return results
+
+
+def append_result(results_path, result):
+    with open(results_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# --- Worker Processes ---
+_dataset = None # Set in each worker by _init_worker
+
+
+def _init_worker(dataset, intra_op_threads, inter_op_threads):
+    """
+    Runs once per worker process (spawned, so TensorFlow starts fresh in each): pins TF's
+    thread pools to this worker's share of the cores before any op runs.
+    """
+    global _dataset
+    for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[variable] = str(intra_op_threads)
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    _dataset = dict(dataset, intra_op_threads=intra_op_threads)
+
+
+def _fold_split(fold):
+    folds = np.asarray(_dataset["folds"])
+    return np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+
+
+def _fit_features(config, fold, callbacks):
+    """Head-only training on feature-store embeddings, as train_pig_detector.py --pipeline features."""
+    import tensorflow as tf
+    from feature_cache import FeatureStore, FEATURE_DIM
+    from train_pig_detector import build_head
+    train_rows, val_rows = _fold_split(fold)
+    labels = np.asarray(_dataset["labels"])
+    hashes = _dataset["hashes"]
+    num_classes = len(_dataset["class_names"])
+    num_variants = _dataset["feature_variants"]
+    store = FeatureStore(_dataset["feature_store"], num_variants=num_variants) # Read-only memmap here
+
+    train_x = store.lookup([hashes[row] for row in train_rows]).reshape(-1, FEATURE_DIM)
+    train_y = tf.keras.utils.to_categorical(np.repeat(labels[train_rows], 1 + num_variants), num_classes)
+    val_x = np.asarray(store.lookup([hashes[row] for row in val_rows], variants=False))
+    val_y = tf.keras.utils.to_categorical(labels[val_rows], num_classes)
+
+    model = build_head(num_classes, FEATURE_DIM, head_units=config["head_units"],
+                       learning_rate=config["learning_rate"])
+    history = model.fit(train_x, train_y, epochs=_dataset["max_epochs"], batch_size=config["batch_size"],
+                        shuffle=True, validation_data=(val_x, val_y), callbacks=callbacks, verbose=0)
+    return model, history, val_x, labels[val_rows]
+
+
+def _fit_images(config, fold, callbacks):
+    """Full-image training through the frozen backbone, as train_pig_detector.py --pipeline tfdata."""
+    import tensorflow as tf
+    from tfdata_pipeline import make_dataset
+    from train_pig_detector import build_model, IMAGE_SIZE
+    train_rows, val_rows = _fold_split(fold)
+    paths = _dataset["paths"]
+    labels = np.asarray(_dataset["labels"])
+    num_classes = len(_dataset["class_names"])
+    # tf.data has its own thread pool sized to the whole machine; keep it to this worker's share
+    options = tf.data.Options()
+    options.threading.private_threadpool_size = _dataset["intra_op_threads"]
+
+    def dataset(rows, training):
+        return make_dataset([paths[row] for row in rows], labels[rows].tolist(), num_classes, IMAGE_SIZE,
+                            config["batch_size"], training=training, seed=SEED).with_options(options)
+
+    model = build_model(num_classes, head_units=config["head_units"], learning_rate=config["learning_rate"])
+    history = model.fit(dataset(train_rows, True), epochs=_dataset["max_epochs"],
+                        validation_data=dataset(val_rows, False), callbacks=callbacks, verbose=0)
+    return model, history, dataset(val_rows, False), labels[val_rows]
+
+
+def run_trial(config, fold, key):
+    """One (config, fold) trial in a worker; returns the result line for the results file."""
+    import tensorflow as tf
+    start = time.time()
+    epoch_seconds = []
+    epoch_start = [0.0]
+    timer = tf.keras.callbacks.LambdaCallback(
+        on_epoch_begin=lambda epoch, logs: epoch_start.__setitem__(0, time.perf_counter()),
+        on_epoch_end=lambda epoch, logs: epoch_seconds.append(round(time.perf_counter() - epoch_start[0], 3)))
+    early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=config["patience"],
+                                                      restore_best_weights=True)
+    tf.keras.utils.set_random_seed(SEED + fold)
+    try:
+        fit = _fit_features if _dataset["pipeline"] == 'features' else _fit_images
+        model, history, val_inputs, val_labels = fit(config, fold, [early_stopping, timer])
+
+        # Metrics of the restored best epoch, including per-class recall (the tiny classes are the point)
+        predicted = np.argmax(model.predict(val_inputs, verbose=0), axis=1)
+        class_names = _dataset["class_names"]
+        recall = {}
+        for label, name in enumerate(class_names):
+            support = int(np.sum(val_labels == label))
+            recall[name] = float(np.mean(predicted[val_labels == label] == label)) if support else None
+        present = [value for value in recall.values() if value is not None]
+        val_losses = history.history["val_loss"]
+        best_epoch = int(np.argmin(val_losses))
+
+        checkpoint_path = os.path.join(_dataset["checkpoint_dir"], config_id(config), f"fold{fold}.weights.h5")
+        os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+        model.save_weights(checkpoint_path)
+        result = {"status": "ok",
+                  "val_loss": float(val_losses[best_epoch]),
+                  "val_accuracy": float(np.mean(predicted == val_labels)),
+                  "macro_recall": float(np.mean(present)) if present else None,
+                  "per_class_recall": recall,
+                  "best_epoch": best_epoch + 1,
+                  "epochs_run": len(val_losses),
+                  "epoch_seconds": epoch_seconds,
+                  "checkpoint": checkpoint_path}
+    except Exception as e:
+        result = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+    finally:
+        tf.keras.backend.clear_session() # Each worker runs many trials; drop the old graphs
+    return dict(result, key=key, config_id=config_id(config), config=config, fold=fold,
+                seconds=round(time.time() - start, 2), pid=os.getpid(), finished_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+
+
+# --- Sweep Driver ---
+def partition_threads(workers=None, threads_per_trial=None):
+    """
+    Splits the machine between trials: workers * intra-op threads ~= cores, one inter-op
+    thread each. A small Dense head gains little past a couple of threads, so many narrow
+    trials keep a 32-core box busier than one wide one.
+    """
+    cpus = os.cpu_count() or 1
+    if workers is None:
+        threads_per_trial = threads_per_trial or THREADS_PER_TRIAL
+        workers = max(1, cpus // threads_per_trial)
+    threads_per_trial = threads_per_trial or max(1, cpus // workers)
+    return workers, threads_per_trial
+
+
+def prepare_dataset(args):
+    """File list, content hashes, folds and (features pipeline) an up-to-date feature store, built once."""
+    from feature_cache import FeatureStore
+    data_dir = args.data_dir
+    if args.manifest:
+        from dataset_index import load_manifest
+        paths, labels, class_names = load_manifest(args.manifest, data_dir)
+    else:
+        from tfdata_pipeline import list_image_files
+        paths, labels, class_names = list_image_files(data_dir)
+    store = FeatureStore(args.feature_store, num_variants=args.feature_variants)
+    # Embedding happens here, once, in the parent; workers only read the memory-mapped store
+    hashes = store.update(paths) if args.pipeline == 'features' else store.hash_files(paths)
+
+    from tfdata_pipeline import stratified_k_fold
+    folds = stratified_k_fold(labels, args.folds, seed=args.seed, groups=hashes)
+    for label, name in enumerate(class_names):
+        count = labels.count(label)
+        if count < args.folds:
+            print(f"Warning: '{name}' has only {count} images, so some folds validate without it.")
+    return {"paths": paths, "labels": labels, "class_names": class_names, "hashes": hashes, "folds": folds,
+            "pipeline": args.pipeline, "feature_store": args.feature_store,
+            "feature_variants": args.feature_variants, "max_epochs": args.max_epochs,
+            "checkpoint_dir": args.checkpoint_dir}
+
+
+def summarize(results, top=10):
+    """Mean and spread over folds per config, best macro recall first (complete configs only)."""
+    by_config = {}
+    for result in results:
+        if result.get("status") == "ok":
+            by_config.setdefault(result["config_id"], []).append(result)
+    rows = []
+    for cid, trials in by_config.items():
+        folds = {trial["fold"] for trial in trials}
+        recalls = [trial["macro_recall"] for trial in trials if trial["macro_recall"] is not None]
+        rows.append({"config_id": cid, "config": trials[0]["config"], "folds": len(folds),
+                     "macro_recall": float(np.mean(recalls)) if recalls else 0.0,
+                     "macro_recall_std": float(np.std(recalls)) if recalls else 0.0,
+                     "val_accuracy": float(np.mean([trial["val_accuracy"] for trial in trials])),
+                     "val_loss": float(np.mean([trial["val_loss"] for trial in trials])),
+                     "mean_epoch_seconds": float(np.mean([np.mean(trial["epoch_seconds"]) for trial in trials])),
+                     "epochs_run": float(np.mean([trial["epochs_run"] for trial in trials]))})
+    rows.sort(key=lambda row: (-row["folds"], -row["macro_recall"], row["val_loss"]))
+    print(f"\n{'config':<11} {'folds':>5} {'macro rec':>10} {'+/-':>6} {'val acc':>8} {'val loss':>9} {'epochs':>7} {'s/epoch':>8}  params")
+    for row in rows[:top]:
+        params = ", ".join(f"{key}={value:.3g}" if isinstance(value, float) else f"{key}={value}"
+                           for key, value in sorted(row["config"].items()))
+        print(f"{row['config_id']:<11} {row['folds']:>5} {row['macro_recall']:>10.1%} {row['macro_recall_std']:>6.1%}"
+              f" {row['val_accuracy']:>8.1%} {row['val_loss']:>9.4f} {row['epochs_run']:>7.0f} "
+              f"{row['mean_epoch_seconds']:>8.3f}  {params}")
+    return rows
+
+
+def run_sweep(args):
+    space = load_search_space(args.space)
+    configs = grid_configs(space) if args.search == 'grid' else random_configs(space, args.trials, args.seed)
+    dataset = prepare_dataset(args)
+    settings = {"folds": args.folds, "seed": args.seed, "pipeline": args.pipeline, "max_epochs": args.max_epochs,
+                "feature_variants": args.feature_variants, "images": len(dataset["paths"])}
+
+    done = {result["key"] for result in read_results(args.results) if result.get("status") == "ok"}
+    tasks = [(config, fold, trial_key(config, fold, settings)) for config in configs for fold in range(args.folds)]
+    pending = [task for task in tasks if task[2] not in done]
+    workers, threads = partition_threads(args.workers, args.threads)
+    workers = min(workers, max(1, len(pending)))
+    print(f"{len(configs)} configs x {args.folds} folds = {len(tasks)} trials; {len(tasks) - len(pending)} already "
+          f"in '{args.results}', {len(pending)} to run on {workers} workers x {threads} threads.")
+
+    # Spawned workers: TensorFlow is not fork-safe, and Windows can only spawn anyway
+    context = multiprocessing.get_context('spawn')
+    start = time.time()
+    finished = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(dataset, threads, 1)) as executor:
+        futures = [executor.submit(run_trial, *task) for task in pending]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                append_result(args.results, result)
+                finished += 1
+                elapsed = time.time() - start
+                status = (f"macro recall {result['macro_recall']:.1%}, {result['epochs_run']} epochs"
+                          if result["status"] == "ok" else result["error"])
+                print(f"[{finished}/{len(pending)}] {result['config_id']} fold {result['fold']}: {status} "
+                      f"({result['seconds']:.0f} s; ETA {elapsed / finished * (len(pending) - finished):.0f} s)")
+        except KeyboardInterrupt:
+            print("Interrupted; finished trials are saved. Run the same command again to resume.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    summarize([result for result in read_results(args.results) if result.get("key") in {task[2] for task in tasks}])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="k-fold hyperparameter sweep for train_pig_detector.py on a process pool.")
+    parser.add_argument('--results', default=RESULTS_PATH, help="Results file (JSON lines); a rerun skips the trials already in it")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Run (or resume) a sweep")
+    run_parser.add_argument('--space', default=None, help="JSON search space (default: SEARCH_SPACE in this file)")
+    run_parser.add_argument('--search', choices=['grid', 'random'], default='grid')
+    run_parser.add_argument('--trials', type=int, default=20, help="random only: number of configs")
+    run_parser.add_argument('--folds', type=int, default=NUM_FOLDS)
+    run_parser.add_argument('--seed', type=int, default=SEED)
+    run_parser.add_argument('--pipeline', choices=['features', 'tfdata'], default='features',
+                            help="features: head on cached embeddings (fast); tfdata: full images, frozen backbone")
+    run_parser.add_argument('--data-dir', default=os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER))
+    run_parser.add_argument('--manifest', default=None, help="Take the file list from a dataset_index.py manifest")
+    run_parser.add_argument('--feature-store', default=FEATURE_STORE_DIR)
+    run_parser.add_argument('--feature-variants', type=int, default=FEATURE_VARIANTS)
+    run_parser.add_argument('--max-epochs', type=int, default=MAX_EPOCHS)
+    run_parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR)
+    run_parser.add_argument('--workers', type=int, default=None, help="Parallel trials (default: cores / --threads)")
+    run_parser.add_argument('--threads', type=int, default=None,
+                            help=f"TF intra-op threads per trial (default: {THREADS_PER_TRIAL}, or cores / --workers)")
+
+    summary_parser = subparsers.add_parser('summary', help="Rank the configs in a results file")
+    summary_parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run_sweep(args)
+    else:
+        summarize(read_results(args.results), top=args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import math
+import os
+
+import numpy as np
+import tensorflow as tf
+
+# --- Configuration ---
+# Unlike ImageDataGenerator (png/jpg/jpeg/bmp/ppm/tif/tiff only), this pipeline also reads
+# the .webp and .gif files scraped into category/.
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+# Same augmentation settings as the ImageDataGenerator in train_pig_detector.py
+AUGMENTATION = {
+    "rotation_range": 20, # degrees
+    "width_shift_range": 0.2, # fraction of width
+    "height_shift_range": 0.2, # fraction of height
+    "shear_range": 0.2, # degrees, as in ImageDataGenerator
+    "zoom_range": 0.2, # zoom factor drawn from [0.8, 1.2] per axis
+    "horizontal_flip": True,
+}
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+# --- 1. Listing and Splitting ---
+def list_image_files(data_dir, class_names=None):
+    """
+    Lists image files per class folder in the same order flow_from_directory uses
+    (classes by sorted folder name, files sorted within each folder).
+    Returns (paths, labels, class_names).
+    """
+    if class_names is None:
+        class_names = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    paths, labels = [], []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(data_dir, class_name)
+        for root, _, files in sorted(os.walk(class_dir), key=lambda entry: entry[0]):
+            for file_name in sorted(files):
+                if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, file_name))
+                    labels.append(label)
+    return paths, labels, class_names
+
+
+def split_train_validation(paths, labels, validation_split=0.2):
+    """
+    Deterministic split with the same rule as ImageDataGenerator(validation_split=...):
+    the first int(validation_split * n) files of each class (in sorted order) are validation.
+    """
+    train, validation = ([], []), ([], [])
+    for label in sorted(set(labels)):
+        class_paths = [path for path, path_label in zip(paths, labels) if path_label == label]
+        num_validation = int(validation_split * len(class_paths))
+        validation[0].extend(class_paths[:num_validation])
+        validation[1].extend([label] * num_validation)
+        train[0].extend(class_paths[num_validation:])
+        train[1].extend([label] * (len(class_paths) - num_validation))
+    return train, validation
+
+
+def stratified_k_fold(labels, num_folds, seed=0, groups=None):
+    """
+    Fold index (0 .. num_folds - 1) per sample, with every class spread as evenly as possible
+    over the folds. Samples sharing a group (e.g. a content hash) always land in the same fold,
+    so duplicate images cannot end up on both sides of a split. Shuffled with a fixed seed.
+    """
+    rng = np.random.default_rng(seed)
+    groups = list(range(len(labels))) if groups is None else list(groups)
+    members = {}
+    for index, group in enumerate(groups):
+        members.setdefault(group, []).append(index)
+    fold_of_group = {}
+    per_class = np.zeros((max(labels) + 1, num_folds), dtype=np.int64)
+    for label in sorted(set(labels)):
+        class_groups = list(dict.fromkeys(group for group, sample_label in zip(groups, labels) if sample_label == label))
+        for position in rng.permutation(len(class_groups)):
+            group = class_groups[position]
+            if group not in fold_of_group:
+                # Fewest images of this class so far; ties broken at random
+                counts = per_class[label]
+                fold_of_group[group] = int(rng.choice(np.flatnonzero(counts == counts.min())))
+            for index in members[group]:
+                if labels[index] == label:
+                    per_class[label, fold_of_group[group]] += 1
+    return [fold_of_group[group] for group in groups]
+
+
+# --- 2. Parallel Decode and Resize ---
+def _decode_webp_with_pil(contents):
+    import io
+    from PIL import Image
+    return np.asarray(Image.open(io.BytesIO(contents)).convert('RGB'), dtype=np.uint8)
+
+
+def decode_and_resize(path, image_size):
+    """Reads and decodes one image file to a uint8 (H, W, 3) tensor of image_size."""
+    contents = tf.io.read_file(path)
+    is_webp = tf.strings.regex_full_match(tf.strings.lower(path), r'.*\.webp')
+
+    def decode_webp():
+        if hasattr(tf.io, 'decode_webp'):
+            img = tf.io.decode_webp(contents, channels=3)
+            if img.shape.rank == 4: # (frames, H, W, C): keep the first frame, like GIFs below
+                img = img[0]
+        else: # Older TensorFlow: fall back to PIL for the handful of .webp files
+            img = tf.numpy_function(_decode_webp_with_pil, [contents], tf.uint8)
+        return tf.ensure_shape(img[..., :3], [None, None, 3])
+
+    def decode_other():
+        # expand_animations=False returns only the first frame of a GIF
+        return tf.ensure_shape(tf.io.decode_image(contents, channels=3, expand_animations=False), [None, None, 3])
+
+    img = tf.cond(is_webp, decode_webp, decode_other)
+    # Nearest-neighbour resize, like the keras load_img used by flow_from_directory
+    img = tf.image.resize(img, image_size, method='nearest')
+    return tf.cast(img, tf.uint8)
+
+
+# --- 3. Vectorized On-Graph Augmentation ---
+def random_affine_transforms(batch_size, height, width, rotation_range, width_shift_range,
+                             height_shift_range, shear_range, zoom_range, seed=None, generator=None):
+    """
+    Builds one projective transform per image, shape (batch, 8), with the same parameter
+    distributions and composition as ImageDataGenerator.apply_transform:
+    rotation . shift . shear . zoom around the image centre, mapping output to input pixels.
+    With a tf.random.Generator the draws come from it instead of the global random state.
+    """
+    def uniform(low, high, seed_offset):
+        if generator is not None:
+            return generator.uniform([batch_size], low, high)
+        op_seed = None if seed is None else seed + seed_offset
+        return tf.random.uniform([batch_size], low, high, seed=op_seed)
+
+    theta = uniform(-rotation_range, rotation_range, 1) * (math.pi / 180.0)
+    tx = uniform(-height_shift_range, height_shift_range, 2) * height # row shift
+    ty = uniform(-width_shift_range, width_shift_range, 3) * width # column shift
+    shear = uniform(-shear_range, shear_range, 4) * (math.pi / 180.0)
+    zx = uniform(1.0 - zoom_range, 1.0 + zoom_range, 5)
+    zy = uniform(1.0 - zoom_range, 1.0 + zoom_range, 6)
+
+    cos_t, sin_t = tf.cos(theta), tf.sin(theta)
+    cos_s, sin_s = tf.cos(shear), tf.sin(shear)
+
+    # Linear part of rotation . shear . zoom in (row, col) coordinates
+    l00 = cos_t * zx
+    l01 = (-cos_t * sin_s - sin_t * cos_s) * zy
+    l10 = sin_t * zx
+    l11 = (-sin_t * sin_s + cos_t * cos_s) * zy
+    # Rotated shift, then re-centred (transform_matrix_offset_center)
+    center_r = height / 2.0 - 0.5
+    center_c = width / 2.0 - 0.5
+    t0 = cos_t * tx - sin_t * ty + center_r - (l00 * center_r + l01 * center_c)
+    t1 = sin_t * tx + cos_t * ty + center_c - (l10 * center_r + l11 * center_c)
+
+    # ImageProjectiveTransform works in (x, y) = (col, row)
+    zeros = tf.zeros_like(theta)
+    return tf.stack([l11, l10, t1, l01, l00, t0, zeros, zeros], axis=1)
+
+
+def augment_batch(images, augmentation=AUGMENTATION, seed=None, generator=None):
+    """
+    Applies random affine transforms and flips to a whole float batch in one op each.
+    Op seeds alone do not repeat in eager mode (they also depend on TF's global op counter);
+    pass a tf.random.Generator built from a seed when the same augmentations must come back.
+    """
+    shape = tf.shape(images)
+    batch_size, height, width = shape[0], shape[1], shape[2]
+    transforms = random_affine_transforms(batch_size, tf.cast(height, tf.float32), tf.cast(width, tf.float32),
+                                          augmentation["rotation_range"], augmentation["width_shift_range"],
+                                          augmentation["height_shift_range"], augmentation["shear_range"],
+                                          augmentation["zoom_range"], seed=seed, generator=generator)
+    images = tf.raw_ops.ImageProjectiveTransformV3(
+        images=images, transforms=transforms, output_shape=tf.stack([height, width]),
+        fill_value=0.0, interpolation='BILINEAR', fill_mode='NEAREST')
+
+    if augmentation.get("horizontal_flip"):
+        if generator is not None:
+            flip = generator.uniform([batch_size]) < 0.5
+        else:
+            op_seed = None if seed is None else seed + 7
+            flip = tf.random.uniform([batch_size], seed=op_seed) < 0.5
+        images = tf.where(flip[:, None, None, None], tf.reverse(images, axis=[2]), images)
+    return images
+
+
+# --- 4. Dataset Assembly ---
+def make_dataset(paths, labels, num_classes, image_size, batch_size, training,
+                 cache_file=None, augmentation=AUGMENTATION, seed=None):
+    """
+    Decode/resize in parallel, cache the decoded uint8 images (in memory, or in cache_file
+    on disk), then shuffle, batch, augment on-graph, rescale to [0, 1] and prefetch.
+    """
+    dataset = tf.data.Dataset.from_tensor_slices((list(paths), list(labels)))
+    dataset = dataset.map(lambda path, label: (decode_and_resize(path, image_size),
+                                               tf.one_hot(label, num_classes)),
+                          num_parallel_calls=AUTOTUNE, deterministic=not training)
+    # Everything above runs once; later epochs read decoded 224x224 tensors from the cache.
+    dataset = dataset.cache(cache_file or '')
+    if training:
+        dataset = dataset.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+
+    def to_float(images, batch_labels):
+        return tf.cast(images, tf.float32) / 255.0, batch_labels
+
+    dataset = dataset.map(to_float, num_parallel_calls=AUTOTUNE)
+    if training and augmentation:
+        dataset = dataset.map(lambda images, batch_labels: (augment_batch(images, augmentation, seed), batch_labels),
+                              num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
+
+
+def build_datasets(data_dir, image_size=(224, 224), batch_size=32, validation_split=0.2,
+                   cache_dir=None, augmentation=AUGMENTATION, seed=None, files=None):
+    """
+    Train/validation tf.data pipelines equivalent to the ImageDataGenerator setup.
+    With cache_dir set, decoded images are cached to files there (reused across runs);
+    otherwise they are cached in memory after the first epoch.
+    files can be a ready (paths, labels, class_names) listing, e.g. from dataset_index.load_manifest,
+    in which case data_dir is not walked.
+    Returns (train_dataset, validation_dataset, info) where info has class_indices and counts.
+    """
+    paths, labels, class_names = files or list_image_files(data_dir)
+    (train_paths, train_labels), (val_paths, val_labels) = split_train_validation(paths, labels, validation_split)
+
+    train_cache = val_cache = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        # File count in the name so adding or removing images does not reuse a stale cache
+        suffix = f"{image_size[0]}x{image_size[1]}_split{validation_split}_{len(paths)}files"
+        train_cache = os.path.join(cache_dir, f"train_{suffix}.cache")
+        val_cache = os.path.join(cache_dir, f"validation_{suffix}.cache")
+
+    num_classes = len(class_names)
+    train_dataset = make_dataset(train_paths, train_labels, num_classes, image_size, batch_size,
+                                 training=True, cache_file=train_cache, augmentation=augmentation, seed=seed)
+    validation_dataset = make_dataset(val_paths, val_labels, num_classes, image_size, batch_size,
+                                      training=False, cache_file=val_cache)
+    info = {
+        "class_indices": {name: index for index, name in enumerate(class_names)},
+        "train_samples": len(train_paths),
+        "validation_samples": len(val_paths),
+    }
+    return train_dataset, validation_dataset, info
@@ -1,4 +1,8 @@
+import argparse
 import os
+import time
+import zlib
+import numpy as np
 
 # --- Configuration ---
 # Input path to your quantized TFLite model
@@ -10,60 +14,129 @@ HEADER_FILE_PATH = 'model_data.h'
 # Name of the C++ array variable that will hold the model data
 MODEL_VARIABLE_NAME = 'g_model_data'
 
-print("--- Starting TFLite to C++ Header Conversion ---")
-
-# --- 1. Read the TFLite model file ---
-try:
-    with open(TFLITE_MODEL_PATH, 'rb') as f:
-        tflite_model_content = f.read()
-    print(f"Successfully read TFLite model from: {TFLITE_MODEL_PATH}")
-except FileNotFoundError:
-    print(f"Error: TFLite model file not found at '{TFLITE_MODEL_PATH}'.")
-    print("Please ensure 'quantized_pig_detector.tflite' is in the same directory as this script.")
-    exit()
-except Exception as e:
-    print(f"Error reading TFLite model file: {e}")
-    exit()
-
-# --- 2. Format the content as a C++ byte array ---
-# Convert bytes to a comma-separated string of hex values
-hex_values = [f'0x{byte:02x}' for byte in tflite_model_content]
-model_data_string = ', '.join(hex_values)
-
-# --- 3. Create the C++ header file content ---
-header_content = f"""
+# TFLite Micro expects the model buffer to be 16-byte aligned
+ALIGNMENT = 16 # None to leave out alignas()
+
+# Optional placement of the array: PROGMEM (Arduino) and/or a linker section, e.g. '.rodata.model'
+USE_PROGMEM = False
+SECTION_NAME = None
+
+BYTES_PER_LINE = 16 # Every full line has the same width: 4 spaces + 16 * "0x00, "
+CHUNK_SIZE = 64 * 1024 # Bytes read and formatted at a time (multiple of BYTES_PER_LINE)
+
+# "0x00, " ... "0xff, " as a (256, 6) byte table, so formatting is a single NumPy lookup per chunk
+_HEX_TABLE = np.frombuffer(b''.join(b'0x%02x, ' % value for value in range(256)), dtype=np.uint8).reshape(256, 6)
+_INDENT = np.frombuffer(b'    ', dtype=np.uint8)
+
+
+def format_chunk(chunk):
+    """Formats bytes as C initializer lines (multiple of BYTES_PER_LINE bytes, except the last chunk)."""
+    values = np.frombuffer(chunk, dtype=np.uint8)
+    full_lines = len(values) // BYTES_PER_LINE
+    out = b''
+    if full_lines:
+        body = _HEX_TABLE[values[:full_lines * BYTES_PER_LINE]].reshape(full_lines, BYTES_PER_LINE * 6)
+        lines = np.concatenate([np.broadcast_to(_INDENT, (full_lines, 4)), body], axis=1)
+        lines[:, -1] = ord('\n') # "0xff, " -> "0xff,\n"
+        out = lines.tobytes()
+    rest = values[full_lines * BYTES_PER_LINE:]
+    if len(rest):
+        out += b'    ' + _HEX_TABLE[rest].tobytes()[:-1] + b'\n'
+    return out
+
+
+def declaration_attributes(alignment=ALIGNMENT, progmem=USE_PROGMEM, section=None):
+    prefix = f"alignas({alignment}) " if alignment else ""
+    suffix = ""
+    if section:
+        suffix += f' __attribute__((section("{section}")))'
+    if progmem:
+        suffix += " PROGMEM"
+    return prefix, suffix
+
+
+def write_header(tflite_path, header_path, variable_name=MODEL_VARIABLE_NAME, alignment=ALIGNMENT,
+                 progmem=USE_PROGMEM, section=SECTION_NAME, chunk_size=CHUNK_SIZE):
+    """
+    Streams the model into the header chunk by chunk, so memory use does not grow with the
+    model size. The CRC32 of the model is computed on the way and emitted as
+    <variable_name>_crc32, so the firmware can verify the flashed copy.
+    The header is written to a temporary file first and only replaces header_path when complete.
+    Returns (model size in bytes, crc32).
+    """
+    chunk_size -= chunk_size % BYTES_PER_LINE
+    prefix, suffix = declaration_attributes(alignment, progmem, section)
+    tmp_path = header_path + '.tmp'
+    crc = 0
+    size = 0
+    with open(tflite_path, 'rb') as model_file, open(tmp_path, 'wb') as header:
+        includes = "#include <cstdint> // For uint8_t\n"
+        if progmem:
+            includes += "#include <pgmspace.h> // For PROGMEM\n"
+        header.write(f"""
 // This file was automatically generated by tflite_to_header.py
 // It contains the binary data of your TensorFlow Lite model.
 
 #ifndef MODEL_DATA_H
 #define MODEL_DATA_H
 
-#include <cstdint> // For uint8_t
-
+{includes}
 // The TensorFlow Lite model data as a C++ byte array.
 // This model has been quantized for embedded deployment.
-const uint8_t {MODEL_VARIABLE_NAME}[] = {{
-    {model_data_string}
-}};
+{prefix}const uint8_t {variable_name}[]{suffix} = {{
+""".encode('ascii'))
+
+        for chunk in iter(lambda: model_file.read(chunk_size), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            header.write(format_chunk(chunk))
+
+        header.write(f"""}};
 
 // The size of the model data in bytes.
-const int {MODEL_VARIABLE_NAME}_len = {len(tflite_model_content)};
+const int {variable_name}_len = {size};
+
+// CRC32 (zlib/IEEE) of the model data, to check the copy in flash.
+const uint32_t {variable_name}_crc32 = 0x{crc:08x};
 
 #endif // MODEL_DATA_H
-"""
-
-# --- 4. Write the content to the header file ---
-try:
-    with open(HEADER_FILE_PATH, 'w') as f:
-        f.write(header_content)
-    print(f"Successfully created C++ header file: {HEADER_FILE_PATH}")
-    print(f"Model variable name: {MODEL_VARIABLE_NAME}")
-    print(f"Model data size: {len(tflite_model_content)} bytes ({len(tflite_model_content) / (1024*1024):.2f} MB)")
-except Exception as e:
-    print(f"Error writing header file: {e}")
-    exit()
-
-print("\n--- TFLite to C++ Header Conversion Complete ---")
-print(f"You can now include '{HEADER_FILE_PATH}' in your ESP32-CAM Arduino sketch.")
-print("The next step involves integrating TensorFlow Lite Micro library and inference code into your ESP32-CAM project.")
+""".encode('ascii'))
+    os.replace(tmp_path, header_path)
+    return size, crc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a .tflite model into a C++ header for the ESP32-CAM.")
+    parser.add_argument('--model', default=TFLITE_MODEL_PATH)
+    parser.add_argument('--output', default=HEADER_FILE_PATH)
+    parser.add_argument('--name', default=MODEL_VARIABLE_NAME, help="C++ array variable name")
+    parser.add_argument('--align', type=int, default=ALIGNMENT, help="alignas() value; 0 to leave it out")
+    parser.add_argument('--progmem', action='store_true', default=USE_PROGMEM, help="Mark the array PROGMEM")
+    parser.add_argument('--section', default=SECTION_NAME, help="Place the array in this linker section")
+    args = parser.parse_args()
+
+    print("--- Starting TFLite to C++ Header Conversion ---")
+    if not os.path.exists(args.model):
+        print(f"Error: TFLite model file not found at '{args.model}'.")
+        print("Please ensure 'quantized_pig_detector.tflite' is in the same directory as this script.")
+        exit()
+
+    start = time.perf_counter()
+    try:
+        size, crc = write_header(args.model, args.output, variable_name=args.name, alignment=args.align,
+                                 progmem=args.progmem, section=args.section)
+    except Exception as e:
+        print(f"Error writing header file: {e}")
+        exit()
+
+    print(f"Successfully created C++ header file: {args.output} in {time.perf_counter() - start:.2f} s")
+    print(f"Model variable name: {args.name}")
+    print(f"Model data size: {size} bytes ({size / (1024*1024):.2f} MB), CRC32 0x{crc:08x}")
+
+    print("\n--- TFLite to C++ Header Conversion Complete ---")
+    print(f"You can now include '{args.output}' in your ESP32-CAM Arduino sketch.")
+    print("The next step involves integrating TensorFlow Lite Micro library and inference code into your ESP32-CAM project.")
+
 
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
 import tensorflow as tf
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.layers import Dense, GlobalAveragePooling2D
+from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Input
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import EarlyStopping # Import EarlyStopping
+import argparse
 import os
 import matplotlib.pyplot as plt
 import numpy as np
+from class_labels import labels_path_for, save_labels
 
 # --- Configuration ---
 DATASET_ROOT_PATH = 'C:/Users/Alfred/Desktop/sick pig database'
@@ -18,114 +20,329 @@ BATCH_SIZE = 32
 # Number of epochs to train
 EPOCHS = 500 # Reasonably high number, but EarlyStopping will manage it
 LEARNING_RATE = 0.0001
+VALIDATION_SPLIT = 0.2
+
+# Input pipeline used to feed model.fit:
+# 'generator' -> ImageDataGenerator.flow_from_directory (decodes and augments every image again each epoch)
+# 'tfdata'    -> tf.data with parallel decode, caching of decoded images, on-graph augmentation and prefetch
+# 'features'  -> run the frozen backbone once per image (see feature_cache.py) and train only the head
+# The default stays 'generator'. The other two also read the .webp/.gif files that flow_from_directory
+# skips, so switching changes the train/validation split, not just the speed.
+INPUT_PIPELINE = 'generator'
+# Where the tf.data pipeline caches decoded images. None keeps them in memory instead.
+TFDATA_CACHE_DIR = None
+# 'features' mode: memory-mapped embedding store and number of augmented variants per image
+FEATURE_STORE_DIR = 'feature_store'
+FEATURE_VARIANTS = 4
+# Manifest written by dataset_index.py. When set, the tf.data and features pipelines take their
+# file list from it (undecodable files and exact duplicates left out) instead of walking the dataset.
+MANIFEST_PATH = None
+
 
 # --- 1. Data Loading and Augmentation ---
-print("--- Loading and Preprocessing Data ---")
-
-train_val_datagen = ImageDataGenerator(
-    rescale=1./255,
-    rotation_range=20,
-    width_shift_range=0.2,
-    height_shift_range=0.2,
-    shear_range=0.2,
-    zoom_range=0.2,
-    horizontal_flip=True,
-    fill_mode='nearest',
-    validation_split=0.2
-)
-
-train_generator = train_val_datagen.flow_from_directory(
-    os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER),
-    target_size=IMAGE_SIZE,
-    batch_size=BATCH_SIZE,
-    class_mode='categorical',
-    subset='training',
-    shuffle=True
-)
-
-validation_generator = train_val_datagen.flow_from_directory(
-    os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER),
-    target_size=IMAGE_SIZE,
-    batch_size=BATCH_SIZE,
-    class_mode='categorical',
-    subset='validation',
-    shuffle=False
-)
-
-NUM_CLASSES = len(train_generator.class_indices)
-print(f"Detected {NUM_CLASSES} classes: {list(train_generator.class_indices.keys())}")
-print(f"Found {train_generator.samples} training images belonging to {NUM_CLASSES} classes.")
-print(f"Found {validation_generator.samples} validation images belonging to {NUM_CLASSES} classes.")
+def load_generator_data(data_dir):
+    train_val_datagen = ImageDataGenerator(
+        rescale=1./255,
+        rotation_range=20,
+        width_shift_range=0.2,
+        height_shift_range=0.2,
+        shear_range=0.2,
+        zoom_range=0.2,
+        horizontal_flip=True,
+        fill_mode='nearest',
+        validation_split=VALIDATION_SPLIT
+    )
+
+    train_generator = train_val_datagen.flow_from_directory(
+        data_dir,
+        target_size=IMAGE_SIZE,
+        batch_size=BATCH_SIZE,
+        class_mode='categorical',
+        subset='training',
+        shuffle=True
+    )
+
+    validation_generator = train_val_datagen.flow_from_directory(
+        data_dir,
+        target_size=IMAGE_SIZE,
+        batch_size=BATCH_SIZE,
+        class_mode='categorical',
+        subset='validation',
+        shuffle=False
+    )
+
+    fit_kwargs = {
+        "steps_per_epoch": train_generator.samples // BATCH_SIZE,
+        "validation_steps": validation_generator.samples // BATCH_SIZE,
+    }
+    info = {
+        "class_indices": train_generator.class_indices,
+        "train_samples": train_generator.samples,
+        "validation_samples": validation_generator.samples,
+    }
+    return train_generator, validation_generator, fit_kwargs, info
+
+
+def load_tfdata_data(data_dir, cache_dir=None, files=None):
+    # Imported here so the generator path does not depend on tfdata_pipeline.py
+    from tfdata_pipeline import build_datasets
+    train_dataset, validation_dataset, info = build_datasets(
+        data_dir,
+        image_size=IMAGE_SIZE,
+        batch_size=BATCH_SIZE,
+        validation_split=VALIDATION_SPLIT,
+        cache_dir=cache_dir,
+        files=files
+    )
+    # A tf.data dataset knows its own length, so no steps_per_epoch is needed
+    return train_dataset, validation_dataset, {}, info
 
 
 # --- 2. Model Selection (Transfer Learning with MobileNetV2) ---
-print("\n--- Building Model with Transfer Learning ---")
+def build_model(num_classes, head_units=128, learning_rate=LEARNING_RATE):
+    base_model = MobileNetV2(weights='imagenet', include_top=False, input_shape=(IMAGE_SIZE[0], IMAGE_SIZE[1], 3))
+    base_model.trainable = False
+
+    x = base_model.output
+    x = GlobalAveragePooling2D()(x)
+    x = Dense(head_units, activation='relu')(x)
+    predictions = Dense(num_classes, activation='softmax')(x)
+
+    model = Model(inputs=base_model.input, outputs=predictions)
+
+    # --- 3. Compile the Model ---
+    model.compile(optimizer=Adam(learning_rate=learning_rate),
+                  loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+    return model
+
+
+# --- 2b. Head-Only Training from Precomputed Backbone Features ---
+def build_head(num_classes, feature_dim, head_units=128, learning_rate=LEARNING_RATE):
+    # Same Dense(128) -> Dense(NUM_CLASSES) head as build_model, fed with pooled features
+    features = Input(shape=(feature_dim,))
+    x = Dense(head_units, activation='relu')(features)
+    predictions = Dense(num_classes, activation='softmax')(x)
+    head = Model(inputs=features, outputs=predictions)
+    head.compile(optimizer=Adam(learning_rate=learning_rate),
+                 loss='categorical_crossentropy',
+                 metrics=['accuracy'])
+    return head
+
+
+def train_head_from_features(data_dir, store_dir=FEATURE_STORE_DIR, num_variants=FEATURE_VARIANTS,
+                             head_units=128, callbacks=None, files=None):
+    """
+    Frozen-backbone training without running the backbone every epoch: embeddings come from
+    the feature store (only new/changed images are embedded), the head trains on them, and the
+    trained head is then placed on top of the MobileNetV2 base to give the usual full model.
+    """
+    from feature_cache import FeatureStore, FEATURE_DIM
+    from tfdata_pipeline import list_image_files, split_train_validation
+
+    paths, labels, class_names = files or list_image_files(data_dir)
+    (train_paths, train_labels), (val_paths, val_labels) = split_train_validation(paths, labels, VALIDATION_SPLIT)
+    num_classes = len(class_names)
+
+    store = FeatureStore(store_dir, num_variants=num_variants, image_size=IMAGE_SIZE)
+    hash_by_path = dict(zip(paths, store.update(paths)))
+
+    # Training uses the plain embedding plus every augmented variant; validation only the plain one
+    train_x = store.lookup([hash_by_path[path] for path in train_paths]).reshape(-1, FEATURE_DIM)
+    train_y = tf.keras.utils.to_categorical(np.repeat(train_labels, 1 + num_variants), num_classes)
+    val_x = np.asarray(store.lookup([hash_by_path[path] for path in val_paths], variants=False))
+    val_y = tf.keras.utils.to_categorical(val_labels, num_classes)
+
+    head = build_head(num_classes, FEATURE_DIM, head_units=head_units)
+    history = head.fit(train_x, train_y,
+                       epochs=EPOCHS,
+                       batch_size=BATCH_SIZE,
+                       shuffle=True,
+                       validation_data=(val_x, val_y),
+                       callbacks=callbacks)
 
-base_model = MobileNetV2(weights='imagenet', include_top=False, input_shape=(IMAGE_SIZE[0], IMAGE_SIZE[1], 3))
-base_model.trainable = False
+    # Put the trained head on the backbone so the saved model is the same as in the other modes
+    model = build_model(num_classes, head_units=head_units)
+    model.layers[-2].set_weights(head.layers[-2].get_weights())
+    model.layers[-1].set_weights(head.layers[-1].get_weights())
 
-x = base_model.output
-x = GlobalAveragePooling2D()(x)
-x = Dense(128, activation='relu')(x)
-predictions = Dense(NUM_CLASSES, activation='softmax')(x)
+    info = {
+        "class_indices": {name: index for index, name in enumerate(class_names)},
+        "train_samples": len(train_paths),
+        "validation_samples": len(val_paths),
+    }
+    return model, history, info
 
-model = Model(inputs=base_model.input, outputs=predictions)
 
-# --- 3. Compile the Model ---
-print("\n--- Compiling Model ---")
-model.compile(optimizer=Adam(learning_rate=LEARNING_RATE),
-              loss='categorical_crossentropy',
-              metrics=['accuracy'])
+# --- 2c. Stage-One Healthy Pre-Filter (cascade mode of the inference server) ---
+def build_stage_one_model(image_size, alpha, learning_rate=LEARNING_RATE):
+    # Small MobileNetV2 at low resolution; two outputs in cascade.STAGE_ONE_CLASSES order
+    base_model = MobileNetV2(weights='imagenet', include_top=False, alpha=alpha,
+                             input_shape=(image_size[0], image_size[1], 3))
+    base_model.trainable = False
+    x = GlobalAveragePooling2D()(base_model.output)
+    predictions = Dense(2, activation='softmax')(x)
+    model = Model(inputs=base_model.input, outputs=predictions)
+    model.compile(optimizer=Adam(learning_rate=learning_rate),
+                  loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+    return model
 
-model.summary()
 
-# --- 4. Train the Model ---
-print("\n--- Starting Model Training ---")
+def train_stage_one(data_dir, callbacks=None, files=None):
+    """
+    Trains the healthy / not-healthy pre-filter. The split is made on the 8 classes exactly as
+    for the full model, so the cascade report's validation images are unseen by both stages.
+    Classes are weighted so the smaller side (Healthy) counts as much as all diseases together.
+    """
+    from cascade import HEALTHY_CLASS, STAGE_ONE_ALPHA, STAGE_ONE_CLASSES, STAGE_ONE_IMAGE_SIZE
+    from tfdata_pipeline import list_image_files, make_dataset, split_train_validation
 
-# Define Early Stopping callback
-# monitor='val_loss': Stop when validation loss stops improving
-# patience=10: Wait for 10 epochs of no improvement before stopping
-# restore_best_weights=True: After stopping, load the model weights from the epoch with the best monitored value (lowest val_loss)
-early_stopping = EarlyStopping(monitor='val_loss', patience=20, restore_best_weights=True, verbose=1)
+    paths, labels, class_names = files or list_image_files(data_dir)
+    (train_paths, train_labels), (val_paths, val_labels) = split_train_validation(paths, labels, VALIDATION_SPLIT)
+    healthy_index = class_names.index(HEALTHY_CLASS)
+    train_binary = [0 if label == healthy_index else 1 for label in train_labels]
+    val_binary = [0 if label == healthy_index else 1 for label in val_labels]
 
-history = model.fit(
-    train_generator,
-    epochs=EPOCHS,
-    validation_data=validation_generator,
-    steps_per_epoch=train_generator.samples // BATCH_SIZE,
-    validation_steps=validation_generator.samples // BATCH_SIZE,
-    callbacks=[early_stopping] # Add the callback here
-)
+    train_dataset = make_dataset(train_paths, train_binary, 2, STAGE_ONE_IMAGE_SIZE, BATCH_SIZE, training=True)
+    validation_dataset = make_dataset(val_paths, val_binary, 2, STAGE_ONE_IMAGE_SIZE, BATCH_SIZE, training=False)
+    counts = np.bincount(train_binary, minlength=2)
+    class_weight = {index: len(train_binary) / (2.0 * max(count, 1)) for index, count in enumerate(counts)}
+    print(f"Stage one: {counts[0]} healthy / {counts[1]} not healthy training images, class weights {class_weight}")
 
-print("\n--- Training Finished ---")
+    model = build_stage_one_model(STAGE_ONE_IMAGE_SIZE, STAGE_ONE_ALPHA)
+    history = model.fit(train_dataset,
+                        epochs=EPOCHS,
+                        validation_data=validation_dataset,
+                        class_weight=class_weight,
+                        callbacks=callbacks)
+    info = {
+        "class_indices": {name: index for index, name in enumerate(STAGE_ONE_CLASSES)},
+        "train_samples": len(train_paths),
+        "validation_samples": len(val_paths),
+    }
+    return model, history, info
 
-# --- 5. Save the Trained Model ---
-print("\n--- Saving Model ---")
-model_save_path = 'pig_disease_detector_model.h5'
-model.save(model_save_path)
-print(f"Model saved to: {model_save_path}")
 
 # --- 6. Plot Training History ---
-print("\n--- Plotting Training History ---")
-plt.figure(figsize=(12, 4))
-
-plt.subplot(1, 2, 1)
-plt.plot(history.history['accuracy'], label='Training Accuracy')
-plt.plot(history.history['val_accuracy'], label='Validation Accuracy')
-plt.title('Model Accuracy')
-plt.xlabel('Epoch')
-plt.ylabel('Accuracy')
-plt.legend()
-
-plt.subplot(1, 2, 2)
-plt.plot(history.history['loss'], label='Training Loss')
-plt.plot(history.history['val_loss'], label='Validation Loss')
-plt.title('Model Loss')
-plt.xlabel('Epoch')
-plt.ylabel('Loss')
-plt.legend()
-
-plt.tight_layout()
-plt.show()
-print("Training history plots displayed.")
- 
\ No newline at end of file
+def plot_history(history):
+    plt.figure(figsize=(12, 4))
+
+    plt.subplot(1, 2, 1)
+    plt.plot(history.history['accuracy'], label='Training Accuracy')
+    plt.plot(history.history['val_accuracy'], label='Validation Accuracy')
+    plt.title('Model Accuracy')
+    plt.xlabel('Epoch')
+    plt.ylabel('Accuracy')
+    plt.legend()
+
+    plt.subplot(1, 2, 2)
+    plt.plot(history.history['loss'], label='Training Loss')
+    plt.plot(history.history['val_loss'], label='Validation Loss')
+    plt.title('Model Loss')
+    plt.xlabel('Epoch')
+    plt.ylabel('Loss')
+    plt.legend()
+
+    plt.tight_layout()
+    plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the MobileNetV2 pig disease detector.")
+    parser.add_argument('--pipeline', choices=['generator', 'tfdata', 'features'], default=INPUT_PIPELINE,
+                        help="Input pipeline feeding model.fit (default: %(default)s)")
+    parser.add_argument('--cache-dir', default=TFDATA_CACHE_DIR,
+                        help="tf.data only: cache decoded images to files in this folder instead of memory")
+    parser.add_argument('--feature-store', default=FEATURE_STORE_DIR,
+                        help="features only: folder of the memory-mapped embedding store")
+    parser.add_argument('--feature-variants', type=int, default=FEATURE_VARIANTS,
+                        help="features only: augmented embeddings per image")
+    parser.add_argument('--manifest', default=MANIFEST_PATH,
+                        help="tf.data/features: take the file list from this dataset_index.py manifest")
+    parser.add_argument('--stage-one', action='store_true',
+                        help="Train the small healthy/not-healthy pre-filter for cascade mode instead")
+    args = parser.parse_args()
+    data_dir = os.path.join(DATASET_ROOT_PATH, DATA_SUBFOLDER)
+
+    # Define Early Stopping callback
+    # monitor='val_loss': Stop when validation loss stops improving
+    # patience=10: Wait for 10 epochs of no improvement before stopping
+    # restore_best_weights=True: After stopping, load the model weights from the epoch with the best monitored value (lowest val_loss)
+    early_stopping = EarlyStopping(monitor='val_loss', patience=20, restore_best_weights=True, verbose=1)
+
+    files = None
+    if args.manifest:
+        from dataset_index import load_manifest
+        files = load_manifest(args.manifest, data_dir)
+        print(f"Using {len(files[0])} images from manifest '{args.manifest}'.")
+        if args.pipeline == 'generator':
+            print("Warning: the generator pipeline walks the dataset itself; --manifest is ignored.")
+
+    if args.stage_one:
+        # --- Cascade Stage One: Healthy Pre-Filter ---
+        from cascade import STAGE_ONE_MODEL_PATH
+        print("--- Training Stage-One Healthy Pre-Filter ---")
+        model, history, info = train_stage_one(data_dir, callbacks=[early_stopping], files=files)
+        model.save(STAGE_ONE_MODEL_PATH)
+        print(f"Stage-one model saved to: {STAGE_ONE_MODEL_PATH} (outputs: {list(info['class_indices'])})")
+        plot_history(history)
+        return
+
+    if args.pipeline == 'features':
+        # --- 1-4. Embed (incrementally) and Train the Head Only ---
+        print("--- Training Head from Precomputed MobileNetV2 Features ---")
+        model, history, info = train_head_from_features(data_dir, store_dir=args.feature_store,
+                                                        num_variants=args.feature_variants,
+                                                        callbacks=[early_stopping], files=files)
+        print(f"Trained on {info['train_samples']} images, validated on {info['validation_samples']}.")
+    else:
+        # --- 1. Data Loading and Augmentation ---
+        print(f"--- Loading and Preprocessing Data ({args.pipeline} pipeline) ---")
+        if args.pipeline == 'tfdata':
+            train_data, validation_data, fit_kwargs, info = load_tfdata_data(data_dir, cache_dir=args.cache_dir, files=files)
+        else:
+            train_data, validation_data, fit_kwargs, info = load_generator_data(data_dir)
+
+        NUM_CLASSES = len(info["class_indices"])
+        print(f"Detected {NUM_CLASSES} classes: {list(info['class_indices'].keys())}")
+        print(f"Found {info['train_samples']} training images belonging to {NUM_CLASSES} classes.")
+        print(f"Found {info['validation_samples']} validation images belonging to {NUM_CLASSES} classes.")
+
+        # --- 2. Model Selection (Transfer Learning with MobileNetV2) ---
+        print("\n--- Building Model with Transfer Learning ---")
+        model = build_model(NUM_CLASSES)
+        model.summary()
+
+        # --- 4. Train the Model ---
+        print("\n--- Starting Model Training ---")
+        history = model.fit(
+            train_data,
+            epochs=EPOCHS,
+            validation_data=validation_data,
+            callbacks=[early_stopping], # Add the callback here
+            **fit_kwargs
+        )
+
+    print("\n--- Training Finished ---")
+
+    # --- 5. Save the Trained Model ---
+    print("\n--- Saving Model ---")
+    model_save_path = 'pig_disease_detector_model.h5'
+    model.save(model_save_path)
+    print(f"Model saved to: {model_save_path}")
+
+    # Save the class-index mapping next to the model so inference never has to scan the dataset
+    labels_save_path = labels_path_for(model_save_path)
+    save_labels(labels_save_path, info["class_indices"],
+                model_info={"architecture": "MobileNetV2", "input_size": list(IMAGE_SIZE), "model_formats": ["h5"]})
+    print(f"Class labels saved to: {labels_save_path}")
+
+    # --- 6. Plot Training History ---
+    print("\n--- Plotting Training History ---")
+    plot_history(history)
+    print("Training history plots displayed.")
+
+
+if __name__ == "__main__":
+    main()
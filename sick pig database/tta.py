@@ -0,0 +1,118 @@
+import collections
+import math
+import threading
+import time
+
+import numpy as np
+
+# --- Configuration ---
+IMAGE_SIZE = (224, 224)
+# Only predictions whose top confidence (in %) falls in this band get TTA; the alert threshold is 80%
+TTA_BAND = (65.0, 90.0)
+# (horizontal flip, zoom, rotation in degrees) per extra view; the original frame is always included.
+# Kept within the training augmentation ranges (rotation 20, zoom 0.2, horizontal flip).
+TTA_TRANSFORMS = (
+    (True, 1.0, 0.0),
+    (False, 1.1, 0.0), # centre crop to ~90%, resized back
+    (True, 1.1, 0.0),
+    (False, 1.0, 8.0),
+    (False, 1.0, -8.0),
+    (True, 1.0, 8.0),
+    (True, 1.0, -8.0),
+)
+LATENCY_WINDOW = 1000 # Recent TTA timings kept for the percentiles in stats()
+
+
+def build_index_maps(image_size, transforms):
+    """
+    Precomputes, for every transform, which source pixel each output pixel reads
+    (nearest neighbour, edges repeated like the training fill_mode='nearest').
+    Returns (rows, cols) int arrays of shape (len(transforms), H, W).
+    """
+    height, width = image_size[1], image_size[0]
+    y, x = np.meshgrid(np.arange(height, dtype=np.float32), np.arange(width, dtype=np.float32), indexing='ij')
+    cy, cx = (height - 1) / 2.0, (width - 1) / 2.0
+    rows, cols = [], []
+    for flip, zoom, degrees in transforms:
+        theta = math.radians(degrees)
+        dy, dx = (y - cy) / zoom, (x - cx) / zoom
+        src_y = cy + math.cos(theta) * dy - math.sin(theta) * dx
+        src_x = cx + math.sin(theta) * dy + math.cos(theta) * dx
+        if flip:
+            src_x = (width - 1) - src_x
+        rows.append(np.clip(np.rint(src_y), 0, height - 1).astype(np.intp))
+        cols.append(np.clip(np.rint(src_x), 0, width - 1).astype(np.intp))
+    return np.stack(rows), np.stack(cols)
+
+
+class TestTimeAugmenter:
+    """
+    Re-checks uncertain predictions with test-time augmentation.
+
+    When the top confidence of a frame lands inside `band`, the extra views are cut from the
+    preprocessed image with one NumPy gather (index maps are precomputed once), scored in one
+    batched call to predict_batch_fn, and averaged with the original prediction. Frames outside
+    the band pay nothing. stats() reports how often TTA fires, what it costs and how often it
+    changes the predicted class or the side of the alert threshold a frame falls on.
+    """
+
+    def __init__(self, predict_batch_fn, band=TTA_BAND, transforms=TTA_TRANSFORMS, image_size=IMAGE_SIZE,
+                 alert_threshold=80.0):
+        self.predict_batch_fn = predict_batch_fn
+        self.band = (float(band[0]), float(band[1]))
+        self.alert_threshold = alert_threshold
+        self.num_views = len(transforms) + 1 # Including the original image
+        self.batch_size = len(transforms) # Augmented views sent to predict_batch_fn per uncertain frame
+        self._rows, self._cols = build_index_maps(image_size, transforms)
+        self._lock = threading.Lock()
+        self._timings_ms = collections.deque(maxlen=LATENCY_WINDOW)
+        self._counts = {"frames": 0, "fired": 0, "class_changed": 0, "threshold_crossed": 0}
+
+    def variants(self, img_array):
+        """(num_transforms, H, W, 3) batch of augmented views of one (H, W, 3) image."""
+        return img_array[self._rows, self._cols]
+
+    def refine(self, img_array, probabilities, predict_batch_fn=None):
+        """
+        Returns (probabilities, fired). Averages over all views only when the frame is uncertain.
+        predict_batch_fn overrides the model for this one call (e.g. a leased model version).
+        """
+        probabilities = np.asarray(probabilities)
+        confidence = float(probabilities.max()) * 100
+        fired = self.band[0] <= confidence <= self.band[1]
+        if not fired:
+            self._count(fired=False)
+            return probabilities, False
+
+        start = time.perf_counter()
+        augmented = np.asarray((predict_batch_fn or self.predict_batch_fn)(self.variants(img_array)))
+        refined = (probabilities + augmented.sum(axis=0)) / self.num_views
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+
+        new_confidence = float(refined.max()) * 100
+        self._count(fired=True, elapsed_ms=elapsed_ms,
+                    class_changed=int(np.argmax(refined)) != int(np.argmax(probabilities)),
+                    threshold_crossed=(confidence >= self.alert_threshold) != (new_confidence >= self.alert_threshold))
+        return refined, True
+
+    def _count(self, fired, elapsed_ms=None, class_changed=False, threshold_crossed=False):
+        with self._lock:
+            self._counts["frames"] += 1
+            if fired:
+                self._counts["fired"] += 1
+                self._counts["class_changed"] += int(class_changed)
+                self._counts["threshold_crossed"] += int(threshold_crossed)
+                self._timings_ms.append(elapsed_ms)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            timings = np.array(self._timings_ms) if self._timings_ms else None
+        counts.update({
+            "band": list(self.band),
+            "views": self.num_views,
+            "fire_rate": counts["fired"] / counts["frames"] if counts["frames"] else 0.0,
+            "extra_latency_ms": {"mean": float(timings.mean()), "p50": float(np.percentile(timings, 50)),
+                                 "p95": float(np.percentile(timings, 95))} if timings is not None else None,
+        })
+        return counts